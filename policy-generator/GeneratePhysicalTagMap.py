@@ -5,11 +5,21 @@
 This script generates the Bro code for the function populate_physical_tag_map() which initializes the constant PHYSICAL_TAG_MAP.
 PHYSICAL_TAG_MAP is a table (hashmap) in which each physical_tag_t is referenced by a tuple (rtu_number_t,address_t).
 It is generated from the RTU configuration given in csv format.
+For many RTU configurations, one Bro module per RTU and an index loader (module T104_PhysicalTags) are generated in parallel.
+Only the modules of RTUs whose source csv files changed are regenerated (change detection with a manifest per output name).
+Alternatively (PHYSICAL_TAG_TABLE_ENABLED), PHYSICAL_TAG_MAP is written as data file for the input framework of Bro (table reader)
+together with a Bro script that loads and rereads it, so Bro startup does not depend on compiling assignment statements.
 '''
-
-import csv
+import glob
+import json
+import os
+import re
+import sys
+import time
+from multiprocessing import Pool, cpu_count
 
 from PolicyGeneratorConstants import *
+from RTUConfiguration import PhysicalTag, loadRTUConfiguration, getFileChecksum
 
 # Outside of git repository ("Workspace" is mountpoint for /data directory in docker container created from rf/broccoli-hilti)
 BRO_SCRIPT_PATH = "/home/rf/Daten/Masterarbeit/iec-104/policy-generator/generated-bro-scripts/"
@@ -21,18 +31,9 @@ ALPHA_RTU_CONFIG_INPUT_FILENAME = "../policy-generator/rtu-configs/Alpha_GlobalK
 MASTERTHESIS_RTU_CONFIG_INPUT_FILENAME = "../policy-generator/rtu-configs/Masterthesis_GlobalKnowledge_Normalized_RTU_Configuration.csv"
 RTU_CONFIG_FILES["Alpha"] = [ALPHA_RTU_CONFIG_INPUT_FILENAME]
 RTU_CONFIG_FILES["Masterthesis"] = [MASTERTHESIS_RTU_CONFIG_INPUT_FILENAME]
-
-
-class PhysicalTag:
-    def __init__(self, tagName, name, description, dimension, rtuNumber, addresses, lowerBound, upperBound):
-        self.tagName = tagName
-        self.name = name
-        self.description = description
-        self.dimension = dimension
-        self.rtuNumber = rtuNumber
-        self.addresses = addresses
-        self.lowerBound = lowerBound
-        self.upperBound = upperBound
+GENERATION_WORKERS = cpu_count()
+GENERATION_MANIFEST_TEMPLATE = "T104_PhysicalTags_%s.json"
+PHYSICAL_TAG_TABLE_ENABLED = True
 
 
 def parseRTUConfiguration(rtuConfigurationFilenames, createBroFile=False):
@@ -43,37 +44,14 @@ def parseRTUConfiguration(rtuConfigurationFilenames, createBroFile=False):
     :return: List of all tags and tag information (lines of RTU configuration)
     """
     broFileContent = BRO_SCRIPT_CONTENT_TRAILER
+    rtuTags = []
     for rtuConfig in rtuConfigurationFilenames:
-        rtuTags = []
-        with open(rtuConfig) as rtuConfigOutputs:
-            csvData = csv.DictReader(rtuConfigOutputs, delimiter=',')
-            for row in csvData:
-                givenAddresses = []
-                for addressType in ["Address", "IOA_M", "IOA_Mtt", "IOA_C"]:
-                    if addressType in row:
-                        try:
-                            givenAddresses.append(int(row[addressType]))
-                        except:
-                            pass
-                if row.has_key("LowerBound") and row["LowerBound"] and row.has_key("UpperBound") and row["UpperBound"]:
-                    lowerBound = float(row["LowerBound"])
-                    upperBound = float(row["UpperBound"])
-                else:
-                    lowerBound = 0.0
-                    upperBound = 0.0
-                if row.has_key("Description"):
-                    description = row["Description"]
-                elif row.has_key("IoDescription"):
-                    description = row["IoDescription"]
-                else:
-                    description = ""
-                dimensionText = row["DimensionText"] if row.has_key("DimensionText") else "Other"
-                currentTag = PhysicalTag(row["TagName"], row["Name"], description, dimensionText, row["RtuNo"],
-                                         givenAddresses, lowerBound, upperBound)
-                rtuTags.append(currentTag)
-
+        configTags = loadRTUConfiguration(rtuConfig).tags
+        rtuTags.extend(configTags)
+        if not createBroFile:
+            continue
         broFileContent += "\t\t#Rules generated from %s\n" % rtuConfig
-        for tag in rtuTags:
+        for tag in configTags:
             for address in tag.addresses:
                 broFileContent += BRO_FORMAT_STRING % (
                     tag.rtuNumber, address, tag.name, tag.description, tag.tagName, tag.dimension, tag.lowerBound,
@@ -104,11 +82,7 @@ def getTagDict(rtuConfigurationFilename):
     :param rtuConfigurationFilename: Path to RTU configuration
     :return: Dictionary with tagName as key
     """
-    rtuTags = parseRTUConfiguration([rtuConfigurationFilename], createBroFile=False)
-    pythonTagDict = dict()
-    for tag in rtuTags:
-        pythonTagDict[tag.tagName] = tag
-    return pythonTagDict
+    return dict(loadRTUConfiguration(rtuConfigurationFilename).tagsByName)
 
 
 def getTagNamesToIOA(rtuConfigurationFilename):
@@ -117,13 +91,252 @@ def getTagNamesToIOA(rtuConfigurationFilename):
     :param rtuConfigurationFilename: Path to RTU configuration
     :return: Dictionary with tagName as key
     """
-    rtuTags = parseRTUConfiguration([rtuConfigurationFilename], createBroFile=False)
-    pythonTagDict = dict()
-    for tag in rtuTags:
-        pythonTagDict[tag.tagName] = tag.addresses[0]
-    return pythonTagDict
+    return dict([(tag.tagName, tag.addresses[0]) for tag in loadRTUConfiguration(rtuConfigurationFilename).tags])
+
+
+def getRTUModuleName(name, rtuNumber):
+    """
+    Return the name of the Bro module of an RTU.
+    :param name: Name of generated configuration (e.g. "Masterthesis")
+    :param rtuNumber: RTU number
+    :return: Module name (also filename without extension)
+    """
+    return BRO_RTU_MODULE_NAME_TEMPLATE % (name, rtuNumber)
+
+
+def createRTUModuleContent(name, rtuNumber, rtuConfigurationFilenames):
+    """
+    Create the Bro module of an RTU (tags of all RTU configurations that contain the RTU).
+    :param name: Name of generated configuration
+    :param rtuNumber: RTU number
+    :param rtuConfigurationFilenames: Filenames of RTU configurations
+    :return: Content of bro script
+    """
+    broFileContent = BRO_RTU_SCRIPT_CONTENT_TRAILER % (rtuNumber, getRTUModuleName(name, rtuNumber))
+    for rtuConfig in rtuConfigurationFilenames:
+        rtuTags = loadRTUConfiguration(rtuConfig).getRtuTags(rtuNumber)
+        if not rtuTags:
+            continue
+        broFileContent += "\t\t#Rules generated from %s\n" % rtuConfig
+        for tag in rtuTags:
+            for address in tag.addresses:
+                broFileContent += BRO_RTU_FORMAT_STRING % (
+                    tag.rtuNumber, address, tag.name, tag.description, tag.tagName, tag.dimension, tag.lowerBound,
+                    tag.upperBound)
+        broFileContent += "\n"
+    return broFileContent + BRO_RTU_SCRIPT_CONTENT_FOOTER
+
+
+def createIndexContent(name, rtuNumbers):
+    """
+    Create the index loader which loads the modules of all RTUs and populates PHYSICAL_TAG_MAP.
+    :param name: Name of generated configuration
+    :param rtuNumbers: List of RTU numbers
+    :return: Content of bro script
+    """
+    moduleNames = [getRTUModuleName(name, rtuNumber) for rtuNumber in rtuNumbers]
+    broFileContent = BRO_INDEX_SCRIPT_CONTENT_TRAILER
+    for moduleName in moduleNames:
+        broFileContent += BRO_INDEX_LOAD_FORMAT_STRING % moduleName
+    broFileContent += BRO_INDEX_SCRIPT_CONTENT_EXPORT
+    for moduleName in moduleNames:
+        broFileContent += BRO_INDEX_POPULATE_FORMAT_STRING % moduleName
+    return broFileContent + BRO_SCRIPT_CONTENT_FOOTER
+
+
+def getSourceStatus(filename, previousStatus):
+    """
+    Check if an RTU configuration changed since the last generation (checksum is only calculated if modification time or size changed).
+    :param filename: Path to RTU configuration
+    :param previousStatus: Status of the last generation (dictionary of manifest) or None
+    :return: Tuple (True if changed, current status dictionary)
+    """
+    status = os.stat(filename)
+    if previousStatus and previousStatus["mtime"] == status.st_mtime and previousStatus["size"] == status.st_size:
+        return False, previousStatus
+    checksum = getFileChecksum(filename)
+    changed = not previousStatus or previousStatus["sha256"] != checksum
+    return changed, {"mtime": status.st_mtime, "size": status.st_size, "sha256": checksum,
+                     "rtus": previousStatus["rtus"] if previousStatus and not changed else None}
+
+
+def getSourceRtuNumbers(filename):
+    """
+    Parse an RTU configuration in a worker process (also fills the configuration cache).
+    :param filename: Path to RTU configuration
+    :return: Tuple (filename, list of RTU numbers)
+    """
+    return filename, loadRTUConfiguration(filename).getRtuNumbers()
+
+
+def writeRTUModule(task):
+    """
+    Write the Bro module of an RTU in a worker process.
+    :param task: (name, RTU number, filenames of RTU configurations, output path) tuple
+    :return: Path to bro script
+    """
+    name, rtuNumber, rtuConfigurationFilenames, path = task
+    filename = os.path.join(path, getRTUModuleName(name, rtuNumber) + ".bro")
+    writeFile(filename, createRTUModuleContent(name, rtuNumber, rtuConfigurationFilenames))
+    return filename
+
+
+def generatePhysicalTagModules(rtuConfigurationFilenames, name, path=BRO_SCRIPT_PATH, workers=GENERATION_WORKERS):
+    """
+    Generate one Bro module per RTU and the index loader (BRO_SCRIPT_FILENAME_TEMPLATE, module T104_PhysicalTags).
+    Only modules of RTUs in changed, added or removed RTU configurations (or missing modules) are written,
+    the index loader only if its content changed (e.g. RTUs were added or the table loader of the same name was generated before).
+    :param rtuConfigurationFilenames: Filenames of RTU configurations
+    :param name: Name of generated configuration (prefix of module names)
+    :param path: Output directory
+    :param workers: Number of worker processes (1: no worker processes)
+    :return: List of written bro scripts
+    """
+    manifestFilename = os.path.join(path, GENERATION_MANIFEST_TEMPLATE % name)
+    manifest = {"sources": {}, "rtus": []}
+    if os.path.exists(manifestFilename):
+        with open(manifestFilename) as manifestFile:
+            manifest = json.load(manifestFile)
+    sources = dict()
+    changedSources = []
+    for filename in rtuConfigurationFilenames:
+        changed, sources[filename] = getSourceStatus(filename, manifest["sources"].get(filename))
+        if changed or sources[filename]["rtus"] is None:
+            changedSources.append(filename)
+    removedSources = [filename for filename in manifest["sources"] if filename not in sources]
+    affectedRtuNumbers = set()
+    for filename in changedSources + removedSources:
+        affectedRtuNumbers.update(manifest["sources"].get(filename, {}).get("rtus") or [])
+
+    pool = Pool(min(workers, max(len(changedSources), 1))) if workers > 1 and changedSources else None
+    try:
+        for filename, rtuNumbers in (pool.map if pool else map)(getSourceRtuNumbers, changedSources):
+            sources[filename]["rtus"] = rtuNumbers
+            affectedRtuNumbers.update(rtuNumbers)
+        rtuSources = dict()
+        for filename in rtuConfigurationFilenames:
+            for rtuNumber in sources[filename]["rtus"]:
+                rtuSources.setdefault(rtuNumber, []).append(filename)
+        rtuNumbers = sorted(rtuSources)
+        for rtuNumber in rtuNumbers:
+            if not os.path.exists(os.path.join(path, getRTUModuleName(name, rtuNumber) + ".bro")):
+                affectedRtuNumbers.add(rtuNumber)
+        tasks = [(name, rtuNumber, rtuSources[rtuNumber], path) for rtuNumber in sorted(affectedRtuNumbers) if rtuNumber in rtuSources]
+        if pool is None and workers > 1 and len(tasks) > 1:
+            pool = Pool(min(workers, len(tasks)))
+        writtenFilenames = (pool.map if pool else map)(writeRTUModule, tasks)
+    finally:
+        if pool:
+            pool.close()
+            pool.join()
+
+    for rtuNumber in manifest["rtus"]:
+        staleFilename = os.path.join(path, getRTUModuleName(name, rtuNumber) + ".bro")
+        if rtuNumber not in rtuSources and os.path.exists(staleFilename):
+            os.remove(staleFilename)
+    indexFilename = os.path.join(path, BRO_SCRIPT_FILENAME_TEMPLATE % name)
+    if writeIfChanged(indexFilename, createIndexContent(name, rtuNumbers)):
+        writtenFilenames.append(indexFilename)
+    writeFile(manifestFilename, json.dumps({"sources": sources, "rtus": rtuNumbers}, indent=2, sort_keys=True))
+    return writtenFilenames
+
+
+def escapeTableField(value):
+    """
+    Escape a string field of the data file (no separators, empty strings as empty field).
+    :param value: String
+    :return: Escaped string
+    """
+    value = value.replace("\t", " ").replace("\n", " ").replace("\r", " ")
+    return value if value else BRO_TABLE_EMPTY_FIELD
+
+
+def createTableRows(rtuConfigurationFilename):
+    """
+    Create the rows of the data file of an RTU configuration (one row per address of a tag).
+    :param rtuConfigurationFilename: Path to RTU configuration
+    :return: Rows (string)
+    """
+    rows = []
+    for tag in loadRTUConfiguration(rtuConfigurationFilename).tags:
+        for address in tag.addresses:
+            rows.append(BRO_TABLE_FORMAT_STRING % (
+                tag.rtuNumber, address, escapeTableField(tag.tagName), escapeTableField(tag.name), escapeTableField(tag.description),
+                escapeTableField(tag.dimension), tag.lowerBound, tag.upperBound))
+    return "".join(rows)
+
+
+def writeFile(filename, content):
+    """
+    Replace a file atomically (readers never see a partially written file).
+    :param filename: Path to file
+    :param content: New content
+    """
+    temporaryFilename = "%s.%d" % (filename, os.getpid())
+    with open(temporaryFilename, "w") as f:
+        f.write(content)
+    os.rename(temporaryFilename, filename)
+
+
+def writeIfChanged(filename, content):
+    """
+    Replace a file atomically if its content changed.
+    :param filename: Path to file
+    :param content: New content
+    :return: True if the file was written
+    """
+    if os.path.exists(filename):
+        with open(filename) as f:
+            if f.read() == content:
+                return False
+    writeFile(filename, content)
+    return True
+
+
+def generatePhysicalTagTable(rtuConfigurationFilenames, name, path=BRO_SCRIPT_PATH, workers=GENERATION_WORKERS, dataFilename=None):
+    """
+    Generate the data file of PHYSICAL_TAG_MAP (input framework) and the Bro script which loads it (BRO_SCRIPT_FILENAME_TEMPLATE).
+    :param rtuConfigurationFilenames: Filenames of RTU configurations
+    :param name: Name of generated configuration
+    :param path: Output directory
+    :param workers: Number of worker processes (1: no worker processes)
+    :param dataFilename: Path of data file used by Bro (default: filename without directory, relative to working directory of Bro)
+    :return: List of written files
+    """
+    if workers > 1 and len(rtuConfigurationFilenames) > 1:
+        pool = Pool(min(workers, len(rtuConfigurationFilenames)))
+        try:
+            rows = pool.map(createTableRows, rtuConfigurationFilenames)
+        finally:
+            pool.close()
+            pool.join()
+    else:
+        rows = map(createTableRows, rtuConfigurationFilenames)
+    writtenFilenames = []
+    tableFilename = os.path.join(path, BRO_TABLE_DATA_FILENAME_TEMPLATE % name)
+    if writeIfChanged(tableFilename, BRO_TABLE_HEADER + "".join(rows)):
+        writtenFilenames.append(tableFilename)
+    scriptFilename = os.path.join(path, BRO_SCRIPT_FILENAME_TEMPLATE % name)
+    if writeIfChanged(scriptFilename, BRO_TABLE_SCRIPT_CONTENT % (dataFilename or os.path.basename(tableFilename))):
+        writtenFilenames.append(scriptFilename)
+    return writtenFilenames
 
 
 if __name__ == '__main__':
-    rtuTags = parseRTUConfiguration(RTU_CONFIG_FILES[RTU_CONFIG_TO_GENERATE], createBroFile=True)
+    # Usage: python GeneratePhysicalTagMap.py [name (key of RTU_CONFIG_FILES) or directory of RTU configurations] [output path] [workers] [table|modules]
+    name = sys.argv[1] if len(sys.argv) > 1 else RTU_CONFIG_TO_GENERATE
+    path = sys.argv[2] if len(sys.argv) > 2 else BRO_SCRIPT_PATH
+    workers = int(sys.argv[3]) if len(sys.argv) > 3 else GENERATION_WORKERS
+    tableEnabled = sys.argv[4] == "table" if len(sys.argv) > 4 else PHYSICAL_TAG_TABLE_ENABLED
+    if os.path.isdir(name):
+        rtuConfigurationFilenames = sorted(glob.glob(os.path.join(name, "*.csv")))
+        name = re.sub("[^A-Za-z0-9_]", "_", os.path.basename(os.path.normpath(name)))
+    else:
+        rtuConfigurationFilenames = RTU_CONFIG_FILES[name]
+    start = time.time()
+    if tableEnabled:
+        writtenFilenames = generatePhysicalTagTable(rtuConfigurationFilenames, name, path, workers)
+    else:
+        writtenFilenames = generatePhysicalTagModules(rtuConfigurationFilenames, name, path, workers)
+    print "Wrote %d Bro files in %.2fs." % (len(writtenFilenames), time.time() - start)
     print "Finished."
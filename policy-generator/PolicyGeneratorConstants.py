@@ -29,3 +29,91 @@ event bro_init(){
 	populate_physical_tag_map();
 }
 """
+
+# Per-RTU modules: one module per RTU populates the map given by the index loader (module T104_PhysicalTags)
+BRO_RTU_MODULE_NAME_TEMPLATE = "T104_PhysicalTags_%s_RTU%d"
+BRO_RTU_FORMAT_STRING = '\t\tphysical_tag_map[%s,%d]=[$name="%s", $description="%s", $tagName="%s", $dimension="%s", $normalizationInterval=[$min=%f, $max=%f]];\n'
+BRO_RTU_SCRIPT_CONTENT_TRAILER = """# This Bro script is automatically generated and contains the config of RTU %d for PHYSICAL_TAG_MAP.
+# The values are extracted from the RTU configuration.
+
+@load T104_DataTypes
+
+module %s;
+
+export
+{
+	function populate_physical_tag_map(physical_tag_map : T104_DataTypes::physical_tag_map_t)
+	{
+"""
+BRO_RTU_SCRIPT_CONTENT_FOOTER = """  } 
+}
+"""
+BRO_INDEX_SCRIPT_CONTENT_TRAILER = """# This Bro script is automatically generated and loads the RTU's configs (one module per RTU) into PHYSICAL_TAG_MAP.
+
+@load T104_DataTypes
+"""
+BRO_INDEX_LOAD_FORMAT_STRING = "@load %s\n"
+BRO_INDEX_SCRIPT_CONTENT_EXPORT = """
+module T104_PhysicalTags;
+
+export
+{
+	global PHYSICAL_TAG_MAP : T104_DataTypes::physical_tag_map_t;
+
+	function populate_physical_tag_map()
+	{
+"""
+BRO_INDEX_POPULATE_FORMAT_STRING = "\t\t%s::populate_physical_tag_map(PHYSICAL_TAG_MAP);\n"
+
+# Data file of PHYSICAL_TAG_MAP for the input framework (table reader) and the Bro glue which loads (and rereads) it
+BRO_TABLE_DATA_FILENAME_TEMPLATE = "T104_PhysicalTags_%s.tsv"
+BRO_TABLE_EMPTY_FIELD = "(empty)"
+BRO_TABLE_HEADER = """#separator \\x09
+#set_separator\t,
+#empty_field\t(empty)
+#unset_field\t-
+#fields\trtuNo\taddress\ttagName\tname\tdescription\tdimension\tnormalizationInterval.min\tnormalizationInterval.max
+#types\tcount\tcount\tstring\tstring\tstring\tstring\tdouble\tdouble
+"""
+BRO_TABLE_FORMAT_STRING = "%s\t%d\t%s\t%s\t%s\t%s\t%f\t%f\n"
+BRO_TABLE_SCRIPT_CONTENT = """# This Bro script is automatically generated and loads the RTU's config into PHYSICAL_TAG_MAP with the input framework.
+# The data file is reread when it changes, so RTU configurations can be updated without restarting Bro.
+
+@load T104_DataTypes
+
+module T104_PhysicalTags;
+
+export
+{
+	global PHYSICAL_TAG_MAP : T104_DataTypes::physical_tag_map_t;
+
+	# Data file generated by the policy generator (tab separated)
+	const PHYSICAL_TAG_MAP_FILE = "%s" &redef;
+	# Reread data file if it changes
+	const PHYSICAL_TAG_MAP_REREAD = T &redef;
+
+	type physical_tag_index_t: record {
+		rtuNo : T104_DataTypes::rtu_number_t;
+		address : T104_DataTypes::address_t;
+	};
+}
+
+global physical_tag_map_loaded = F;
+
+# Initialization code
+event bro_init(){
+	# The input framework fills PHYSICAL_TAG_MAP asynchronously: hold back packet processing until the data file is read,
+	# otherwise lookups of early events (and of all events when reading a trace file) fail.
+	suspend_processing();
+	Input::add_table([$source=PHYSICAL_TAG_MAP_FILE, $name="T104_PhysicalTags", $idx=physical_tag_index_t, $val=T104_DataTypes::physical_tag_t,
+	                  $destination=PHYSICAL_TAG_MAP, $mode=PHYSICAL_TAG_MAP_REREAD ? Input::REREAD : Input::MANUAL]);
+}
+
+event Input::end_of_data(name: string, source: string){
+	if ( name == "T104_PhysicalTags" && ! physical_tag_map_loaded )
+		{
+		physical_tag_map_loaded = T;
+		continue_processing();
+		}
+}
+"""
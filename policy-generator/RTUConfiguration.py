@@ -0,0 +1,272 @@
+#!/usr/bin/python
+# -*- coding: utf-8 -*-
+'''
+
+RTU configuration model shared by the policy generator, the traffic generator and the state manager.
+An RTU configuration (csv format) is parsed once into PhysicalTag objects with indexes by tag name, RTU, (RTU, IOA) address
+and (RTU, command address). Parsed configurations are kept in memory and cached in a binary file (marshal of plain tag tuples,
+in a private directory of the user) that is reused as long as modification time and size, or the checksum, of the csv file are unchanged.
+'''
+import csv
+import hashlib
+import marshal
+import os
+import stat
+import tempfile
+
+RTU_ADDRESS_TYPES = ["Address", "IOA_M", "IOA_Mtt", "IOA_C"]
+RTU_COMMAND_ADDRESS_TYPE = "IOA_C"
+RTU_CONFIGURATION_CACHE_ENABLED = True
+RTU_CONFIGURATION_CACHE_PATH = os.path.join(tempfile.gettempdir(), "rtu-configuration-cache-%d" % os.getuid())
+RTU_CONFIGURATION_CACHE_VERSION = 2
+loadedConfigurations = dict()
+
+
+class PhysicalTag:
+    def __init__(self, tagName, name, description, dimension, rtuNumber, addresses, lowerBound, upperBound, commandAddress=None):
+        self.tagName = tagName
+        self.name = name
+        self.description = description
+        self.dimension = dimension
+        self.rtuNumber = rtuNumber
+        self.addresses = addresses
+        self.lowerBound = lowerBound
+        self.upperBound = upperBound
+        self.commandAddress = commandAddress
+
+
+def parsePhysicalTag(row):
+    """
+    Create the physical tag of a line of an RTU configuration.
+    :param row: Line of RTU configuration (dictionary of csv.DictReader)
+    :return: PhysicalTag object and normalization interval (tuple or None if not given)
+    """
+    givenAddresses = []
+    for addressType in RTU_ADDRESS_TYPES:
+        if addressType in row:
+            try:
+                givenAddresses.append(int(row[addressType]))
+            except:
+                pass
+    if row.get("LowerBound") and row.get("UpperBound"):
+        interval = (float(row["LowerBound"]), float(row["UpperBound"]))
+    else:
+        interval = None
+    lowerBound, upperBound = interval or (0.0, 0.0)
+    if row.has_key("Description"):
+        description = row["Description"]
+    elif row.has_key("IoDescription"):
+        description = row["IoDescription"]
+    else:
+        description = ""
+    dimensionText = row["DimensionText"] if row.has_key("DimensionText") else "Other"
+    try:
+        commandAddress = int(row[RTU_COMMAND_ADDRESS_TYPE])
+    except:
+        commandAddress = None
+    tag = PhysicalTag(row["TagName"], row["Name"], description, dimensionText, row["RtuNo"], givenAddresses, lowerBound, upperBound,
+                      commandAddress)
+    return tag, interval
+
+
+class RTUConfiguration():
+    def __init__(self, filename, tags=None):
+        """
+        Parse an RTU configuration (or restore it from tag tuples) and build its indexes.
+        :param filename: Path to RTU configuration (csv format)
+        :param tags: List of tag tuples (see getTagTuples), the csv file is parsed if not given
+        """
+        self.filename = filename
+        self.tags = []
+        self.tagsByName = dict()
+        self.tagsByAddress = dict()
+        self.tagsByCommandAddress = dict()
+        self.tagsByRtu = dict()
+        self.intervals = dict()
+        if tags is not None:
+            for values in tags:
+                interval = tuple(values[-1]) if values[-1] else None
+                self.addTag(PhysicalTag(*values[:-1]), interval)
+            return
+        with open(filename) as rtuConfig:
+            for row in csv.DictReader(rtuConfig, delimiter=','):
+                tag, interval = parsePhysicalTag(row)
+                self.addTag(tag, interval)
+
+    def __getstate__(self):
+        """
+        Return the pickled state: tags as plain tuples, the indexes are rebuilt on unpickling (much faster than pickling objects).
+        :return: Tuple (filename, list of tag tuples)
+        """
+        return self.filename, self.getTagTuples()
+
+    def __setstate__(self, state):
+        """
+        Restore a pickled configuration and rebuild its indexes.
+        :param state: Tuple (filename, list of tag tuples)
+        """
+        self.__init__(*state)
+
+    def getTagTuples(self):
+        """
+        Return the tags as plain tuples (only built-in types, used for pickling and the cache file).
+        :return: List of tag tuples (PhysicalTag arguments and normalization interval)
+        """
+        return [(tag.tagName, tag.name, tag.description, tag.dimension, tag.rtuNumber, tag.addresses, tag.lowerBound, tag.upperBound,
+                 tag.commandAddress, self.intervals.get(tag.tagName)) for tag in self.tags]
+
+    def addTag(self, tag, interval=None):
+        """
+        Add a physical tag to the configuration and its indexes.
+        :param tag: PhysicalTag object
+        :param interval: Normalization interval (lower bound, upper bound) or None if not given
+        """
+        rtuNumber = int(tag.rtuNumber)
+        self.tags.append(tag)
+        self.tagsByName[tag.tagName] = tag
+        self.tagsByRtu.setdefault(rtuNumber, []).append(tag)
+        for address in tag.addresses:
+            self.tagsByAddress[(rtuNumber, address)] = tag
+        if tag.commandAddress is not None:
+            self.tagsByCommandAddress[(rtuNumber, tag.commandAddress)] = tag
+        if interval:
+            self.intervals[tag.tagName] = interval
+
+    def getTag(self, tagName):
+        """
+        Return the physical tag of a tag name.
+        :param tagName: Tag name
+        :return: PhysicalTag object or None if the tag is unknown
+        """
+        return self.tagsByName.get(tagName)
+
+    def getTagByAddress(self, rtuNumber, address):
+        """
+        Return the physical tag of an information object address (any address type).
+        :param rtuNumber: RTU number
+        :param address: Information object address
+        :return: PhysicalTag object or None if the address is unknown
+        """
+        return self.tagsByAddress.get((rtuNumber, address))
+
+    def getTagByCommandAddress(self, rtuNumber, address):
+        """
+        Return the physical tag of a command address.
+        :param rtuNumber: RTU number
+        :param address: Information object address of commands (IOA_C)
+        :return: PhysicalTag object or None if the address is unknown
+        """
+        return self.tagsByCommandAddress.get((rtuNumber, address))
+
+    def getRtuTags(self, rtuNumber):
+        """
+        Return the physical tags of an RTU.
+        :param rtuNumber: RTU number
+        :return: List of PhysicalTag objects in order of the configuration
+        """
+        return self.tagsByRtu.get(rtuNumber, [])
+
+    def getRtuNumbers(self):
+        """
+        Return the RTU numbers of the configuration.
+        :return: Sorted list of RTU numbers
+        """
+        return sorted(self.tagsByRtu)
+
+
+def getFileChecksum(filename):
+    """
+    Calculate the SHA-256 checksum of a file.
+    :param filename: Path to file
+    :return: Checksum (hex string)
+    """
+    with open(filename, "rb") as f:
+        return hashlib.sha256(f.read()).hexdigest()
+
+
+def getCacheDirectory():
+    """
+    Return the cache directory (created if missing). The directory must be owned by the user and not accessible by others.
+    :return: Path to cache directory
+    :raise OSError: if the directory can not be created or is not private
+    """
+    if not os.path.lexists(RTU_CONFIGURATION_CACHE_PATH):
+        os.makedirs(RTU_CONFIGURATION_CACHE_PATH, 0700)
+    status = os.lstat(RTU_CONFIGURATION_CACHE_PATH)
+    if not stat.S_ISDIR(status.st_mode) or status.st_uid != os.getuid() or status.st_mode & 0077:
+        raise OSError("Cache directory %s is not private" % RTU_CONFIGURATION_CACHE_PATH)
+    return RTU_CONFIGURATION_CACHE_PATH
+
+
+def getCacheFilename(filename):
+    """
+    Return the cache file of an RTU configuration.
+    :param filename: Path to RTU configuration
+    :return: Path to cache file
+    """
+    return os.path.join(getCacheDirectory(), "%s.marshal" % hashlib.sha1(os.path.abspath(filename)).hexdigest())
+
+
+def readCache(filename, status):
+    """
+    Read the cached RTU configuration if the csv file is unchanged.
+    :param filename: Path to RTU configuration
+    :param status: os.stat result of the csv file
+    :return: Tuple (RTUConfiguration object or None, checksum of csv file or None if not calculated)
+    """
+    try:
+        with open(getCacheFilename(filename), "rb") as f:
+            cache = marshal.load(f)
+        if cache.get("version") != RTU_CONFIGURATION_CACHE_VERSION:
+            return None, None
+        if cache["mtime"] == status.st_mtime and cache["size"] == status.st_size:
+            return RTUConfiguration(filename, cache["tags"]), None
+        checksum = getFileChecksum(filename)
+        if cache["checksum"] == checksum:
+            return RTUConfiguration(filename, cache["tags"]), checksum
+    except Exception:
+        return None, None
+    return None, checksum
+
+
+def writeCache(filename, status, checksum, configuration):
+    """
+    Write an RTU configuration to its cache file.
+    :param filename: Path to RTU configuration
+    :param status: os.stat result of the csv file
+    :param checksum: Checksum of csv file
+    :param configuration: RTUConfiguration object
+    """
+    cacheFilename = getCacheFilename(filename)
+    temporaryFilename = "%s.%d" % (cacheFilename, os.getpid())
+    with open(temporaryFilename, "wb") as f:
+        marshal.dump({"version": RTU_CONFIGURATION_CACHE_VERSION, "mtime": status.st_mtime, "size": status.st_size, "checksum": checksum,
+                      "tags": configuration.getTagTuples()}, f)
+    os.rename(temporaryFilename, cacheFilename)
+
+
+def loadRTUConfiguration(filename, useCache=RTU_CONFIGURATION_CACHE_ENABLED):
+    """
+    Load an RTU configuration (parsed only if the csv file changed since the last load).
+    The returned object is shared by all callers and must not be modified.
+    :param filename: Path to RTU configuration (csv format)
+    :param useCache: Use the in-memory and binary file cache
+    :return: RTUConfiguration object
+    """
+    if not useCache:
+        return RTUConfiguration(filename)
+    status = os.stat(filename)
+    key = os.path.abspath(filename)
+    loaded = loadedConfigurations.get(key)
+    if loaded and loaded[0] == (status.st_mtime, status.st_size):
+        return loaded[1]
+    configuration, checksum = readCache(filename, status)
+    if configuration is None or checksum is not None:
+        if configuration is None:
+            configuration = RTUConfiguration(filename)
+        try:
+            writeCache(filename, status, checksum or getFileChecksum(filename), configuration)
+        except (IOError, OSError):
+            pass
+    loadedConfigurations[key] = ((status.st_mtime, status.st_size), configuration)
+    return configuration
@@ -0,0 +1,217 @@
+#!/usr/bin/python
+# -*- coding: utf-8 -*-
+'''
+
+The command evaluation applies commands to a calculated state T_{c} and checks the safety requirements that are relevant for them.
+Only the relevant rules of the nodes which read values changed by the command (affected region) are evaluated.
+Set points only affect the node of the commanded meter, the region of switch and transformer commands follows their calculated effects.
+Besides single commands, lists of candidate commands can be evaluated at once: every command as an alternative on its own
+and all commands as a cumulative sequence. Calculated states are overlays of the observed state, unchanged values are shared.
+With a PowerFlowSolver the effects of switch and transformer commands are estimated on all lines (see PowerFlow.py),
+otherwise by the commanded component (local effects only).
+'''
+import logging
+
+from GridComponents.Meter import getMeterBySetPointTag
+from GridComponents.Switch import getSwitchByTag
+from GridComponents.Transformer import getTransformerByTag
+
+logger = logging.getLogger(__name__)
+
+COMMAND_SAFETY_RULES = {"setPointV": ["R8a"],
+                        "setPointI": ["R8b"],
+                        "transformer": ["R1", "R2", "R4", "R5a", "R5b"],
+                        "switch": ["R1", "R4", "R9a", "R9b"]}
+COMMAND_DESCRIPTIONS = {"setPointV": "Voltage set point change",
+                        "setPointI": "Current set point change",
+                        "transformer": "Transformer tap position change",
+                        "switch": "Switch command"}
+COMMAND_SUBJECTS = {"setPointV": "set point",
+                    "setPointI": "set point",
+                    "transformer": "transformer tap position",
+                    "switch": "switch position"}
+
+
+def getCommandTarget(tagName):
+    """
+    Determine the command type of a tag and the node whose safety requirements are affected.
+    :param tagName: Tag name that is changed with the command
+    :return: (Command type (key of COMMAND_SAFETY_RULES) or None, commanded component, affected node)
+    """
+    meter = getMeterBySetPointTag(tagName)
+    if meter:
+        commandType = "setPointV" if tagName == meter.setPointVKey else "setPointI"
+        return (commandType, meter, meter.connectedNode)
+    transformer = getTransformerByTag(tagName)
+    if transformer:
+        return ("transformer", transformer, transformer)
+    switch = getSwitchByTag(tagName)
+    if switch:
+        return ("switch", switch, switch.connectedNode)
+    return (None, None, None)
+
+
+def applyCommand(tagName, value, calculatedState, powerFlow=None):
+    """
+    Apply a command and its calculated effects to a calculated state.
+    :param tagName: Tag name that is changed with the command
+    :param value: New value
+    :param calculatedState: Calculated state (is modified)
+    :param powerFlow: PowerFlowSolver of the topology (effects are calculated by the commanded component if not given)
+    :return: True if the effects of the command could be calculated
+    """
+    calculatedState.updateValue(tagName, value)
+    commandType, component, node = getCommandTarget(tagName)
+    if commandType in ["transformer", "switch"]:
+        if powerFlow:
+            return powerFlow.calculateCommandEffects(component, calculatedState)
+        return component.calculateCommandEffects(calculatedState)
+    return commandType is not None
+
+
+def screenSwitchOpening(tagName, value, observedState, powerFlow=None):
+    """
+    Screen a switch opening against the current limits of R1 and R4 with line outage distribution factors (see PowerFlow.py).
+    :param tagName: Tag name that is changed with the command
+    :param value: New value
+    :param observedState: Observed state T_{o} (is not modified)
+    :param powerFlow: PowerFlowSolver of the topology
+    :return: List of names of lines with estimated current above a limit, None if the command opens no line of the topology
+    """
+    commandType, component, node = getCommandTarget(tagName)
+    if not powerFlow or commandType != "switch" or value or component.connectedLine.name not in powerFlow.graph.lineIndex:
+        return None
+    return powerFlow.screenLineOutages(observedState, [component.connectedLine])[component.connectedLine.name]
+
+
+def getAffectedNodes(tagName, changedTags, topologyIndex=None):
+    """
+    Determine the nodes whose safety requirements have to be checked for a command.
+    :param tagName: Tag name that is changed with the command
+    :param changedTags: Tags changed by the command and its calculated effects
+    :param topologyIndex: TopologyIndex of the topology (only the commanded node is affected if not given)
+    :return: List of nodes sorted by name
+    """
+    commandType, component, node = getCommandTarget(tagName)
+    nodes = set([node]) if node else set()
+    # Set point commands have no calculated effects on other values (only the commanded node is checked, as for single evaluations)
+    if topologyIndex and commandType in ["transformer", "switch"]:
+        nodes.update(topologyIndex.getNodesOfTags(changedTags))
+    return sorted(nodes, key=lambda n: n.name)
+
+
+def evaluateRegionSafety(state, nodes, ruleNames):
+    """
+    Check selected safety requirements on a set of nodes.
+    :param state: State object which contains state information
+    :param nodes: List of nodes
+    :param ruleNames: List of rule names
+    :return: True if all selected safety requirements are fulfilled on all nodes (nodes without any of the rules are skipped)
+    """
+    safety = True
+    for node in nodes:
+        nodeRuleNames = [r for r in ruleNames if hasattr(node, "safetyCheck%s" % r)]
+        if not nodeRuleNames:
+            continue
+        result = node.executeSafetyRules(state, nodeRuleNames)
+        # Rules without result failed with an exception
+        safety = safety and len(result) == len(nodeRuleNames) and all(result.values())
+    return safety
+
+
+def evaluateCommandSafety(tagName, state, changedTags=(), topologyIndex=None):
+    """
+    Check the safety requirements that are relevant for a command.
+    :param tagName: Tag name that is changed with the command
+    :param state: State object which contains state information
+    :param changedTags: Tags changed by the command and its calculated effects
+    :param topologyIndex: TopologyIndex of the topology (only the commanded node is checked if not given)
+    :return: True if all relevant safety requirements are fulfilled
+    """
+    commandType, component, node = getCommandTarget(tagName)
+    if not commandType:
+        return False
+    nodes = getAffectedNodes(tagName, changedTags, topologyIndex)
+    return evaluateRegionSafety(state, nodes, COMMAND_SAFETY_RULES[commandType])
+
+
+def evaluateAlternative(command, observedState, topologyIndex=None, powerFlow=None):
+    """
+    Evaluate a single command on its own calculated state.
+    :param command: (tagName, value) tuple
+    :param observedState: Observed state T_{o} (is not modified)
+    :param topologyIndex: TopologyIndex of the topology (only the commanded node is checked if not given)
+    :param powerFlow: PowerFlowSolver of the topology (local effects only if not given)
+    :return: (tagName, value, safety) tuple, safety is None if the command can not be evaluated
+    """
+    tagName, value = command
+    try:
+        calculatedState = observedState.getOverlay("T_{c}[%s]" % tagName)
+        if not applyCommand(tagName, value, calculatedState, powerFlow):
+            return (tagName, value, None)
+        return (tagName, value, evaluateCommandSafety(tagName, calculatedState, calculatedState.getModifiedKeys(), topologyIndex))
+    except Exception, e:
+        logger.error("Unknown exception or error in evaluation of %s = %s. %s" % (tagName, value, e.message))
+        return (tagName, value, None)
+
+
+def evaluateSequence(commands, observedState, topologyIndex=None, powerFlow=None):
+    """
+    Apply a list of commands cumulatively to one calculated state.
+    After every step the safety requirements of all commands applied so far are checked again.
+    :param commands: List of (tagName, value) tuples in order of execution
+    :param observedState: Observed state T_{o} (is not modified)
+    :param topologyIndex: TopologyIndex of the topology (only the commanded nodes are checked if not given)
+    :param powerFlow: PowerFlowSolver of the topology (local effects only if not given)
+    :return: List of (tagName, value, safety) tuples, safety is None if the step can not be evaluated
+    """
+    calculatedState = observedState.getOverlay("T_{c}[sequence]")
+    results = []
+    evaluable = True
+    for i, (tagName, value) in enumerate(commands):
+        try:
+            evaluable = evaluable and applyCommand(tagName, value, calculatedState, powerFlow)
+            if not evaluable:
+                results.append((tagName, value, None))
+                continue
+            changedTags = calculatedState.getModifiedKeys()
+            safety = all([evaluateCommandSafety(t, calculatedState, changedTags, topologyIndex) for t in set([t for t, v in commands[:i + 1]])])
+            results.append((tagName, value, safety))
+        except Exception, e:
+            logger.error("Unknown exception or error in evaluation of %s = %s. %s" % (tagName, value, e.message))
+            evaluable = False
+            results.append((tagName, value, None))
+    return results
+
+
+def evaluateCommandBatch(commands, observedState, topologyIndex=None, powerFlow=None):
+    """
+    Evaluate a list of candidate commands as alternatives and as a cumulative sequence.
+    The observed state must not be modified during the evaluation.
+    :param commands: List of (tagName, value) tuples
+    :param observedState: Observed state T_{o}
+    :param topologyIndex: TopologyIndex of the topology (only the commanded nodes are checked if not given)
+    :param powerFlow: PowerFlowSolver of the topology (local effects only if not given)
+    :return: Dictionary with the lists of (tagName, value, safety) tuples ("alternatives", "sequence")
+             and the overall safety of the sequence ("sequenceSafe")
+    """
+    commands = list(commands)
+    alternatives = [evaluateAlternative(c, observedState, topologyIndex, powerFlow) for c in commands]
+    sequence = evaluateSequence(commands, observedState, topologyIndex, powerFlow)
+    sequenceSafe = len(sequence) > 0 and all([safety is True for tagName, value, safety in sequence])
+    return {"alternatives": alternatives, "sequence": sequence, "sequenceSafe": sequenceSafe}
+
+
+def printBatchResult(result):
+    """
+    Print the result of a batch evaluation.
+    :param result: Result of evaluateCommandBatch
+    """
+    descriptions = {True: "safe", False: "NOT safe", None: "can not be evaluated"}
+    logger.warning("Evaluated commands (as alternatives):")
+    for tagName, value, safety in result["alternatives"]:
+        logger.warning("\tSet %s to %s: %s" % (tagName, value, descriptions[safety]))
+    logger.warning("Evaluated commands (as sequence):")
+    for i, (tagName, value, safety) in enumerate(result["sequence"]):
+        logger.warning("\t%2d. Set %s to %s: %s" % (i + 1, tagName, value, descriptions[safety]))
+    logger.warning("Command sequence is %s." % ("safe" if result["sequenceSafe"] else "NOT safe"))
@@ -0,0 +1,108 @@
+#!/usr/bin/python
+# -*- coding: utf-8 -*-
+'''
+
+The compact transport is an alternative to the broccoli events. Bro (T104_CompactExport.bro) appends a fixed-width hex record
+for every measured or commanded value to a file: timestamp (microseconds), RTU number, information object address, context, type and raw value.
+The reader decodes all new records of a batch at once (with NumPy if available, with struct otherwise),
+maps (RTU number, address) to the tag names of the RTU configuration and converts the raw values with the tag converters.
+'''
+import binascii
+import logging
+import struct
+
+try:
+    import numpy
+except ImportError:
+    numpy = None
+
+logger = logging.getLogger(__name__)
+
+RECORD_HEX_LENGTH = 42
+RECORD_STRUCT = struct.Struct(">QIIBI")
+RECORD_DTYPE = numpy.dtype([("timestamp", ">u8"), ("rtu", ">u4"), ("address", ">u4"), ("kind", "u1"), ("raw", ">u4")]) if numpy else None
+READ_BATCH_SIZE = 4096
+CONTEXTS = ["measured", "commanded"]
+RAW_TYPES = ["normalized", "double", "doublePoint", "singlePoint"]
+
+
+def decodeRecords(hexData):
+    """
+    Decode a batch of concatenated records.
+    :param hexData: Hex string of records (without line breaks)
+    :return: Tuple of lists (timestamps, RTU numbers, addresses, context indices, type indices, raw values)
+    """
+    data = binascii.unhexlify(hexData)
+    if numpy:
+        records = numpy.frombuffer(data, dtype=RECORD_DTYPE)
+        kinds = records["kind"]
+        return ((records["timestamp"] / 1e6).tolist(), records["rtu"].tolist(), records["address"].tolist(),
+                (kinds >> 4).tolist(), (kinds & 0x0f).tolist(), records["raw"].tolist())
+    columns = ([], [], [], [], [], [])
+    for offset in xrange(0, len(data), RECORD_STRUCT.size):
+        timestamp, rtu, address, kind, raw = RECORD_STRUCT.unpack_from(data, offset)
+        for column, value in zip(columns, (timestamp / 1e6, rtu, address, kind >> 4, kind & 0x0f, raw)):
+            column.append(value)
+    return columns
+
+
+class CompactRecordReader():
+    def __init__(self, filename, tagConverters):
+        """
+        Initialize a reader for a record file that is written by Bro.
+        :param filename: Path to record file (COMPACT_EXPORT_FILE of T104_CompactExport.bro)
+        :param tagConverters: TagConverters of the RTU configuration
+        """
+        self.filename = filename
+        self.tagConverters = tagConverters
+        self.file = None
+        self.remainder = ""
+        self.receivedCount = 0
+        self.unknownCount = 0
+
+    def readValues(self, maxRecords=READ_BATCH_SIZE):
+        """
+        Read and convert the records appended since the last call.
+        :param maxRecords: Maximal number of records read at once
+        :return: List of (timestamp, tagName, context, value) tuples in order of the records
+        """
+        if not self.file:
+            try:
+                self.file = open(self.filename)
+            except IOError:
+                # Bro has not created the file yet
+                return []
+        data = self.remainder + self.file.read(maxRecords * (RECORD_HEX_LENGTH + 1))
+        lines = data.split("\n")
+        self.remainder = lines.pop()
+        records = [l for l in lines if len(l) == RECORD_HEX_LENGTH]
+        if len(records) < len(lines):
+            logger.error("Skipped %d malformed records in %s." % (len(lines) - len(records), self.filename))
+        if not records:
+            return []
+        timestamps, rtus, addresses, contexts, rawTypes, raws = decodeRecords("".join(records))
+        selected = []
+        tagNames = []
+        for i, (rtu, address) in enumerate(zip(rtus, addresses)):
+            tagName = self.tagConverters.getTagName(rtu, address)
+            if tagName is None:
+                self.unknownCount += 1
+            elif contexts[i] >= len(CONTEXTS) or rawTypes[i] >= len(RAW_TYPES):
+                logger.error("Invalid record of RTU %d, address %d: Unknown context or type." % (rtu, address))
+            else:
+                selected.append(i)
+                tagNames.append(tagName)
+        values = self.tagConverters.convertValues(tagNames, [raws[i] for i in selected], [RAW_TYPES[rawTypes[i]] for i in selected])
+        values = [(timestamps[i], tagName, CONTEXTS[contexts[i]], value) for i, tagName, value in zip(selected, tagNames, values)]
+        self.receivedCount += len(records)
+        return values
+
+    def close(self):
+        """Close the record file."""
+        if self.file:
+            self.file.close()
+            self.file = None
+
+    def printStatistics(self):
+        """Print statistics about the received records."""
+        logger.info("Compact transport: %d records received, %d records of unknown addresses." % (self.receivedCount, self.unknownCount))
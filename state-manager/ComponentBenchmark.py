@@ -0,0 +1,108 @@
+#!/usr/bin/python
+# -*- coding: utf-8 -*-
+'''
+
+Memory benchmark of the grid component model on a synthetic topology (see TestTopologies.initiateTopologySynthetic).
+The size of every component with __slots__ is compared with the size of the same attributes stored in a per-instance __dict__
+(layout of the component classes without __slots__). Additionally the resident memory of the process and the time of
+attribute reads on the rule hot path (line ends of all nodes) are reported.
+Usage: python ComponentBenchmark.py [number of RTUs]
+'''
+import resource
+import sys
+import time
+from collections import defaultdict
+
+from GridComponents.AbstractComponent import AbstractComponent
+from GridComponents.AbstractNode import AbstractNode
+from TestTopologies import initiateTopologySynthetic
+
+BENCHMARK_RTUS = 10000
+
+
+class DictComponent(object):
+    pass
+
+
+def getSlotNames(componentType):
+    """
+    Return the attribute names declared in __slots__ of a component class and its base classes.
+    :param componentType: Component class
+    :return: List of attribute names
+    """
+    names = []
+    for c in reversed(componentType.__mro__):
+        names.extend(c.__dict__.get("__slots__", ()))
+    return names
+
+
+def getDictLayoutSize(component):
+    """
+    Return the size of a component if its attributes were stored in a per-instance __dict__.
+    :param component: Grid component
+    :return: Size in bytes (object and dictionary)
+    """
+    dictComponent = DictComponent()
+    for name in getSlotNames(type(component)):
+        if hasattr(component, name):
+            setattr(dictComponent, name, getattr(component, name))
+    return sys.getsizeof(dictComponent) + sys.getsizeof(dictComponent.__dict__)
+
+
+def readLineEnds(nodes):
+    """
+    Read the meter keys and switch keys of all line ends of the nodes (attribute access pattern of the consistency rules).
+    :param nodes: List of nodes
+    :return: Number of read keys
+    """
+    count = 0
+    for node in nodes:
+        for l in node.linesIn:
+            count += len(l.endMeter.currentKey) > 0
+            count += len(l.endSwitch.stateKey) > 0
+        for l in node.linesOut:
+            count += len(l.startMeter.currentKey) > 0
+            count += len(l.startSwitch.stateKey) > 0
+    return count
+
+
+def runBenchmark(rtuCount=BENCHMARK_RTUS):
+    """
+    Build a synthetic topology and print the memory usage of its components.
+    :param rtuCount: Number of RTUs of the synthetic topology
+    :return: Dictionary with results (components, slotsBytes, dictBytes, rssKilobytes, buildSeconds, readSeconds)
+    """
+    rssBefore = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    start = time.time()
+    initiateTopologySynthetic(rtuCount)
+    buildSeconds = time.time() - start
+    rssKilobytes = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss - rssBefore
+    counts = defaultdict(int)
+    slotsBytes = defaultdict(int)
+    dictBytes = defaultdict(int)
+    for component in AbstractComponent.allComponents:
+        name = type(component).__name__
+        counts[name] += 1
+        slotsBytes[name] += sys.getsizeof(component)
+        dictBytes[name] += getDictLayoutSize(component)
+    nodes = [c for c in AbstractComponent.allComponents if isinstance(c, AbstractNode)]
+    start = time.time()
+    readLineEnds(nodes)
+    readSeconds = time.time() - start
+
+    print "Synthetic topology with %d RTUs: %d components built in %.2fs, resident memory +%.1f MB" % (
+        rtuCount, len(AbstractComponent.allComponents), buildSeconds, rssKilobytes / 1024.0)
+    print "%-16s %9s %14s %14s" % ("Type", "Count", "__slots__ [MB]", "__dict__ [MB]")
+    for name in sorted(counts):
+        print "%-16s %9d %14.2f %14.2f" % (name, counts[name], slotsBytes[name] / 1048576.0, dictBytes[name] / 1048576.0)
+    totalSlots = sum(slotsBytes.values())
+    totalDict = sum(dictBytes.values())
+    print "%-16s %9d %14.2f %14.2f (saving %.0f%%)" % ("Total", len(AbstractComponent.allComponents), totalSlots / 1048576.0,
+                                                        totalDict / 1048576.0, 100.0 * (totalDict - totalSlots) / totalDict)
+    print "Read line ends of %d nodes in %.3fs" % (len(nodes), readSeconds)
+    return {"components": len(AbstractComponent.allComponents), "slotsBytes": totalSlots, "dictBytes": totalDict,
+            "rssKilobytes": rssKilobytes, "buildSeconds": buildSeconds, "readSeconds": readSeconds}
+
+
+if __name__ == '__main__':
+    runBenchmark(int(sys.argv[1]) if len(sys.argv) > 1 else BENCHMARK_RTUS)
@@ -0,0 +1,121 @@
+#!/usr/bin/python
+# -*- coding: utf-8 -*-
+'''
+
+The evaluation scheduler decides when the rules of an RTU are automatically evaluated.
+An RTU is scheduled as soon as one of its tags changes. The evaluation is debounced until no further change arrived for a while,
+but it is forced if the oldest unevaluated change exceeds the maximum staleness. Command evaluations have priority:
+pending automatic evaluations are held back shortly after a command was received.
+The statistics count per RTU the tag changes, the changes coalesced into an already pending evaluation,
+the pending evaluations held back by commands and the evaluations triggered after the debounce or forced by the maximum staleness.
+'''
+import logging
+import time
+from collections import defaultdict
+from threading import Lock
+
+logger = logging.getLogger(__name__)
+
+EVALUATION_DEBOUNCE = 2
+EVALUATION_MAX_STALENESS = 10
+EVALUATION_COMMAND_PRIORITY_HOLD = 1
+STATISTICS_COUNTERS = ["changes", "coalesced", "held", "triggered", "forced"]
+
+
+class EvaluationScheduler():
+    def __init__(self, topologyIndex, debounce=EVALUATION_DEBOUNCE, maxStaleness=EVALUATION_MAX_STALENESS,
+                 commandPriorityHold=EVALUATION_COMMAND_PRIORITY_HOLD):
+        """
+        Initialize an evaluation scheduler.
+        :param topologyIndex: TopologyIndex of the evaluated topology
+        :param debounce: Time in seconds without changes of an RTU's tags before it is evaluated
+        :param maxStaleness: Maximal time in seconds an RTU change stays unevaluated
+        :param commandPriorityHold: Time in seconds automatic evaluations are held back after a command
+        """
+        assert 0 <= debounce <= maxStaleness
+        self.topologyIndex = topologyIndex
+        self.debounce = debounce
+        self.maxStaleness = maxStaleness
+        self.commandPriorityHold = commandPriorityHold
+        self.enabled = True
+        self.lock = Lock()
+        self.firstChange = dict()
+        self.lastChange = dict()
+        self.lastCommand = None
+        self.statistics = defaultdict(lambda: dict([(c, 0) for c in STATISTICS_COUNTERS]))
+
+    def notifyTagChange(self, tagName, now=None):
+        """
+        Schedule the RTUs whose rules read a changed tag.
+        :param tagName: Tag name of changed value
+        :param now: Time of change (time.time() if not given)
+        """
+        if now is None:
+            now = time.time()
+        with self.lock:
+            for rtuName in self.topologyIndex.getRTUsOfTags([tagName]):
+                self.statistics[rtuName]["changes"] += 1
+                if self.firstChange.has_key(rtuName):
+                    self.statistics[rtuName]["coalesced"] += 1
+                else:
+                    self.firstChange[rtuName] = now
+                self.lastChange[rtuName] = now
+
+    def notifyCommand(self, now=None):
+        """
+        Hold back pending automatic evaluations in favour of a command evaluation.
+        :param now: Time of command (time.time() if not given)
+        """
+        if now is None:
+            now = time.time()
+        with self.lock:
+            self.lastCommand = now
+            for rtuName in self.firstChange.keys():
+                self.statistics[rtuName]["held"] += 1
+
+    def collectDueRTUs(self, now=None):
+        """
+        Return the RTUs which should be evaluated now and mark them as evaluated.
+        :param now: Current time (time.time() if not given)
+        :return: (List of RTU names, True if at least one evaluation was forced by the maximum staleness)
+        """
+        if now is None:
+            now = time.time()
+        dueRTUs = []
+        forced = False
+        with self.lock:
+            if not self.enabled or not self.firstChange:
+                return ([], False)
+            commandActive = self.lastCommand is not None and now - self.lastCommand < self.commandPriorityHold
+            for rtuName in sorted(self.firstChange.keys()):
+                if now - self.firstChange[rtuName] >= self.maxStaleness:
+                    self.statistics[rtuName]["forced"] += 1
+                    forced = True
+                elif now - self.lastChange[rtuName] >= self.debounce and not commandActive:
+                    self.statistics[rtuName]["triggered"] += 1
+                else:
+                    continue
+                dueRTUs.append(rtuName)
+                del self.firstChange[rtuName]
+                del self.lastChange[rtuName]
+        return (dueRTUs, forced)
+
+    def markAllEvaluated(self):
+        """Drop all pending evaluations (e.g. after a manual evaluation of the full topology)."""
+        with self.lock:
+            self.firstChange.clear()
+            self.lastChange.clear()
+
+    def printStatistics(self):
+        """Print how often changes were coalesced, evaluations held back by commands, triggered and forced per RTU."""
+        logger.warning("Evaluation scheduler statistics (%ds debounce, %ds max. staleness, %ds command priority):" %
+                       (self.debounce, self.maxStaleness, self.commandPriorityHold))
+        totals = dict([(c, 0) for c in STATISTICS_COUNTERS])
+        for rtuName in sorted(self.statistics.keys()):
+            counters = self.statistics[rtuName]
+            logger.warning("\t%-15s changes: %6d, coalesced: %6d, held: %4d, triggered: %4d, forced: %4d" %
+                           (rtuName, counters["changes"], counters["coalesced"], counters["held"], counters["triggered"], counters["forced"]))
+            for c in STATISTICS_COUNTERS:
+                totals[c] += counters[c]
+        logger.warning("\t%-15s changes: %6d, coalesced: %6d, held: %4d, triggered: %4d, forced: %4d" %
+                       ("Total", totals["changes"], totals["coalesced"], totals["held"], totals["triggered"], totals["forced"]))
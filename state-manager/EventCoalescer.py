@@ -0,0 +1,143 @@
+#!/usr/bin/python
+# -*- coding: utf-8 -*-
+'''
+
+The event coalescer buffers received measurements and keeps only the latest value per tag within a configurable window.
+Bursts of updates of the same tag (e.g. general interrogation or high-rate cyclic reporting) are therefore applied to the observed state at once.
+Superseded values can optionally be recorded in a compact log instead of the history of the ValueStore.
+'''
+import logging
+import time
+from array import array
+from threading import Lock
+
+from StateManagerUtilities import formatTimestamp
+
+logger = logging.getLogger(__name__)
+
+COALESCING_WINDOW = 0.5
+
+
+class CompactValueLog():
+    def __init__(self):
+        """Initialize an empty compact value log (two typed arrays per tag)."""
+        self.values = dict()
+        self.timestamps = dict()
+        self.types = dict()
+
+    def append(self, name, value, timestamp):
+        """
+        Append a value to the log.
+        :param name: Reference key
+        :param value: Value (bool or float)
+        :param timestamp: Timestamp of value
+        """
+        if not self.values.has_key(name):
+            self.values[name] = array('d')
+            self.timestamps[name] = array('d')
+            self.types[name] = type(value)
+        self.values[name].append(float(value))
+        self.timestamps[name].append(timestamp)
+
+    def retrieveEntries(self, name):
+        """
+        Return all logged values of a tag.
+        :param name: Reference key
+        :return: List of (value, timestamp) tuples in order of arrival
+        """
+        if not self.values.has_key(name):
+            return []
+        valueType = self.types[name]
+        return [(valueType(v), t) for v, t in zip(self.values[name], self.timestamps[name])]
+
+    def countEntries(self):
+        """
+        Return the total number of logged values.
+        :return: Number of entries over all tags
+        """
+        return sum([len(v) for v in self.values.itervalues()])
+
+    def printLog(self):
+        """Print the full compact log."""
+        logger.debug("Full compact value log:")
+        for name in sorted(self.values.keys()):
+            logger.debug("Value log for %s:" % name)
+            for v, t in self.retrieveEntries(name):
+                logger.debug("\t%s: %s" % (formatTimestamp(t), v))
+        logger.debug("Total log entries: %d" % self.countEntries())
+
+
+class EventCoalescer():
+    def __init__(self, window=COALESCING_WINDOW, keepFullHistory=False):
+        """
+        Initialize an event coalescer.
+        :param window: Coalescing window in seconds (time between first buffered value and flush)
+        :param keepFullHistory: True if every received value should be recorded in a compact log
+        """
+        assert window >= 0
+        self.window = window
+        self.lock = Lock()
+        self.pending = dict()
+        self.windowStart = None
+        self.fullHistory = CompactValueLog() if keepFullHistory else None
+        self.receivedCount = 0
+        self.coalescedCount = 0
+        self.flushCount = 0
+
+    def add(self, name, value, timestamp=None):
+        """
+        Buffer a received value. A pending value of the same tag is replaced.
+        :param name: Reference key
+        :param value: Received value
+        :param timestamp: Timestamp of the value (e.g. network time of Bro, time of reception if not given)
+        """
+        # The coalescing window runs on the time of reception (timestamps of captures may be far in the past)
+        receptionTime = time.time()
+        if timestamp is None:
+            timestamp = receptionTime
+        with self.lock:
+            self.receivedCount += 1
+            if not self.pending:
+                self.windowStart = receptionTime
+            elif self.pending.has_key(name):
+                self.coalescedCount += 1
+            self.pending[name] = (value, timestamp)
+            if self.fullHistory is not None:
+                self.fullHistory.append(name, value, timestamp)
+
+    def hasPendingValues(self):
+        """
+        Check whether values are buffered.
+        :return: True if at least one value waits for being flushed
+        """
+        return len(self.pending) > 0
+
+    def isDue(self, now=None):
+        """
+        Check whether the coalescing window of the buffered values is over.
+        :param now: Current time (time.time() if not given)
+        :return: True if buffered values should be flushed
+        """
+        if not self.pending:
+            return False
+        if now is None:
+            now = time.time()
+        return now - self.windowStart >= self.window
+
+    def flush(self):
+        """
+        Remove and return all buffered values.
+        :return: List of (name, value, timestamp) tuples sorted by timestamp
+        """
+        with self.lock:
+            pending = self.pending
+            self.pending = dict()
+            self.windowStart = None
+            if pending:
+                self.flushCount += 1
+        return sorted([(k, v, t) for k, (v, t) in pending.iteritems()], key=lambda (k, v, t): t)
+
+    def printStatistics(self):
+        """Print statistics about the coalescing."""
+        logger.info("Coalesced measurements: %d received, %d superseded within %2.3fs window, %d flushes." %
+                    (self.receivedCount, self.coalescedCount, self.window, self.flushCount))
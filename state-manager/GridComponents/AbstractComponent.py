@@ -5,10 +5,14 @@
 Every class representing a physical part of the electrical grid is subclass of this abstract component.
 This class ensures that every component has a name and offers a function to return all components there are.
 Furthermore it can be used for type checks and constraints.
+The registry of all components is global, so every process creates exactly one topology (see assertSingleTopology in LocalRTU.py).
+All component classes declare their attributes in __slots__ (no per-instance __dict__), which keeps large topologies compact
+and attribute access fast. Subclasses must declare __slots__ (empty tuple if they add no attributes).
 '''
 
 
 class AbstractComponent(object):
+    __slots__ = ("name",)
     allComponents = []
     allNames = []
 
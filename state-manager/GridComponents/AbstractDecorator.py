@@ -8,6 +8,8 @@ from GridComponents.AbstractComponent import AbstractComponent
 
 
 class AbstractDecorator(AbstractComponent):
+    __slots__ = ("connectedLine", "connectedNode")
+
     def __init__(self, name):
         """
         Initialize a decorator type.
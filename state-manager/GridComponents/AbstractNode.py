@@ -10,13 +10,17 @@ import time
 from DynamicInterlock import DynamicInterlock
 from GridComponents.AbstractComponent import AbstractComponent
 from GridComponents.PowerLine import PowerLine
-from LoggerUtilities import logCheckPassed, logDebugCheckValues, logCheckDescription, logDebugUnknownValues
-from StateManagerUtilities import isZero, isClose
+from LoggerUtilities import logCheckPassed, logDebugCheckValues, logCheckDescription, logDebugUnknownValues, logAllChecksDescription, \
+    logAllChecksPassed, logError
+from RuleResultCache import cachedRuleResult
+from StateManagerUtilities import isZero, isClose, formatBroDouble, BRO_UNBOUNDED
 from StaticInterlock import StaticInterlock
 from ValueStore import ValueNotStoredException
 
 
 class AbstractNode(AbstractComponent):
+    __slots__ = ("linesIn", "linesOut")
+
     def __init__(self, name, linesIn, linesOut):
         """
         Initialize a node type.
@@ -36,6 +40,7 @@ class AbstractNode(AbstractComponent):
             assert isinstance(l, PowerLine)
             l.setStartNode(self)
 
+    @cachedRuleResult
     def consistencyCheckP3(self, state):
         """
         This consistency rule checks that the current is zero if a switch, fuse or protective relay has an open circuit.
@@ -99,6 +104,7 @@ class AbstractNode(AbstractComponent):
         logCheckPassed("P3", passed, indentation=3)
         return passed
 
+    @cachedRuleResult
     def consistencyCheckP4(self, state):
         """
         This consistency rule checks that the voltage and current at the start of a line is the same as at the end.
@@ -121,6 +127,7 @@ class AbstractNode(AbstractComponent):
         logCheckPassed("P4", passed, indentation=3)
         return passed
 
+    @cachedRuleResult
     def safetyCheckR1(self, state):
         """
         This safety rule checks that the current is below the maximal safe current threshold for a power line
@@ -140,6 +147,7 @@ class AbstractNode(AbstractComponent):
         logCheckPassed("R1", passed, indentation=3)
         return passed
 
+    @cachedRuleResult
     def safetyCheckR2(self, state):
         """
         This safety rule checks that the voltage is within its allowed interval around the nominal voltage
@@ -161,6 +169,7 @@ class AbstractNode(AbstractComponent):
         logCheckPassed("R2", passed, indentation=3)
         return passed
 
+    @cachedRuleResult
     def safetyCheckR3(self, state):
         """
         This safety rule checks whether all fuses and protective relays are closed.
@@ -210,6 +219,7 @@ class AbstractNode(AbstractComponent):
         logCheckPassed("R3", passed, indentation=3)
         return passed
 
+    @cachedRuleResult
     def safetyCheckR4(self, state):
         """
         This safety rule checks whether all lines connected to fuses and protective relays have current below the cutting current
@@ -287,6 +297,7 @@ class AbstractNode(AbstractComponent):
         logCheckPassed("R4", passed, indentation=3)
         return passed
 
+    @cachedRuleResult
     def safetyCheckR8a(self, state):
         """
         This safety rule checks whether the voltage set points are safe
@@ -308,6 +319,7 @@ class AbstractNode(AbstractComponent):
         logCheckPassed("R8a", passed, indentation=3)
         return passed
 
+    @cachedRuleResult
     def safetyCheckR8b(self, state):
         """
         This safety rule checks whether the current set points are safe
@@ -329,6 +341,7 @@ class AbstractNode(AbstractComponent):
         logCheckPassed("R8b", passed, indentation=3)
         return passed
 
+    @cachedRuleResult
     def safetyCheckR9a(self, state):
         """
         This safety rule checks that static interlocks are not violated.
@@ -371,6 +384,7 @@ class AbstractNode(AbstractComponent):
         logCheckPassed("R9a", passed, indentation=3)
         return passed
 
+    @cachedRuleResult
     def safetyCheckR9b(self, state):
         """
         This safety rule checks that dynamic interlocks are not violated.
@@ -439,16 +453,54 @@ class AbstractNode(AbstractComponent):
         """
         pass
 
+    def executeSafetyRules(self, state, ruleNames):
+        """
+        Execute selected safety rules over this compnent.
+        Rules that are not defined for the node type are skipped.
+        :param state: State object which contains state information
+        :param ruleNames: List of rule names (e.g. ["R1", "R4"])
+        :return: Dictionary of rule names and results
+        """
+        nodeName = "%s %s" % (self.__class__.__name__.upper(), self.name)
+        logAllChecksDescription("SAFETY", nodeName, indentation=2)
+        checkStatus = dict()
+        try:
+            for ruleName in ruleNames:
+                rule = getattr(self, "safetyCheck%s" % ruleName, None)
+                if rule:
+                    checkStatus[ruleName] = rule(state)
+            logAllChecksPassed("SAFETY", nodeName, all(checkStatus.values()), indentation=2)
+        except Exception, e:
+            logError("Unknown exception or error: %s" % e.message, indentation=2)
+        return checkStatus
+
     def generateBroConsistencyCheck(self):
         """
         Generate consistency check bro rules for this compnent.
-        Function stub for subclasses
+        All consistency rules compare several values and are evaluated by the state manager.
+        :return: List of bro statements (empty)
         """
-        pass
+        return []
 
     def generateBroSafetyCheck(self):
         """
         Generate safety check bro rules for this compnent.
-        Function stub for subclasses
+        Only the stateless rules that bound a single value (R1, R2, R3, R8a, R8b) are evaluated in bro.
+        :return: List of bro statements (one add_bound_rule call per bound value)
         """
-        pass
+        boundRules = []
+        for l in self.getAllConnectedLines():
+            localMeter = l.getLocalComponent(self, "local", "meter")
+            safeVoltageInterval = (l.nominalV * (1 - l.voltageBoundaryFactor), l.nominalV * (1 + l.voltageBoundaryFactor))
+            boundRules.append(("R1", l, localMeter.currentKey, -BRO_UNBOUNDED, l.maxI, False))
+            boundRules.append(("R2", l, localMeter.voltageKey, safeVoltageInterval[0], safeVoltageInterval[1], True))
+            for type in ["fuse", "protectiveRelay"]:
+                localDevice = l.getLocalComponent(self, "local", type)
+                if localDevice:
+                    # Closed state (True or double point state > 0)
+                    boundRules.append(("R3", l, localDevice.stateKey, 0.5, BRO_UNBOUNDED, False))
+            boundRules.append(("R8a", l, localMeter.setPointVKey, l.nominalV * 0.90, l.nominalV * 1.10, False))
+            boundRules.append(("R8b", l, localMeter.setPointIKey, l.maxI * 0.90, l.maxI * 1.10, False))
+        return ['add_bound_rule("%s", bound_rule_t($rule="%s", $node="%s", $line="%s", $min=%s, $max=%s, $ignoreZero=%s));' %
+                (tagName, ruleName, self.name, l.name, formatBroDouble(minValue), formatBroDouble(maxValue), "T" if ignoreZero else "F")
+                for ruleName, l, tagName, minValue, maxValue, ignoreZero in boundRules]
@@ -8,6 +8,8 @@ from GridComponents.AbstractDecorator import AbstractDecorator
 
 
 class AbstractProtectiveDevice(AbstractDecorator):
+    __slots__ = ("cuttingI", "cuttingT", "stateKey")
+
     def __init__(self, name, cuttingI, cuttingT=0, stateKey=None):
         """
         Initialize a fuse.
@@ -7,11 +7,14 @@ This class represents a bus node.
 from GridComponents.AbstractNode import AbstractNode
 from LoggerUtilities import logCheckPassed, logCheckDescription, logAllChecksPassed, logAllChecksDescription, \
     logDebugCheckValues, logDebugUnknownValues, logError
+from RuleResultCache import cachedRuleResult
 from StateManagerUtilities import isClose
 from ValueStore import ValueNotStoredException
 
 
 class Bus(AbstractNode):
+    __slots__ = ()
+
     def __init__(self, name, linesIn, linesOut):
         """
         Initialize a bus.
@@ -23,6 +26,7 @@ class Bus(AbstractNode):
         assert len(linesIn) > 0
         assert len(linesOut) > 0
 
+    @cachedRuleResult
     def consistencyCheckP1(self, state):
         """
         This consistency rule checks whether Kirchhoff's current law holds at the bus.
@@ -42,6 +46,7 @@ class Bus(AbstractNode):
         logCheckPassed("P1", passed, indentation=3)
         return passed
 
+    @cachedRuleResult
     def consistencyCheckP2(self, state):
         """
         This consistency rule checks whether the voltage equals on all meters of a bus.
@@ -99,12 +104,3 @@ class Bus(AbstractNode):
         except Exception, e:
             logError("Unknown exception or error: %s" % e.message, indentation=2)
         return checkStatus
-
-    def generateBroConsistencyCheck(self):
-        """Generate consistency check bro rules for this compnent."""
-        pass
-
-    def generateBroSafetyCheck(self):
-        """Generate safety check bro rules for this compnent."""
-        pass
-
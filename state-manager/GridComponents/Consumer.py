@@ -7,11 +7,14 @@ This class represents a consumer node.
 from GridComponents.AbstractNode import AbstractNode
 from LoggerUtilities import logCheckPassed, logCheckDescription, logAllChecksPassed, logAllChecksDescription, \
     logDebugCheckValues, logDebugUnknownValues, logError
+from RuleResultCache import cachedRuleResult
 from StateManagerUtilities import isClose
 from ValueStore import ValueNotStoredException
 
 
 class Consumer(AbstractNode):
+    __slots__ = ("consumedPowerKey",)
+
     def __init__(self, name, linesIn, linesOut, consumedPowerKey=None):
         """
         Initialize a consumer.
@@ -25,6 +28,7 @@ class Consumer(AbstractNode):
         assert len(linesOut) == 0
         self.consumedPowerKey = consumedPowerKey if consumedPowerKey else "%s_P" % self.name.upper()
 
+    @cachedRuleResult
     def consistencyCheckP5b(self, state):
         """
         This consistency rule checks whether P = I * V holds for the consumer.
@@ -82,11 +86,3 @@ class Consumer(AbstractNode):
         except Exception, e:
             logError("Unknown exception or error: %s" % e.message, indentation=2)
         return checkStatus
-
-    def generateBroConsistencyCheck(self):
-        """Generate consistency check bro rules for this compnent."""
-        pass
-
-    def generateBroSafetyCheck(self):
-        """Generate safety check bro rules for this compnent."""
-        pass
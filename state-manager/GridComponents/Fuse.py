@@ -8,6 +8,8 @@ from GridComponents.AbstractProtectiveDevice import AbstractProtectiveDevice
 
 
 class Fuse(AbstractProtectiveDevice):
+    __slots__ = ()
+
     def __init__(self, name, cuttingI, cuttingT=0, stateKey=None):
         """
         Initialize a fuse.
@@ -7,11 +7,14 @@ This class represents a generator node.
 from GridComponents.AbstractNode import AbstractNode
 from LoggerUtilities import logCheckPassed, logCheckDescription, logAllChecksPassed, logAllChecksDescription, \
     logDebugCheckValues, logDebugUnknownValues, logError
+from RuleResultCache import cachedRuleResult
 from StateManagerUtilities import isClose
 from ValueStore import ValueNotStoredException
 
 
 class Generator(AbstractNode):
+    __slots__ = ("generatedPowerKey",)
+
     def __init__(self, name, linesIn, linesOut, generatedPowerKey=None):
         """
         Initialize a generator.
@@ -25,6 +28,7 @@ class Generator(AbstractNode):
         assert len(linesOut) == 1
         self.generatedPowerKey = generatedPowerKey if generatedPowerKey else "%s_P" % self.name.upper()
 
+    @cachedRuleResult
     def consistencyCheckP5a(self, state):
         """
         This consistency rule checks whether P = I * V holds for the generator.
@@ -82,11 +86,3 @@ class Generator(AbstractNode):
         except Exception, e:
             logError("Unknown exception or error: %s" % e.message, indentation=2)
         return checkStatus
-
-    def generateBroConsistencyCheck(self):
-        """Generate consistency check bro rules for this compnent."""
-        pass
-
-    def generateBroSafetyCheck(self):
-        """Generate safety check bro rules for this compnent."""
-        pass
@@ -5,6 +5,7 @@
 This class represents a RTU.
 '''
 from GridComponents.AbstractComponent import getAllComponentsOfType
+from GridComponents.AbstractNode import AbstractNode
 from GridComponents.Consumer import Consumer
 from GridComponents.Generator import Generator
 from LoggerUtilities import logCheckPassed, logCheckDescription, logAllChecksDescription, logAllChecksPassed, \
@@ -128,11 +129,34 @@ class LocalRTU:
         return checkStatus
 
     def generateFullBroConsistencyCheck(self):
-        """Generate consistency check bro rules for this compnent."""
+        """
+        Generate consistency check bro rules for all compnents connected to this RTU.
+        :return: List of bro statements
+        """
+        statements = []
         for n in self.controlledNodes:
-            n.generateBroConsistencyCheck()
+            statements.extend(n.generateBroConsistencyCheck())
+        return statements
 
     def generateFullBroSafetyCheck(self):
-        """Generate safety check bro rules for this compnent."""
+        """
+        Generate safety check bro rules for all compnents connected to this RTU.
+        R6 and R7 compare values of several nodes and are evaluated by the state manager.
+        :return: List of bro statements
+        """
+        statements = []
         for n in self.controlledNodes:
-            n.generateBroSafetyCheck()
+            statements.extend(n.generateBroSafetyCheck())
+        return statements
+
+
+def assertSingleTopology(topology):
+    """
+    Assert that all grid components of the process belong to the given topology.
+    The component registry (AbstractComponent.allComponents) is global: R6, R7 and the tag lookups of switches and
+    transformers would mix the components of several topologies, so every process creates exactly one topology.
+    :param topology: Topology list of RTUs
+    """
+    nodes = set(n for rtu in topology for n in rtu.controlledNodes)
+    foreignNodes = [c.name for c in getAllComponentsOfType(AbstractNode) if c not in nodes]
+    assert not foreignNodes, "Components of another topology in this process: %s" % ", ".join(foreignNodes)
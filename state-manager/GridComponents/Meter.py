@@ -10,6 +10,7 @@ from GridComponents.AbstractDecorator import AbstractDecorator
 
 
 class Meter(AbstractDecorator):
+    __slots__ = ("currentKey", "voltageKey", "setPointIKey", "setPointVKey")
     meterBySetPointTags = defaultdict(lambda: None)
 
     def __init__(self, name, currentKey=None, voltageKey=None, setPointIKey=None, setPointVKey=None):
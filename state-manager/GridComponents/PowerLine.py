@@ -12,6 +12,9 @@ from GridComponents.Switch import Switch
 
 
 class PowerLine(AbstractComponent):
+    __slots__ = ("maxI", "nominalV", "voltageBoundaryFactor", "startNode", "endNode", "startMeter", "endMeter", "startSwitch", "endSwitch",
+                 "startFuse", "endFuse", "startProtectiveRelay", "endProtectiveRelay")
+
     def __init__(self, name, maxI, nominalV=230, startSwitch=None, endSwitch=None, startMeter=None, endMeter=None,
                  startFuse=None, endFuse=None, startProtectiveRelay=None, endProtectiveRelay=None, voltageBoundaryFactor=0.10):
         """
@@ -12,6 +12,7 @@ from ValueStore import ValueNotStoredException
 
 
 class Switch(AbstractDecorator):
+    __slots__ = ("stateKey", "interlocks")
     switchesByTags = defaultdict(lambda: None)
 
     def __init__(self, name, stateKey=None):
@@ -9,11 +9,14 @@ from collections import defaultdict
 from GridComponents.AbstractNode import AbstractNode
 from LoggerUtilities import logAllChecksPassed, logAllChecksDescription, logCheckDescription, logCheckPassed, \
     logDebugCheckValues, logDebugUnknownValues, logError
+from RuleResultCache import cachedRuleResult
 from StateManagerUtilities import isClose, isZero
 from ValueStore import ValueNotStoredException
 
 
 class Transformer(AbstractNode):
+    __slots__ = ("rateFunction", "tapPositionKey")
+
     transformersByTags = defaultdict(lambda: None)
 
     def __init__(self, name, linesIn, linesOut, transformerRateFunction, tapPositionKey=None):
@@ -33,6 +36,7 @@ class Transformer(AbstractNode):
         self.tapPositionKey = tapPositionKey if tapPositionKey else "%s_TAP" % self.name.upper()
         Transformer.transformersByTags[self.tapPositionKey] = self
 
+    @cachedRuleResult
     def consistencyCheckP6a(self, state):
         """
         This consistency rule checks whether the transformation rate is consistent with the voltage measurement.
@@ -72,6 +76,7 @@ class Transformer(AbstractNode):
         logCheckPassed("P6a", passed, indentation=3)
         return passed
 
+    @cachedRuleResult
     def consistencyCheckP6b(self, state):
         """
         This consistency rule checks whether the transformation rate is consistent with the current measurement.
@@ -114,6 +119,7 @@ class Transformer(AbstractNode):
         logCheckPassed("P6b", passed, indentation=3)
         return passed
 
+    @cachedRuleResult
     def consistencyCheckP7(self, state):
         """
         This consistency rule checks whether the transformer has a rate function defined
@@ -141,6 +147,7 @@ class Transformer(AbstractNode):
         logCheckPassed("P7", passed, indentation=3)
         return passed
 
+    @cachedRuleResult
     def safetyCheckR5a(self, state):
         """
         This safety rule checks whether the transformer rate is safe on nominal voltage
@@ -181,6 +188,7 @@ class Transformer(AbstractNode):
         logCheckPassed("R5a", passed, indentation=3)
         return passed
 
+    @cachedRuleResult
     def safetyCheckR5b(self, state):
         """
         This safety rule checks whether the transformer rate is safe on actual voltage
@@ -266,14 +274,6 @@ class Transformer(AbstractNode):
             logError("Unknown exception or error: %s" % e.message, indentation=2)
         return checkStatus
 
-    def generateBroConsistencyCheck(self):
-        """Generate consistency check bro rules for this compnent."""
-        pass
-
-    def generateBroSafetyCheck(self):
-        """Generate safety check bro rules for this compnent."""
-        pass
-
     def calculateCommandEffects(self, state):
         """
         Calculates the (currently local) effect of a tap position change command.
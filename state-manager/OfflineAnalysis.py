@@ -0,0 +1,231 @@
+#!/usr/bin/python
+# -*- coding: utf-8 -*-
+'''
+
+The offline analysis evaluates a directory of archived traffic captures (pcap/pcapng) without replaying them.
+Every capture is analyzed in its own worker process: Bro reads the capture and exports the values as compact records
+(T104_CompactExport.bro), a StateManager instance processes the records in order of their timestamps. The automatic evaluations
+of the evaluation scheduler run on the capture time (so transient violations raise alerts) and all rules are evaluated at the end of the capture.
+Alerts (warnings of the rule evaluation and command evaluation), results and timing are written as JSON summary per capture.
+Exported records are kept next to the summaries and reused as long as the capture is unchanged,
+so a re-analysis after a rule change only repeats the evaluation.
+Usage: python OfflineAnalysis.py <Alpha|Masterthesis> <capture directory> [workers] [result directory]
+'''
+import glob
+import json
+import logging
+import os
+import subprocess
+import sys
+import time
+from multiprocessing import Pool
+
+from StateManager import StateManager, RTU_CONFIGURATION_FILE
+from TestTopologies import SCENARIO_TOPOLOGIES
+
+logger = logging.getLogger(__name__)
+
+OFFLINE_WORKERS = 4
+OFFLINE_RESULT_PATH = "/data/offline/"
+OFFLINE_SUMMARY_FILENAME = "OfflineAnalysisSummary.json"
+CAPTURE_EXTENSIONS = [".pcap", ".pcapng"]
+BRO_SCRIPT_PATH = "/data/pythontests/"
+BRO_COMMAND = ["bro", "-C", "-r", "%(capture)s", "T104_CompactExport.bro", "t104.evt",
+               "T104_CompactExport::COMPACT_EXPORT_FILE=%(records)s", "T104_CompactExport::COMPACT_EXPORT_BUFFERED=T"]
+ALERT_LIMIT = 1000
+
+workerTopologies = dict()
+
+
+class AlertCollector(logging.Handler):
+    def __init__(self):
+        """Initialize a logging handler that collects warnings and errors as alerts."""
+        logging.Handler.__init__(self, logging.WARNING)
+        self.alerts = []
+        self.alertCount = 0
+
+    def emit(self, record):
+        """
+        Collect a log record.
+        :param record: Log record
+        """
+        self.alertCount += 1
+        if len(self.alerts) < ALERT_LIMIT:
+            self.alerts.append("%s: %s" % (record.levelname, record.getMessage().strip()))
+
+    def reset(self):
+        """Drop all collected alerts."""
+        self.alerts = []
+        self.alertCount = 0
+
+
+alertCollector = AlertCollector()
+
+
+def findCaptures(captureDirectory):
+    """
+    Return all capture files of a directory.
+    :param captureDirectory: Directory with pcap/pcapng files
+    :return: Sorted list of paths
+    """
+    captures = []
+    for extension in CAPTURE_EXTENSIONS:
+        captures.extend(glob.glob(os.path.join(captureDirectory, "*%s" % extension)))
+    return sorted(captures)
+
+
+def getCaptureName(captureFilename):
+    """
+    Return the name of a capture (filename without directory, the extension is kept so x.pcap and x.pcapng get different results).
+    :param captureFilename: Path to capture
+    :return: Capture name
+    """
+    return os.path.basename(captureFilename)
+
+
+def exportCapture(captureFilename, recordFilename):
+    """
+    Export the values of a capture as compact records with Bro (skipped if the records are newer than the capture).
+    :param captureFilename: Path to capture
+    :param recordFilename: Path to record file
+    :return: True if Bro was run, False if existing records were reused
+    """
+    if os.path.exists(recordFilename) and os.path.getmtime(recordFilename) >= os.path.getmtime(captureFilename):
+        return False
+    temporaryFilename = "%s.tmp" % recordFilename
+    if os.path.exists(temporaryFilename):
+        os.remove(temporaryFilename)
+    parameters = {"capture": os.path.abspath(captureFilename), "records": os.path.abspath(temporaryFilename)}
+    with open(os.devnull, "w") as devnull:
+        subprocess.check_call([p % parameters for p in BRO_COMMAND], cwd=BRO_SCRIPT_PATH, stdout=devnull)
+    if not os.path.exists(temporaryFilename):
+        # No IEC-104 values in capture
+        open(temporaryFilename, "w").close()
+    os.rename(temporaryFilename, recordFilename)
+    return True
+
+
+def analyzeRecords(recordFilename, topology, scenario, rtuConfigurationFilename):
+    """
+    Process all records of a record file with a new StateManager instance and evaluate all rules at the end.
+    Before every record the RTUs that are due at the time of the record are evaluated (automatic evaluation on capture time).
+    :param recordFilename: Path to record file
+    :param topology: Topology list of RTUs
+    :param scenario: Scenario topology like "Masterthesis" or "Alpha"
+    :param rtuConfigurationFilename: Path to RTU configuration (csv format)
+    :return: Dictionary with the results (values, automatic evaluations and their violations, consistency and safety at the end)
+    """
+    stateManager = StateManager(topology, scenario, eventCoalescing=False)
+    stateManager.initializeTagConverters(rtuConfigurationFilename)
+    stateManager.initializeCompactTransport(recordFilename)
+    reader = stateManager.compactRecordReader
+    evaluations = 0
+    violations = 0
+    lastTime = None
+    position = None
+    while reader.file is None or position <> reader.file.tell():
+        position = reader.file.tell() if reader.file else None
+        for timestamp, tagName, context, value in reader.readValues():
+            if timestamp <> lastTime:
+                lastTime = timestamp
+                result = stateManager.runAutomaticEvaluation(timestamp)
+                if result:
+                    evaluations += 1
+                    violations += 0 if result[0] and result[1] else 1
+            stateManager.processRecieved(int(timestamp), tagName, context, value, now=timestamp)
+        if reader.file is None:
+            raise IOError("Record file %s not found." % recordFilename)
+    consistency, safety = stateManager.evaluateTopology()
+    stateManager.finish(printValues=False, printStatistics=False)
+    return {"records": reader.receivedCount, "unknownRecords": reader.unknownCount, "values": stateManager.receivedCount,
+            "evaluations": evaluations, "violatingEvaluations": violations, "consistency": consistency, "safety": safety}
+
+
+def initializeWorker():
+    """Collect the warnings of a worker process as alerts (no other log output)."""
+    rootLogger = logging.getLogger()
+    for handler in list(rootLogger.handlers):
+        rootLogger.removeHandler(handler)
+    rootLogger.addHandler(alertCollector)
+    rootLogger.setLevel(logging.WARNING)
+
+
+def analyzeCapture(task):
+    """
+    Analyze a capture in a worker process and write its summary.
+    :param task: (captureFilename, scenario, rtuConfigurationFilename, resultPath) tuple
+    :return: Summary dictionary
+    """
+    captureFilename, scenario, rtuConfigurationFilename, resultPath = task
+    captureName = getCaptureName(captureFilename)
+    summary = {"capture": captureFilename, "scenario": scenario, "error": None}
+    alertCollector.reset()
+    startTime = time.time()
+    try:
+        # The grid components register globally, the topology is only created once per worker process
+        if not workerTopologies.has_key(scenario):
+            workerTopologies[scenario] = SCENARIO_TOPOLOGIES[scenario]()
+        recordFilename = os.path.join(resultPath, "%s.hex" % captureName)
+        summary["exported"] = exportCapture(captureFilename, recordFilename)
+        exportTime = time.time()
+        summary.update(analyzeRecords(recordFilename, workerTopologies[scenario], scenario, rtuConfigurationFilename))
+        summary["timing"] = {"export": exportTime - startTime, "analysis": time.time() - exportTime}
+    except Exception, e:
+        summary["error"] = "%s: %s" % (type(e).__name__, e)
+    summary["timing"] = dict(summary.get("timing", dict()), total=time.time() - startTime)
+    summary["alertCount"] = alertCollector.alertCount
+    summary["alerts"] = alertCollector.alerts
+    with open(os.path.join(resultPath, "%s.json" % captureName), "w") as summaryFile:
+        json.dump(summary, summaryFile, indent=2, sort_keys=True)
+    return summary
+
+
+def runOfflineAnalysis(captureDirectory, scenario, rtuConfigurationFilename=None, resultPath=OFFLINE_RESULT_PATH, workers=OFFLINE_WORKERS):
+    """
+    Analyze all captures of a directory in parallel worker processes.
+    :param captureDirectory: Directory with pcap/pcapng files
+    :param scenario: Scenario topology like "Masterthesis" or "Alpha"
+    :param rtuConfigurationFilename: Path to RTU configuration (RTU_CONFIGURATION_FILE of the scenario if not given)
+    :param resultPath: Directory for records and summaries
+    :param workers: Number of worker processes
+    :return: List of summary dictionaries in order of the captures
+    """
+    assert SCENARIO_TOPOLOGIES.has_key(scenario)
+    rtuConfigurationFilename = os.path.abspath(rtuConfigurationFilename or RTU_CONFIGURATION_FILE % scenario)
+    if not os.path.isdir(resultPath):
+        os.makedirs(resultPath)
+    captures = findCaptures(captureDirectory)
+    tasks = [(c, scenario, rtuConfigurationFilename, resultPath) for c in captures]
+    logger.warning("Analyzing %d captures of %s with %d workers." % (len(captures), captureDirectory, workers))
+    startTime = time.time()
+    summaries = dict()
+    pool = Pool(workers, initializer=initializeWorker)
+    try:
+        for summary in pool.imap_unordered(analyzeCapture, tasks):
+            summaries[summary["capture"]] = summary
+            if summary["error"]:
+                result = "ERROR %s" % summary["error"]
+            else:
+                result = "Consistency: %s, Safety: %s, %d of %d automatic evaluations violated, %d alerts" % (
+                    summary["consistency"], summary["safety"], summary["violatingEvaluations"], summary["evaluations"], summary["alertCount"])
+            logger.warning("[%d/%d] %s (%.1fs): %s" % (len(summaries), len(captures), getCaptureName(summary["capture"]),
+                                                       summary["timing"]["total"], result))
+    finally:
+        pool.close()
+        pool.join()
+    totalTime = time.time() - startTime
+    overview = {"captureDirectory": captureDirectory, "scenario": scenario, "workers": workers, "totalTime": totalTime,
+                "captures": [dict([(k, v) for k, v in summaries[c].iteritems() if k <> "alerts"]) for c in captures]}
+    with open(os.path.join(resultPath, OFFLINE_SUMMARY_FILENAME), "w") as overviewFile:
+        json.dump(overview, overviewFile, indent=2, sort_keys=True)
+    logger.warning("Analyzed %d captures in %.1fs (%d errors)." % (len(captures), totalTime, len([s for s in summaries.values() if s["error"]])))
+    return [summaries[c] for c in captures]
+
+
+if __name__ == '__main__':
+    if len(sys.argv) < 3 or sys.argv[1] not in SCENARIO_TOPOLOGIES:
+        print __doc__
+        sys.exit(1)
+    logging.basicConfig(level=logging.WARNING, format="%(asctime)s %(message)s")
+    runOfflineAnalysis(sys.argv[2], sys.argv[1], workers=int(sys.argv[3]) if len(sys.argv) > 3 else OFFLINE_WORKERS,
+                       resultPath=sys.argv[4] if len(sys.argv) > 4 else OFFLINE_RESULT_PATH)
@@ -0,0 +1,465 @@
+#!/usr/bin/python
+# -*- coding: utf-8 -*-
+'''
+
+The power flow estimation calculates the effects of switch and transformer commands on all lines of a topology
+with a linearized (DC) power flow on the topology graph (see TopologyGraph.py).
+Line flows are the measured currents times the nominal voltage of the line, so flows are preserved by transformers.
+Every node is balanced, one generator per island is the slack node. Without impedance data all lines have the same admittance.
+The estimated flows after a switch command are the measured flows plus the change of the modelled flows between
+the topology before and after the command; lines out of service and lines of islands without generator carry no current.
+Lines without measured current are assumed to carry no current, their meters are not updated.
+A transformer tap change scales voltages and currents of all lines of the voltage zone behind the transformer.
+The sparse LU factorization of the grid is cached per set of lines in service, so repeated commands only need two solves.
+Switch openings are estimated with line outage distribution factors (LODF: share of the flow of an opened line that shifts
+to every other line) of the observed switch states; they are calculated again only when an observed switch, fuse or protective relay changes.
+Calculated states with other lines in service (e.g. later steps of a command sequence) use the cached factorizations instead.
+With them all line openings can be screened against the current limits of R1 and R4 at once.
+Lines whose opening creates an island (no parallel path) are estimated with the factorization of the grid without the line.
+Requires numpy and scipy.
+'''
+from collections import OrderedDict
+from threading import Lock
+
+from GridComponents.Generator import Generator
+from GridComponents.Switch import Switch
+from GridComponents.Transformer import Transformer
+from StateManagerUtilities import isZero, ZERO_TOLERANCE
+from TopologyGraph import numpy, StateVector
+from ValueStore import ValueNotStoredException, OverlayValueStore
+
+if numpy:
+    import scipy.sparse
+    import scipy.sparse.csgraph
+    import scipy.sparse.linalg
+
+POWER_FLOW_LINE_ADMITTANCE = 1.0
+POWER_FLOW_FACTORIZATION_CACHE_SIZE = 32
+LINE_OUTAGE_DENSE_MAX_LINES = 2048
+LINE_OUTAGE_BATCH_SIZE = 256
+LINE_OUTAGE_ISLAND_TOLERANCE = 1e-09
+
+
+class PowerFlowFactorization():
+    def __init__(self, solver, inService):
+        """
+        Factorize the grid with the given lines in service.
+        :param solver: PowerFlowSolver
+        :param inService: Boolean numpy array per line: line in service
+        """
+        graph = solver.graph
+        self.inService = inService
+        self.incidence = graph.incidence[:, inService]
+        laplacian = (self.incidence * scipy.sparse.diags(solver.admittances[inService]) * self.incidence.T).tocsr()
+        # lines with only one node in the topology connect to the rest of the grid (grounded)
+        grounded = abs(self.incidence).dot((abs(self.incidence).sum(axis=0).A1 == 1).astype(numpy.float64)) > 0
+        adjacency = abs(self.incidence) * abs(self.incidence).T
+        count, labels = scipy.sparse.csgraph.connected_components(adjacency, directed=False)
+        self.energized = numpy.zeros(len(graph.nodes), dtype=bool)
+        unknown = numpy.zeros(len(graph.nodes), dtype=bool)
+        for component in range(count):
+            members = labels == component
+            if grounded[members].any():
+                self.energized |= members
+                unknown |= members
+            elif solver.generators[members].any():
+                self.energized |= members
+                unknown |= members
+                unknown[numpy.flatnonzero(members & solver.generators)[0]] = False
+        self.unknown = numpy.flatnonzero(unknown)
+        self.slack = self.energized & ~unknown
+        self.degrees = abs(self.incidence).sum(axis=1).A1
+        self.lu = None
+        if len(self.unknown):
+            self.lu = scipy.sparse.linalg.splu(laplacian[self.unknown][:, self.unknown].tocsc())
+        # energized lines: in service and all nodes in the topology energized
+        deenergizedLines = abs(graph.incidence).T.dot((~self.energized).astype(numpy.float64)) > 0
+        self.energizedLines = inService & ~deenergizedLines
+        # voltage zones: lines connected by nodes which are no transformers
+        zoneIncidence = abs(graph.incidence)[~solver.transformers][:, inService]
+        zoneCount, zoneLabels = scipy.sparse.csgraph.connected_components(zoneIncidence.T * zoneIncidence, directed=False)
+        self.zones = numpy.full(len(graph.lines), -1, dtype=numpy.intp)
+        self.zones[inService] = zoneLabels
+        self.admittances = solver.admittances[inService]
+
+    def solve(self, injections):
+        """
+        Calculate the modelled line flows for node injections (injections of slack nodes and de-energized nodes are ignored).
+        :param injections: numpy array per node: flow out of the node into the lines (or matrix with one column per case)
+        :return: numpy array per line: flow from start to end, 0 for lines out of service (or matrix with one column per case)
+        """
+        angles = numpy.zeros(injections.shape)
+        if self.lu is not None:
+            angles[self.unknown] = self.lu.solve(injections[self.unknown])
+        flows = numpy.zeros((len(self.inService),) + injections.shape[1:])
+        flows[self.inService] = self.admittances.reshape((-1,) + (1,) * (injections.ndim - 1)) * self.incidence.T.dot(angles)
+        return flows
+
+
+class LineOutageFactors():
+    def __init__(self, solver, inService):
+        """
+        Initialize the line outage distribution factors of the grid with the given lines in service.
+        The factors of all lines are calculated at once (matrix) for up to LINE_OUTAGE_DENSE_MAX_LINES lines,
+        otherwise per opened line on first use.
+        :param solver: PowerFlowSolver
+        :param inService: Boolean numpy array per line: line in service
+        """
+        self.graph = solver.graph
+        self.inService = inService
+        self.factorization = solver.getFactorization(inService)
+        self.incidence = self.graph.incidence.tocsc()
+        self.factors = dict()
+        self.matrix = None
+        self.islands = None
+        if len(self.graph.lines) <= LINE_OUTAGE_DENSE_MAX_LINES:
+            outages = numpy.flatnonzero(inService)
+            self.matrix = numpy.zeros((len(self.graph.lines), len(self.graph.lines)))
+            self.islands = numpy.zeros(len(self.graph.lines), dtype=bool)
+            self.matrix[:, outages], self.islands[outages] = self.calculateFactors(outages)
+            self.matrix[:, self.islands] = 0.0
+
+    def calculateFactors(self, outages):
+        """
+        Calculate the factors of opened lines: flow change of every line per flow of the opened line.
+        A line to a node without other lines (e.g. consumer) cuts this node off, its flow is taken from the other node of the line.
+        :param outages: numpy array of line positions (lines in service)
+        :return: (matrix with one column per opened line, boolean numpy array: opening creates another island)
+        """
+        if not len(outages):
+            return numpy.zeros((len(self.graph.lines), 0)), numpy.zeros(0, dtype=bool)
+        factorization = self.factorization
+        transfers = factorization.solve(self.incidence[:, outages].toarray())
+        own = transfers[outages, numpy.arange(len(outages))]
+        islands = numpy.abs(1.0 - own) < LINE_OUTAGE_ISLAND_TOLERANCE
+        factors = transfers / numpy.where(islands, 1.0, 1.0 - own)
+        cutOff = []
+        for i in numpy.flatnonzero(islands):
+            column = self.incidence[:, outages[i]]
+            nodes, signs = column.indices, column.data
+            if len(nodes) == 2:
+                leaves = factorization.degrees[nodes] == 1
+                if leaves.sum() == 1 and not factorization.slack[nodes[leaves][0]]:
+                    cutOff.append((i, nodes[~leaves][0], signs[~leaves][0]))
+        if cutOff:
+            injections = numpy.zeros((len(self.graph.nodes), len(cutOff)))
+            injections[[u for i, u, sign in cutOff], numpy.arange(len(cutOff))] = 1.0
+            distributions = factorization.solve(injections)
+            for j, (i, u, sign) in enumerate(cutOff):
+                factors[:, i] = sign * distributions[:, j]
+                islands[i] = False
+        factors[outages, numpy.arange(len(outages))] = -1.0
+        return factors, islands
+
+    def getFactors(self, k):
+        """
+        Return the factors of an opened line.
+        :param k: Position of line (in service)
+        :return: numpy array per line or None if the opening creates an island
+        """
+        if self.matrix is not None:
+            return None if self.islands[k] else self.matrix[:, k]
+        if k not in self.factors:
+            factors, islands = self.calculateFactors(numpy.array([k]))
+            self.factors[k] = None if islands[0] else factors[:, 0]
+        return self.factors[k]
+
+    def getFactorMatrix(self, outages):
+        """
+        Return the factors of several opened lines (calculated factors are reused, missing factors are not stored).
+        :param outages: numpy array of line positions
+        :return: (matrix with one column per opened line (0 for lines out of service), boolean numpy array: opening creates another island)
+        """
+        if self.matrix is not None:
+            return self.matrix[:, outages], self.islands[outages]
+        factors = numpy.zeros((len(self.graph.lines), len(outages)))
+        islands = numpy.zeros(len(outages), dtype=bool)
+        missing = []
+        for i, k in enumerate(outages):
+            if not self.inService[k]:
+                continue
+            if k not in self.factors:
+                missing.append(i)
+            elif self.factors[k] is None:
+                islands[i] = True
+            else:
+                factors[:, i] = self.factors[k]
+        if missing:
+            factors[:, missing], islands[missing] = self.calculateFactors(outages[missing])
+        return factors, islands
+
+    def getModelledFlows(self, flows):
+        """
+        Return the modelled flows for the node injections of measured flows.
+        :param flows: numpy array per line: measured flows
+        :return: numpy array per line: modelled flows
+        """
+        return self.factorization.solve(self.graph.incidence.dot(numpy.where(self.inService, flows, 0.0)))
+
+    def estimateFlows(self, flows, k, modelledFlows=None):
+        """
+        Estimate the line flows after opening a line (same result as PowerFlowSolver.estimateFlows).
+        :param flows: numpy array per line: measured flows
+        :param k: Position of opened line
+        :param modelledFlows: Result of getModelledFlows (calculated if not given)
+        :return: numpy array per line: estimated flows or None if the opening creates an island
+        """
+        estimated = flows.copy()
+        if self.inService[k]:
+            factors = self.getFactors(k)
+            if factors is None:
+                return None
+            if modelledFlows is None:
+                modelledFlows = self.getModelledFlows(flows)
+            estimated += factors * modelledFlows[k]
+        estimated[~self.factorization.energizedLines] = 0.0
+        estimated[k] = 0.0
+        return estimated
+
+
+class PowerFlowSolver():
+    def __init__(self, graph):
+        """
+        Initialize the power flow estimation of a topology.
+        :param graph: TopologyGraph of the topology
+        """
+        assert numpy, "PowerFlowSolver requires numpy and scipy."
+        self.graph = graph
+        self.admittances = numpy.full(len(graph.lines), POWER_FLOW_LINE_ADMITTANCE)
+        self.nominalVoltages = numpy.array([float(l.nominalV) for l in graph.lines])
+        self.generators = numpy.array([isinstance(n, Generator) for n in graph.nodes], dtype=bool)
+        self.transformers = numpy.array([isinstance(n, Transformer) for n in graph.nodes], dtype=bool)
+        self.deviceKeys = []
+        deviceLines = []
+        for j, l in enumerate(graph.lines):
+            for device in [l.startSwitch, l.endSwitch, l.startFuse, l.endFuse, l.startProtectiveRelay, l.endProtectiveRelay]:
+                if device:
+                    self.deviceKeys.append(device.stateKey)
+                    deviceLines.append(j)
+        self.deviceStates = StateVector(self.deviceKeys)
+        self.lineDevices = scipy.sparse.csr_matrix((numpy.ones(len(deviceLines)), (deviceLines, range(len(deviceLines)))),
+                                                   shape=(len(graph.lines), len(self.deviceKeys)))
+        self.currentLimits = numpy.array([float(l.maxI) for l in graph.lines])
+        self.cuttingCurrents = numpy.array([min([float(d.cuttingI) for d in [l.startFuse, l.endFuse, l.startProtectiveRelay, l.endProtectiveRelay] if d] or
+                                                [numpy.inf]) for l in graph.lines])
+        # lowest current limit of R1 (maxI of line) and R4 (cutting current of fuses and protective relays) per line
+        self.lineLimits = numpy.minimum(self.currentLimits, self.cuttingCurrents)
+        self.factorizations = OrderedDict()
+        self.lineOutageFactors = None
+        self.lock = Lock()
+        self.lineOutageLock = Lock()
+
+    def retrieveDeviceStates(self, state):
+        """
+        Read the states of all switches, fuses and protective relays (unknown states are assumed to be closed).
+        :param state: State object
+        :return: Boolean numpy array per device: closed
+        """
+        values, known = self.deviceStates.retrieve(state)
+        return ~known | (values != 0)
+
+    def getLinesInService(self, closed):
+        """
+        Return the lines whose switches, fuses and protective relays are all closed.
+        :param closed: Boolean numpy array per device: closed
+        :return: Boolean numpy array per line
+        """
+        return self.lineDevices.dot((~closed).astype(numpy.float64)) == 0
+
+    def getFactorization(self, inService):
+        """
+        Return the (cached) factorization of the grid with the given lines in service.
+        :param inService: Boolean numpy array per line
+        :return: PowerFlowFactorization
+        """
+        key = inService.tobytes()
+        with self.lock:
+            factorization = self.factorizations.pop(key, None)
+            if factorization is None:
+                factorization = PowerFlowFactorization(self, inService)
+            self.factorizations[key] = factorization
+            while len(self.factorizations) > POWER_FLOW_FACTORIZATION_CACHE_SIZE:
+                self.factorizations.popitem(last=False)
+        return factorization
+
+    def getLineOutageFactors(self, state):
+        """
+        Return the line outage distribution factors of the observed state (base of calculated states),
+        calculated again only if its lines in service changed.
+        :param state: State object (observed or calculated)
+        :return: LineOutageFactors
+        """
+        while isinstance(state, OverlayValueStore):
+            state = state.baseStore
+        inService = self.getLinesInService(self.retrieveDeviceStates(state))
+        with self.lineOutageLock:
+            factors = self.lineOutageFactors
+            if factors is None or not numpy.array_equal(factors.inService, inService):
+                factors = LineOutageFactors(self, inService)
+                self.lineOutageFactors = factors
+        return factors
+
+    def retrieveFlows(self, values, known):
+        """
+        Return the measured line flows (current at start of line, or at end if unknown, times nominal voltage).
+        :param values: numpy array of meter values (see TopologyGraph.retrieveValues)
+        :param known: Boolean numpy array: value known and valid
+        :return: (numpy array per line: flow, boolean numpy array per line: flow known)
+        """
+        graph = self.graph
+        currents = numpy.where(known[graph.startCurrent], values[graph.startCurrent], values[graph.endCurrent])
+        flowKnown = known[graph.startCurrent] | known[graph.endCurrent]
+        return numpy.where(flowKnown, currents, 0.0) * self.nominalVoltages, flowKnown
+
+    def estimateFlows(self, flows, inServiceBefore, inServiceAfter):
+        """
+        Estimate the line flows after a change of the lines in service.
+        :param flows: numpy array per line: measured flows before the change
+        :param inServiceBefore: Boolean numpy array per line: lines in service before the change
+        :param inServiceAfter: Boolean numpy array per line: lines in service after the change
+        :return: numpy array per line: estimated flows
+        """
+        before = self.getFactorization(inServiceBefore)
+        after = self.getFactorization(inServiceAfter)
+        injections = self.graph.incidence.dot(numpy.where(inServiceBefore, flows, 0.0))
+        estimated = flows + after.solve(injections) - before.solve(injections)
+        estimated[~after.energizedLines] = 0.0
+        return estimated
+
+    def updateCurrents(self, state, currents, flowKnown, estimatedCurrents):
+        """
+        Write changed currents to both meters of the lines with known current.
+        :param state: Calculated State object (is modified)
+        :param currents: numpy array per line: currents before the command
+        :param flowKnown: Boolean numpy array per line: current known
+        :param estimatedCurrents: numpy array per line: estimated currents
+        """
+        graph = self.graph
+        for j in numpy.flatnonzero(flowKnown & (numpy.abs(estimatedCurrents - currents) > ZERO_TOLERANCE)):
+            state.updateValue(graph.keys[graph.startCurrent[j]], abs(float(estimatedCurrents[j])))
+            state.updateValue(graph.keys[graph.endCurrent[j]], abs(float(estimatedCurrents[j])))
+
+    def calculateSwitchEffects(self, switch, state):
+        """
+        Calculate the effect of a switch position change on the currents of all lines.
+        Closing a line that carries current and opening a line without current have no effect (switch already in position).
+        :param switch: Commanded switch
+        :param state: Calculated State object with new switch position (is modified)
+        :return: True if successful, False if calculation was not possible (missing values)
+        """
+        try:
+            newPosition = state.retrieveValue(switch.stateKey)
+            lineCurrent = state.retrieveValue(switch.connectedLine.getLocalComponent(switch.connectedNode, "local", "meter").currentKey)
+        except ValueNotStoredException:
+            return False
+        if bool(newPosition) != isZero(lineCurrent):
+            return True
+        values, known = self.graph.retrieveValues(state)
+        flows, flowKnown = self.retrieveFlows(values, known)
+        closed = self.retrieveDeviceStates(state)
+        inServiceAfter = self.getLinesInService(closed)
+        closed[self.deviceStates.keyIndex[switch.stateKey]] = not newPosition
+        inServiceBefore = self.getLinesInService(closed)
+        estimated = None
+        if not newPosition:
+            factors = self.getLineOutageFactors(state)
+            if numpy.array_equal(factors.inService, inServiceBefore):
+                estimated = factors.estimateFlows(flows, self.graph.lineIndex[switch.connectedLine.name])
+        if estimated is None:
+            estimated = self.estimateFlows(flows, inServiceBefore, inServiceAfter)
+        self.updateCurrents(state, flows / self.nominalVoltages, flowKnown, estimated / self.nominalVoltages)
+        return True
+
+    def screenLineOutages(self, state, lines=None):
+        """
+        Screen the opening of lines against the current limits of R1 (maxI of line) and R4 (cutting current of fuses and protective relays).
+        :param state: State object (observed or calculated)
+        :param lines: Lines to open (all lines of the topology if not given)
+        :return: Dictionary line name -> names of lines with estimated current above a limit after opening the line
+        """
+        values, known = self.graph.retrieveValues(state)
+        flows, flowKnown = self.retrieveFlows(values, known)
+        inService = self.getLinesInService(self.retrieveDeviceStates(state))
+        factors = self.getLineOutageFactors(state)
+        if not numpy.array_equal(factors.inService, inService):
+            # Calculated state with other lines in service than the observed state: factors only for this screening
+            factors = LineOutageFactors(self, inService)
+        outages = numpy.array([self.graph.lineIndex[l.name] for l in lines] if lines is not None else range(len(self.graph.lines)), dtype=numpy.intp)
+        modelledFlows = factors.getModelledFlows(flows)
+        result = dict()
+        for start in range(0, len(outages), LINE_OUTAGE_BATCH_SIZE):
+            # one column per opened line
+            batch = outages[start:start + LINE_OUTAGE_BATCH_SIZE]
+            matrix, islands = factors.getFactorMatrix(batch)
+            estimated = flows[:, None] + matrix * modelledFlows[batch]
+            for i in numpy.flatnonzero(islands):
+                inServiceAfter = inService.copy()
+                inServiceAfter[batch[i]] = False
+                estimated[:, i] = self.estimateFlows(flows, inService, inServiceAfter)
+            estimated[~factors.factorization.energizedLines] = 0.0
+            estimated[batch, numpy.arange(len(batch))] = 0.0
+            currents = numpy.abs(estimated) / self.nominalVoltages[:, None]
+            violated = flowKnown[:, None] & (currents > self.lineLimits[:, None])
+            for i, k in enumerate(batch):
+                result[self.graph.lines[k].name] = [self.graph.lines[j].name for j in numpy.flatnonzero(violated[:, i])]
+        return result
+
+    def getOverloadedLines(self, state):
+        """
+        Return the lines whose current is above the current limits of R1 and R4 (e.g. in a calculated state after a command).
+        :param state: State object (observed or calculated)
+        :return: Names of lines with current above a limit
+        """
+        values, known = self.graph.retrieveValues(state)
+        flows, flowKnown = self.retrieveFlows(values, known)
+        violated = flowKnown & (numpy.abs(flows) / self.nominalVoltages > self.lineLimits)
+        return [self.graph.lines[j].name for j in numpy.flatnonzero(violated)]
+
+    def calculateTransformerEffects(self, transformer, state):
+        """
+        Calculate the effect of a tap position change on the voltages and currents of the voltage zone behind the transformer.
+        :param transformer: Commanded transformer
+        :param state: Calculated State object with new tap position (is modified)
+        :return: True if successful, False if calculation was not possible (missing values)
+        """
+        if not callable(transformer.rateFunction):
+            return False
+        try:
+            measuredInVoltage = transformer.linesIn[0].retrieveValue(state, transformer, "local", "voltage")
+            measuredInCurrent = transformer.linesIn[0].retrieveValue(state, transformer, "local", "current")
+            transformerRate = float(transformer.rateFunction(state.retrieveValue(transformer.tapPositionKey)))
+        except ValueNotStoredException:
+            return False
+        graph = self.graph
+        outLine = transformer.linesOut[0]
+        outMeter = outLine.getLocalComponent(transformer, "local", "meter")
+        expectedOutVoltage = measuredInVoltage / transformerRate
+        expectedOutCurrent = measuredInCurrent * transformerRate
+        values, known = graph.retrieveValues(state)
+        zone = self.getFactorization(self.getLinesInService(self.retrieveDeviceStates(state))).zones
+        j = graph.lineIndex[outLine.name]
+        zoneLines = numpy.flatnonzero(zone == zone[j]) if zone[j] >= 0 else numpy.array([], dtype=numpy.intp)
+        for key, expected, meterKeys in [(outMeter.voltageKey, expectedOutVoltage, [graph.startVoltage, graph.endVoltage]),
+                                         (outMeter.currentKey, expectedOutCurrent, [graph.startCurrent, graph.endCurrent])]:
+            i = graph.keyIndex[key]
+            if known[i] and not isZero(values[i]):
+                scale = expected / values[i]
+                for keys in meterKeys:
+                    for k in keys[zoneLines][known[keys[zoneLines]]]:
+                        state.updateValue(graph.keys[k], float(values[k] * scale))
+            state.updateValue(key, expected)
+        return True
+
+    def calculateCommandEffects(self, component, state):
+        """
+        Calculate the effects of a switch or transformer command on all lines of the topology.
+        Components outside of the topology graph calculate their (local) effects themselves.
+        :param component: Commanded switch or transformer
+        :param state: Calculated State object with commanded value (is modified)
+        :return: True if successful, False if calculation was not possible (missing values)
+        """
+        if isinstance(component, Switch) and component.connectedLine and component.connectedLine.name in self.graph.lineIndex:
+            return self.calculateSwitchEffects(component, state)
+        if isinstance(component, Transformer) and component.name in self.graph.nodeIndex:
+            return self.calculateTransformerEffects(component, state)
+        return component.calculateCommandEffects(state)
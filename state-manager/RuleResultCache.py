@@ -0,0 +1,113 @@
+#!/usr/bin/python
+# -*- coding: utf-8 -*-
+'''
+
+The rule result cache keeps the results of node rules evaluated on the observed state T_{o}.
+A result is reused as long as the versions of all tags read by the rule are unchanged, i.e. across command evaluations
+and automatic evaluations until one of its input values is updated or invalidated.
+Only the node rules are cached (R6 and R7 of the RTUs compare values of several nodes and are always evaluated).
+Every state manager instance caches the results of its own observed state.
+'''
+import logging
+from functools import wraps
+
+from LoggerUtilities import logCheckPassed
+from TopologyIndex import getInputTagsOfNode
+
+logger = logging.getLogger(__name__)
+
+ruleResultCaches = dict()
+
+
+class RuleResultCache():
+    def __init__(self, state):
+        """
+        Initialize an empty cache for the rule results of a state.
+        :param state: Cached state (observed state)
+        """
+        self.state = state
+        self.inputTags = dict()
+        self.results = dict()
+        self.hits = 0
+        self.misses = 0
+
+    def isCachedState(self, state):
+        """
+        Check whether results of a state are cached.
+        :param state: State object
+        :return: True if results of the state are cached
+        """
+        return state is self.state
+
+    def retrieveInputVersions(self, node):
+        """
+        Return the current versions of all tags read by the rules of a node.
+        :param node: Node
+        :return: Tuple of tag versions
+        """
+        if not self.inputTags.has_key(node.name):
+            self.inputTags[node.name] = tuple(sorted(getInputTagsOfNode(node)))
+        return tuple([self.state.retrieveVersion(t) for t in self.inputTags[node.name]])
+
+    def retrieveResult(self, node, ruleName, evaluate):
+        """
+        Return the cached result of a rule or evaluate it if one of its inputs changed.
+        :param node: Node
+        :param ruleName: Name of rule
+        :param evaluate: Function without arguments that evaluates the rule
+        :return: Result of rule
+        """
+        key = (ruleName, node.name)
+        inputVersions = self.retrieveInputVersions(node)
+        if self.results.has_key(key) and self.results[key][0] == inputVersions:
+            self.hits += 1
+            result = self.results[key][1]
+            logCheckPassed(ruleName, result, indentation=3)
+            return result
+        self.misses += 1
+        result = evaluate()
+        self.results[key] = (inputVersions, result)
+        return result
+
+    def printStatistics(self):
+        """Print statistics about the cache usage."""
+        logger.info("Cached rule results: %d entries, %d hits, %d evaluations." % (len(self.results), self.hits, self.misses))
+
+
+def enableRuleResultCache(state):
+    """
+    Cache the rule results of a state (previously cached results of the state are dropped).
+    :param state: Cached state (observed state)
+    :return: New RuleResultCache
+    """
+    cache = RuleResultCache(state)
+    ruleResultCaches[id(state)] = cache
+    return cache
+
+
+def disableRuleResultCache(state=None):
+    """
+    Stop caching rule results.
+    :param state: State whose results are dropped (results of all states if not given)
+    """
+    if state is None:
+        ruleResultCaches.clear()
+    else:
+        ruleResultCaches.pop(id(state), None)
+
+
+def cachedRuleResult(rule):
+    """
+    Decorator for the rules of a node. The rule name is taken from the method name (e.g. safetyCheckR1 -> R1).
+    :param rule: Rule method with the arguments (self, state)
+    :return: Rule method that uses the rule result cache for the cached state
+    """
+    ruleName = rule.__name__.replace("consistencyCheck", "").replace("safetyCheck", "")
+
+    @wraps(rule)
+    def cachedRule(self, state):
+        cache = ruleResultCaches.get(id(state))
+        if cache is None or not cache.isCachedState(state):
+            return rule(self, state)
+        return cache.retrieveResult(self, ruleName, lambda: rule(self, state))
+    return cachedRule
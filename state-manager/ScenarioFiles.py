@@ -0,0 +1,259 @@
+#!/usr/bin/python
+# -*- coding: utf-8 -*-
+'''
+
+Streaming parser of scenario files (.state) and a compiled binary scenario format.
+Both yield the events of a scenario one by one as ScenarioEvent records, so scenarios of any size are processed with constant memory.
+Compiled scenarios consist of fixed-width event records, a string table (tags, option texts) and an index of the WAIT segments
+(first event and virtual start time of every segment), so a reader can seek to a virtual time without reading the events before it.
+Usage: python ScenarioFiles.py <scenario file> [<scenario file> ...] (compiles the files next to the originals)
+'''
+import bisect
+import logging
+import os
+import struct
+import sys
+from collections import namedtuple
+
+logger = logging.getLogger(__name__)
+
+EVENT_TYPES = ["OPTION", "MEASUREMENT", "COMMAND", "WAIT", "C102"]
+OPTION_TYPES = ["name", "description"]
+COMPILED_EXTENSION = ".scn"
+COMPILED_MAGIC = "SCN1"
+COMPILED_VERSION = 1
+# magic, version, event count, string count, segment count, offset of string table, offset of segment index
+COMPILED_HEADER = struct.Struct("<4sHIIIQQ")
+# event type, value type, string index of key, value (string index for option texts)
+COMPILED_EVENT = struct.Struct("<BBId")
+# first event of segment, virtual start time of segment
+COMPILED_SEGMENT = struct.Struct("<Id")
+COMPILED_STRING_LENGTH = struct.Struct("<I")
+COMPILED_READ_EVENTS = 4096
+
+VALUE_NONE = 0
+VALUE_BOOL = 1
+VALUE_FLOAT = 2
+VALUE_STRING = 3
+NO_KEY = 0xFFFFFFFF
+
+# eventType: one of EVENT_TYPES
+# key: option type (OPTION), tag name (MEASUREMENT, COMMAND, C102) or None (WAIT)
+# value: option text (OPTION), bool or float (MEASUREMENT, COMMAND), duration in seconds (WAIT) or None (C102)
+ScenarioEvent = namedtuple("ScenarioEvent", ["eventType", "key", "value"])
+
+
+def parseScenarioLine(line, lineNumber=0):
+    """
+    Parse a line of a scenario file.
+    :param line: Line of scenario file
+    :param lineNumber: Line number (for error messages)
+    :return: ScenarioEvent or None for empty lines, comments and unknown options
+    """
+    line = line.strip()
+    if not line or line.startswith("#"):
+        return None
+    tmp = line.split(" ")
+    eventType = tmp[0]
+    if eventType == "OPTION":
+        optionType = tmp[1]
+        if optionType in OPTION_TYPES:
+            return ScenarioEvent(eventType, optionType, line[len("OPTION %s " % optionType):])
+        return None
+    elif eventType == "MEASUREMENT" or eventType == "COMMAND":
+        valueType = tmp[1]
+        value = tmp[3]
+        if valueType == "B":
+            assert value == "True" or value == "False"
+            value = True if value == "True" else False
+        elif valueType == "F":
+            value = float(value)
+        else:
+            logger.error("Line %d: Unknown valueType: %s" % (lineNumber, valueType))
+            assert False
+        return ScenarioEvent(eventType, tmp[2], value)
+    elif eventType == "WAIT":
+        return ScenarioEvent(eventType, None, float(tmp[1]))
+    elif eventType == "C102":
+        return ScenarioEvent(eventType, tmp[1], None)
+    else:
+        logger.error("Line %d: Unknown eventType: %s" % (lineNumber, eventType))
+        assert False
+
+
+def iterTextScenario(filename):
+    """
+    Yield the events of a scenario file in text format.
+    :param filename: Absolute or relative filepath of scenario file
+    :return: Generator of ScenarioEvent records
+    """
+    with open(filename, "r") as f:
+        for i, line in enumerate(f, 1):
+            event = parseScenarioLine(line, i)
+            if event is not None:
+                yield event
+
+
+def isCompiledScenario(filename):
+    """
+    Check whether a scenario file is in compiled format.
+    :param filename: Absolute or relative filepath of scenario file
+    :return: True if compiled
+    """
+    with open(filename, "rb") as f:
+        return f.read(len(COMPILED_MAGIC)) == COMPILED_MAGIC
+
+
+def getCompiledFilename(filename):
+    """
+    Return the filename of the compiled version of a scenario file.
+    :param filename: Absolute or relative filepath of scenario file (text format)
+    :return: Filepath of compiled scenario file
+    """
+    return os.path.splitext(filename)[0] + COMPILED_EXTENSION
+
+
+def compileScenarioFile(filename, compiledFilename=None):
+    """
+    Compile a scenario file (streamed, the memory needed only depends on the number of distinct strings and WAIT events).
+    :param filename: Absolute or relative filepath of scenario file (text format)
+    :param compiledFilename: Filepath of compiled scenario file (getCompiledFilename if not given)
+    :return: Filepath of compiled scenario file
+    """
+    compiledFilename = compiledFilename or getCompiledFilename(filename)
+    strings = dict()
+    segments = [(0, 0.0)]
+    eventCount = 0
+    virtualTime = 0.0
+
+    def stringIndex(s):
+        if s not in strings:
+            strings[s] = len(strings)
+        return strings[s]
+
+    temporaryFilename = "%s.tmp" % compiledFilename
+    with open(temporaryFilename, "wb") as f:
+        f.write(COMPILED_HEADER.pack(COMPILED_MAGIC, COMPILED_VERSION, 0, 0, 0, 0, 0))
+        for event in iterTextScenario(filename):
+            eventType = EVENT_TYPES.index(event.eventType)
+            keyIndex = NO_KEY if event.key is None else stringIndex(event.key)
+            if event.eventType == "OPTION":
+                f.write(COMPILED_EVENT.pack(eventType, VALUE_STRING, keyIndex, stringIndex(event.value)))
+            elif event.value is None:
+                f.write(COMPILED_EVENT.pack(eventType, VALUE_NONE, keyIndex, 0.0))
+            elif type(event.value) == bool:
+                f.write(COMPILED_EVENT.pack(eventType, VALUE_BOOL, keyIndex, 1.0 if event.value else 0.0))
+            else:
+                f.write(COMPILED_EVENT.pack(eventType, VALUE_FLOAT, keyIndex, event.value))
+            eventCount += 1
+            if event.eventType == "WAIT":
+                virtualTime += event.value
+                segments.append((eventCount, virtualTime))
+        stringTableOffset = f.tell()
+        for s in sorted(strings, key=strings.get):
+            encoded = s.encode("utf-8") if isinstance(s, unicode) else s
+            f.write(COMPILED_STRING_LENGTH.pack(len(encoded)))
+            f.write(encoded)
+        segmentIndexOffset = f.tell()
+        for firstEvent, startTime in segments:
+            f.write(COMPILED_SEGMENT.pack(firstEvent, startTime))
+        f.seek(0)
+        f.write(COMPILED_HEADER.pack(COMPILED_MAGIC, COMPILED_VERSION, eventCount, len(strings), len(segments),
+                                     stringTableOffset, segmentIndexOffset))
+    os.rename(temporaryFilename, compiledFilename)
+    return compiledFilename
+
+
+class CompiledScenario():
+    def __init__(self, filename):
+        """
+        Open a compiled scenario file and read its string table and segment index.
+        :param filename: Absolute or relative filepath of compiled scenario file
+        """
+        self.filename = filename
+        with open(filename, "rb") as f:
+            magic, version, self.eventCount, stringCount, segmentCount, stringTableOffset, segmentIndexOffset = \
+                COMPILED_HEADER.unpack(f.read(COMPILED_HEADER.size))
+            assert magic == COMPILED_MAGIC and version == COMPILED_VERSION
+            f.seek(stringTableOffset)
+            self.strings = []
+            for i in range(stringCount):
+                length = COMPILED_STRING_LENGTH.unpack(f.read(COMPILED_STRING_LENGTH.size))[0]
+                self.strings.append(f.read(length))
+            f.seek(segmentIndexOffset)
+            segmentIndex = f.read(COMPILED_SEGMENT.size * segmentCount)
+        self.segments = [COMPILED_SEGMENT.unpack_from(segmentIndex, i * COMPILED_SEGMENT.size) for i in range(segmentCount)]
+        self.segmentStartTimes = [startTime for firstEvent, startTime in self.segments]
+
+    def getDuration(self):
+        """
+        Return the virtual duration of the scenario (sum of all WAIT events).
+        :return: Duration in seconds
+        """
+        return self.segmentStartTimes[-1]
+
+    def findEvent(self, virtualTime):
+        """
+        Return the first event of the segment that is active at a virtual time (from the segment index).
+        :param virtualTime: Virtual time in seconds since the start of the scenario
+        :return: Event number
+        """
+        return self.segments[max(0, bisect.bisect_right(self.segmentStartTimes, virtualTime) - 1)][0]
+
+    def iterEvents(self, firstEvent=0):
+        """
+        Yield the events of the scenario (read and unpacked in blocks of COMPILED_READ_EVENTS records).
+        :param firstEvent: Number of first event (e.g. of findEvent)
+        :return: Generator of ScenarioEvent records
+        """
+        strings = self.strings
+        eventTypes = EVENT_TYPES
+        blockStructs = dict()
+        # tuple.__new__ skips the argument handling of the namedtuple constructor
+        newEvent = tuple.__new__
+        with open(self.filename, "rb") as f:
+            f.seek(COMPILED_HEADER.size + firstEvent * COMPILED_EVENT.size)
+            remaining = self.eventCount - firstEvent
+            while remaining > 0:
+                count = min(remaining, COMPILED_READ_EVENTS)
+                if count not in blockStructs:
+                    blockStructs[count] = struct.Struct("<" + COMPILED_EVENT.format[1:] * count)
+                fields = blockStructs[count].unpack(f.read(count * COMPILED_EVENT.size))
+                for i in xrange(0, 4 * count, 4):
+                    valueType = fields[i + 1]
+                    keyIndex = fields[i + 2]
+                    if valueType == VALUE_FLOAT:
+                        value = fields[i + 3]
+                    elif valueType == VALUE_BOOL:
+                        value = fields[i + 3] != 0.0
+                    elif valueType == VALUE_STRING:
+                        value = strings[int(fields[i + 3])]
+                    else:
+                        value = None
+                    yield newEvent(ScenarioEvent, (eventTypes[fields[i]], None if keyIndex == NO_KEY else strings[keyIndex], value))
+                remaining -= count
+
+
+def iterScenarioEvents(filename, compile=False):
+    """
+    Yield the events of a scenario file in text or compiled format.
+    :param filename: Absolute or relative filepath of scenario file
+    :param compile: Compile a text scenario file (if the compiled file is missing or older) and read the compiled file
+    :return: Generator of ScenarioEvent records
+    """
+    if compile and not isCompiledScenario(filename):
+        compiledFilename = getCompiledFilename(filename)
+        if not os.path.exists(compiledFilename) or os.path.getmtime(compiledFilename) < os.path.getmtime(filename):
+            compileScenarioFile(filename, compiledFilename)
+        filename = compiledFilename
+    if isCompiledScenario(filename):
+        return CompiledScenario(filename).iterEvents()
+    return iterTextScenario(filename)
+
+
+if __name__ == '__main__':
+    if len(sys.argv) < 2:
+        print __doc__
+        sys.exit(1)
+    for scenarioFilename in sys.argv[1:]:
+        print "%s -> %s" % (scenarioFilename, compileScenarioFile(scenarioFilename))
@@ -0,0 +1,245 @@
+#!/usr/bin/python
+# -*- coding: utf-8 -*-
+'''
+
+The scenario regression runs all cases of REGRESSION_CASES (the cases of the ScenarioTestScripts) at once
+and compares the result of every rule with the stored expected outcomes (REGRESSION_EXPECTED_FILENAME).
+Every scenario file is parsed only once, the base case state is built once per worker process
+and every scenario is evaluated on a cheap overlay of it. The scenarios of a topology run in a process pool.
+The mode selects what is evaluated (REGRESSION_MODES):
+rules: all rules of the grid components,
+graph: the same rules with P1, P2 and P4 evaluated vectorized on the TopologyGraph (compared with the expected outcomes of rules),
+powerflow: the opening of every line screened with the line outage factors and calculated as switch command with the
+PowerFlowSolver (lines above the current limits of R1 and R4 after the opening).
+Usage: python ScenarioRegression.py [workers] [rules|graph|powerflow] [update]
+'''
+import json
+import logging
+import os
+import sys
+import time
+from multiprocessing import Pool
+
+from CommandEvaluation import applyCommand
+from PowerFlow import PowerFlowSolver
+from TestTopologies import initiateTopologyAlpha, initiateTopologyInterlock, initiateTopologyMasterthesis, initiateTopologyTransfFuseRelay
+from TopologyGraph import TopologyGraph
+from ValueStore import ValueStore, OverlayValueStore, parseScenarioFile
+
+logger = logging.getLogger(__name__)
+
+REGRESSION_WORKERS = 4
+REGRESSION_SCENARIO_PATH = os.path.join(os.path.dirname(os.path.abspath(__file__)), "Scenarios")
+REGRESSION_EXPECTED_FILENAME = os.path.join(REGRESSION_SCENARIO_PATH, "ExpectedResults.json")
+REGRESSION_POWER_FLOW_EXPECTED_FILENAME = os.path.join(REGRESSION_SCENARIO_PATH, "ExpectedPowerFlowResults.json")
+# mode -> expected outcomes
+REGRESSION_MODES = {"rules": REGRESSION_EXPECTED_FILENAME, "graph": REGRESSION_EXPECTED_FILENAME,
+                    "powerflow": REGRESSION_POWER_FLOW_EXPECTED_FILENAME}
+REGRESSION_TOPOLOGIES = {"Alpha": initiateTopologyAlpha, "Interlock": initiateTopologyInterlock,
+                         "Masterthesis": initiateTopologyMasterthesis, "TransfFuseRelay": initiateTopologyTransfFuseRelay}
+# case name -> (topology name, RTUs to test or None for all RTUs)
+REGRESSION_CASES = {"Alpha_GlobalKnowledge": ("Alpha", None),
+                    "Alpha_LocalKnowledge": ("Alpha", ["rtu1"]),
+                    "Interlock": ("Interlock", ["rtu1"]),
+                    "Masterthesis_GlobalKnowledge": ("Alpha", None),
+                    "TransfFuseRelay": ("TransfFuseRelay", None)}
+
+workerTopology = None
+workerGraph = None
+workerPowerFlow = None
+workerMode = None
+workerBaseStates = dict()
+
+
+def parseCase(caseName, scenarioPath=REGRESSION_SCENARIO_PATH):
+    """
+    Parse the base case and all scenario files of a case.
+    :param caseName: Name of case
+    :param scenarioPath: Directory of scenario files
+    :return: (base case, list of scenarios) as ParsedScenario objects, scenarios sorted by filename
+    """
+    basicCaseFilename = "%s_%s.state" % (caseName, "BasicCase")
+    scenarioFilenames = []
+    for filename in sorted(os.listdir(scenarioPath)):
+        if filename != basicCaseFilename and filename.startswith("%s_" % caseName) and filename.endswith(".state"):
+            scenarioFilenames.append(filename)
+    assert os.path.exists(os.path.join(scenarioPath, basicCaseFilename))
+    basicCase = parseScenarioFile(os.path.join(scenarioPath, basicCaseFilename))
+    return basicCase, [parseScenarioFile(os.path.join(scenarioPath, f)) for f in scenarioFilenames]
+
+
+def getScenarioName(scenario):
+    """
+    Return the name of a parsed scenario (filename without directory and extension).
+    :param scenario: ParsedScenario object
+    :return: Scenario name
+    """
+    return os.path.splitext(os.path.basename(scenario.filename))[0]
+
+
+def evaluateRules(topology, state, rtusToTest=None, graph=None):
+    """
+    Evaluate all consistency and safety rules and return the result of every rule.
+    :param topology: Topology list of RTUs
+    :param state: State object with stateful information
+    :param rtusToTest: RTUs which should be tested
+    :param graph: TopologyGraph of the topology (consistency rules P1, P2 and P4 are evaluated vectorized) or None
+    :return: Dictionary "consistency|safety/<rtu>/<component>/<rule>" -> True if rule holds
+    """
+    results = dict()
+    relevantRTUs = [rtu for rtu in topology if rtusToTest is None or rtu.name in rtusToTest]
+    if graph:
+        consistency = graph.executeConsistencyChecks(state, [n for rtu in relevantRTUs for n in rtu.controlledNodes])
+    for rtu in relevantRTUs:
+        for n in rtu.controlledNodes:
+            for rule, result in (consistency[n.name] if graph else n.executeConsistencyCheck(state)).iteritems():
+                results["consistency/%s/%s/%s" % (rtu.name, n.name, rule)] = bool(result)
+            for rule, result in n.executeSafetyCheck(state).iteritems():
+                results["safety/%s/%s/%s" % (rtu.name, n.name, rule)] = bool(result)
+        results["safety/%s/%s/R6" % (rtu.name, rtu.name)] = bool(rtu.safetyCheckR6(state))
+        results["safety/%s/%s/R7" % (rtu.name, rtu.name)] = bool(rtu.safetyCheckR7(state))
+    return results
+
+
+def evaluateLineOpenings(powerFlow, state):
+    """
+    Screen the opening of every line with the line outage factors and calculate every opening as switch command.
+    :param powerFlow: PowerFlowSolver of the topology
+    :param state: State object with stateful information
+    :return: Dictionary "screening|command/<line>" -> sorted names of lines above a current limit after opening the line
+             (None if the effects of opening a switch of the line could not be calculated)
+    """
+    results = dict()
+    for lineName, overloadedLines in powerFlow.screenLineOutages(state).iteritems():
+        results["screening/%s" % lineName] = sorted(overloadedLines)
+    for l in powerFlow.graph.lines:
+        results["command/%s" % l.name] = None
+        for switch in [l.startSwitch, l.endSwitch]:
+            calculatedState = OverlayValueStore(state)
+            if switch and switch.stateKey and applyCommand(switch.stateKey, False, calculatedState, powerFlow):
+                results["command/%s" % l.name] = sorted(powerFlow.getOverloadedLines(calculatedState))
+                break
+    return results
+
+
+def initializeWorker(topologyName, basicCases, mode="rules"):
+    """
+    Create the topology and the base case states of a worker process (no log output of the rule evaluation).
+    :param topologyName: Name of topology in REGRESSION_TOPOLOGIES
+    :param basicCases: Dictionary case name -> parsed base case
+    :param mode: Regression mode (key of REGRESSION_MODES)
+    """
+    global workerTopology, workerGraph, workerPowerFlow, workerMode
+    logging.disable(logging.CRITICAL)
+    workerTopology = REGRESSION_TOPOLOGIES[topologyName]()
+    workerMode = mode
+    workerGraph = TopologyGraph(workerTopology) if mode in ["graph", "powerflow"] else None
+    workerPowerFlow = PowerFlowSolver(workerGraph) if mode == "powerflow" else None
+    workerBaseStates.clear()
+    for caseName, basicCase in basicCases.iteritems():
+        baseState = ValueStore("T_{o}")
+        baseState.loadScenario(basicCase)
+        workerBaseStates[caseName] = baseState
+
+
+def runScenario(task):
+    """
+    Evaluate a scenario on an overlay of the base case state of its case.
+    :param task: (case name, parsed scenario, RTUs to test) tuple
+    :return: (scenario name, dictionary with rule results (line openings in mode powerflow))
+    """
+    caseName, scenario, rtusToTest = task
+    state = OverlayValueStore(workerBaseStates[caseName])
+    state.loadScenario(scenario)
+    if workerMode == "powerflow":
+        return getScenarioName(scenario), evaluateLineOpenings(workerPowerFlow, state)
+    return getScenarioName(scenario), evaluateRules(workerTopology, state, rtusToTest, workerGraph)
+
+
+def runScenarios(cases=None, workers=REGRESSION_WORKERS, scenarioPath=REGRESSION_SCENARIO_PATH, mode="rules"):
+    """
+    Run the scenarios of several cases, one process pool per topology (grid components register globally).
+    :param cases: List of case names of REGRESSION_CASES (all cases if not given)
+    :param workers: Number of worker processes per topology
+    :param scenarioPath: Directory of scenario files
+    :param mode: Regression mode (key of REGRESSION_MODES)
+    :return: Dictionary scenario name -> dictionary with rule results (line openings in mode powerflow)
+    """
+    assert REGRESSION_MODES.has_key(mode)
+    casesOfTopology = dict()
+    for caseName in sorted(cases if cases else REGRESSION_CASES.keys()):
+        casesOfTopology.setdefault(REGRESSION_CASES[caseName][0], []).append(caseName)
+    results = dict()
+    for topologyName, caseNames in sorted(casesOfTopology.iteritems()):
+        basicCases = dict()
+        tasks = []
+        for caseName in caseNames:
+            basicCases[caseName], scenarios = parseCase(caseName, scenarioPath)
+            tasks.extend([(caseName, scenario, REGRESSION_CASES[caseName][1]) for scenario in scenarios])
+        pool = Pool(min(workers, len(tasks)), initializer=initializeWorker, initargs=(topologyName, basicCases, mode))
+        try:
+            for scenarioName, ruleResults in pool.imap_unordered(runScenario, tasks):
+                results[scenarioName] = ruleResults
+        finally:
+            pool.close()
+            pool.join()
+    return results
+
+
+def compareResults(results, expected):
+    """
+    Compare rule results with the expected outcomes.
+    :param results: Dictionary scenario name -> dictionary with rule results
+    :param expected: Dictionary scenario name -> dictionary with expected rule results
+    :return: Dictionary scenario name -> list of failure descriptions (empty list if scenario passed)
+    """
+    failures = dict()
+    for scenarioName, ruleResults in sorted(results.iteritems()):
+        failures[scenarioName] = []
+        if not expected.has_key(scenarioName):
+            failures[scenarioName].append("no expected outcome stored")
+            continue
+        for rule in sorted(set(ruleResults.keys()) | set(expected[scenarioName].keys())):
+            if ruleResults.get(rule) != expected[scenarioName].get(rule):
+                failures[scenarioName].append("%s: expected %s, got %s" % (rule, expected[scenarioName].get(rule), ruleResults.get(rule)))
+    return failures
+
+
+def runRegression(workers=REGRESSION_WORKERS, update=False, expectedFilename=None, mode="rules"):
+    """
+    Run all scenarios and compare the results with the expected outcomes.
+    :param workers: Number of worker processes per topology
+    :param update: Store the results as new expected outcomes instead of comparing
+    :param expectedFilename: Path to expected outcomes (json format, expected outcomes of the mode if not given)
+    :param mode: Regression mode (key of REGRESSION_MODES)
+    :return: True if all scenarios passed
+    """
+    startTime = time.time()
+    expectedFilename = expectedFilename or REGRESSION_MODES[mode]
+    results = runScenarios(workers=workers, mode=mode)
+    if update:
+        with open(expectedFilename, "w") as f:
+            json.dump(results, f, indent=2, sort_keys=True)
+        logger.info("Stored expected outcomes of %d scenarios in %s (%.2fs)." % (len(results), expectedFilename, time.time() - startTime))
+        return True
+    with open(expectedFilename, "r") as f:
+        expected = json.load(f)
+    failures = compareResults(results, expected)
+    for scenarioName, scenarioFailures in sorted(failures.iteritems()):
+        if scenarioFailures:
+            logger.error("%s: FAILED" % scenarioName)
+            for failure in scenarioFailures:
+                logger.error("\t%s" % failure)
+        else:
+            logger.info("%s: passed (%d results)" % (scenarioName, len(results[scenarioName])))
+    failed = len([f for f in failures.values() if f])
+    logger.info("%d of %d scenarios passed in %.2fs (mode %s)." % (len(failures) - failed, len(failures), time.time() - startTime, mode))
+    return failed == 0
+
+
+if __name__ == '__main__':
+    logging.basicConfig(level=logging.INFO, format="%(message)s")
+    modes = [m for m in sys.argv[2:] if REGRESSION_MODES.has_key(m)]
+    passed = runRegression(workers=int(sys.argv[1]) if len(sys.argv) > 1 else REGRESSION_WORKERS, update="update" in sys.argv[2:],
+                           mode=modes[0] if modes else "rules")
+    sys.exit(0 if passed else 1)
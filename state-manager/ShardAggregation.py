@@ -0,0 +1,319 @@
+#!/usr/bin/python
+# -*- coding: utf-8 -*-
+'''
+
+In a sharded deployment several state managers (shards) run side by side, one per Bro instance, and each owns a partition of the RTUs.
+A shard evaluates the rules of its own RTUs and publishes a summary of its observed state to the aggregator:
+the sums of generated and consumed power of its nodes and the local meter values of lines that end in another shard.
+The aggregator merges the summaries and evaluates the rules that span shards (R7 and P4 of lines between shards).
+Shards and aggregator communicate over local sockets (multiprocessing.connection).
+'''
+import logging
+import time
+from multiprocessing.connection import Client, Listener
+from threading import Lock, Thread
+
+from LoggerUtilities import logAllChecksDescription, logAllChecksPassed, logCheckDescription, logCheckPassed, \
+    logDebugCheckValues, logDebugUnknownValues
+from StateManagerUtilities import isClose
+from ValueStore import ValueNotStoredException
+
+logger = logging.getLogger(__name__)
+
+AGGREGATOR_HOST = "127.0.0.1"
+AGGREGATOR_PORT = 47770
+AGGREGATOR_AUTHKEY = "T104StateManagerShards"
+SHARD_SUMMARY_INTERVAL = 1.0
+SHARD_LAYOUTS = {"Alpha": {"shard1": ["rtu1", "rtuGenerators"],
+                           "shard2": ["rtu2", "rtuLoads"]},
+                 "Masterthesis": {"shard1": ["rtu1", "rtu2"],
+                                  "shard2": ["rtu3", "rtu4"]}}
+
+
+def getShardOfNodes(topology, shardLayout):
+    """
+    Map the nodes of a topology to the shards which own their RTUs.
+    :param topology: Topology list of RTUs
+    :param shardLayout: Dictionary with shard name as key and list of RTU names as value
+    :return: Dictionary with node name as key and shard name as value
+    """
+    shardOfRTU = dict()
+    for shardName, rtuNames in shardLayout.iteritems():
+        for rtuName in rtuNames:
+            assert not shardOfRTU.has_key(rtuName), "RTU %s is owned by several shards." % rtuName
+            shardOfRTU[rtuName] = shardName
+    shardOfNodes = dict()
+    for rtu in topology:
+        assert shardOfRTU.has_key(rtu.name), "RTU %s is not owned by any shard." % rtu.name
+        for node in rtu.controlledNodes:
+            shardOfNodes[node.name] = shardOfRTU[rtu.name]
+    return shardOfNodes
+
+
+def getShardTopology(topology, shardLayout, shardName):
+    """
+    Return the RTUs owned by a shard.
+    :param topology: Topology list of RTUs
+    :param shardLayout: Dictionary with shard name as key and list of RTU names as value
+    :param shardName: Name of shard
+    :return: Topology list of the RTUs of the shard
+    """
+    return [rtu for rtu in topology if rtu.name in shardLayout[shardName]]
+
+
+def getBoundaryLines(topology, shardLayout):
+    """
+    Return all lines whose start and end node are owned by different shards.
+    :param topology: Topology list of RTUs
+    :param shardLayout: Dictionary with shard name as key and list of RTU names as value
+    :return: List of (line, start shard, end shard) tuples sorted by line name
+    """
+    shardOfNodes = getShardOfNodes(topology, shardLayout)
+    lines = dict()
+    for rtu in topology:
+        for node in rtu.controlledNodes:
+            for l in node.getAllConnectedLines():
+                startShard = shardOfNodes.get(l.startNode.name)
+                endShard = shardOfNodes.get(l.endNode.name)
+                if startShard and endShard and startShard <> endShard:
+                    lines[l.name] = (l, startShard, endShard)
+    return [lines[n] for n in sorted(lines.keys())]
+
+
+class ShardPublisher():
+    def __init__(self, shardName, topology, shardLayout, address=(AGGREGATOR_HOST, AGGREGATOR_PORT), authkey=AGGREGATOR_AUTHKEY,
+                 interval=SHARD_SUMMARY_INTERVAL):
+        """
+        Initialize the publisher of the summaries of a shard.
+        :param shardName: Name of shard
+        :param topology: Topology list of all RTUs
+        :param shardLayout: Dictionary with shard name as key and list of RTU names as value
+        :param address: (host, port) of the aggregator
+        :param authkey: Authentication key of the aggregator connection
+        :param interval: Minimal time in seconds between two summaries
+        """
+        assert shardLayout.has_key(shardName)
+        self.shardName = shardName
+        self.address = address
+        self.authkey = authkey
+        self.interval = interval
+        self.connection = None
+        self.lastPublish = 0
+        # last published state and its version (a replaced or reloaded store is published even with the same version)
+        self.lastState = None
+        self.lastVersion = None
+        self.publishedCount = 0
+        nodes = [n for rtu in getShardTopology(topology, shardLayout, shardName) for n in rtu.controlledNodes]
+        self.generatedPowerTags = sorted([n.generatedPowerKey for n in nodes if getattr(n, "generatedPowerKey", None)])
+        self.consumedPowerTags = sorted([n.consumedPowerKey for n in nodes if getattr(n, "consumedPowerKey", None)])
+        self.lineEndTags = []
+        for l, startShard, endShard in getBoundaryLines(topology, shardLayout):
+            meters = ([l.startMeter] if startShard == shardName else []) + ([l.endMeter] if endShard == shardName else [])
+            for meter in meters:
+                self.lineEndTags.extend([meter.voltageKey, meter.currentKey])
+
+    def createSummary(self, state):
+        """
+        Create the summary of the observed state of the shard.
+        :param state: Observed state of the shard
+        :return: Summary dictionary
+        """
+        summary = {"shard": self.shardName, "timestamp": time.time(), "lineEnds": dict(), "unknownPowerTags": []}
+        for key, tags in [("generatedPower", self.generatedPowerTags), ("consumedPower", self.consumedPowerTags)]:
+            summary[key] = 0.0
+            for tagName in tags:
+                try:
+                    summary[key] += state.retrieveValue(tagName)
+                except ValueNotStoredException:
+                    summary["unknownPowerTags"].append(tagName)
+        for tagName in self.lineEndTags:
+            try:
+                summary["lineEnds"][tagName] = state.retrieveValue(tagName)
+            except ValueNotStoredException:
+                pass
+        return summary
+
+    def publish(self, state, now=None):
+        """
+        Send a summary to the aggregator if the observed state changed and the publish interval passed.
+        :param state: Observed state of the shard
+        :param now: Current time (time.time() if not given)
+        :return: True if a summary was sent
+        """
+        if now is None:
+            now = time.time()
+        if (state is self.lastState and state.version == self.lastVersion) or now < self.lastPublish + self.interval:
+            return False
+        self.lastPublish = now
+        try:
+            if not self.connection:
+                self.connection = Client(self.address, authkey=self.authkey)
+                logger.info("Shard %s connected to aggregator at %s:%d." % ((self.shardName,) + self.address))
+            self.connection.send(self.createSummary(state))
+            self.lastState = state
+            self.lastVersion = state.version
+            self.publishedCount += 1
+            return True
+        except Exception, e:
+            logger.warning("Shard %s could not publish summary to aggregator. %s" % (self.shardName, e))
+            self.close()
+            return False
+
+    def close(self):
+        """Close the connection to the aggregator."""
+        if self.connection:
+            try:
+                self.connection.close()
+            except Exception:
+                pass
+            self.connection = None
+
+    def printStatistics(self):
+        """Print statistics about the published summaries."""
+        logger.info("Shard %s: %d summaries published." % (self.shardName, self.publishedCount))
+
+
+class ShardAggregator():
+    def __init__(self, topology, shardLayout, address=(AGGREGATOR_HOST, AGGREGATOR_PORT), authkey=AGGREGATOR_AUTHKEY):
+        """
+        Initialize the aggregator of the shard summaries.
+        :param topology: Topology list of all RTUs
+        :param shardLayout: Dictionary with shard name as key and list of RTU names as value
+        :param address: (host, port) the aggregator listens on
+        :param authkey: Authentication key of the shard connections
+        """
+        self.shardLayout = shardLayout
+        self.address = address
+        self.authkey = authkey
+        self.boundaryLines = getBoundaryLines(topology, shardLayout)
+        self.summaries = dict()
+        self.lock = Lock()
+        self.listener = None
+        self.receivedCount = 0
+        self.lastResult = None
+
+    def receiveSummary(self, summary):
+        """
+        Store the summary of a shard and evaluate the global rules.
+        :param summary: Summary dictionary of ShardPublisher.createSummary
+        :return: Result of evaluate
+        """
+        assert self.shardLayout.has_key(summary["shard"]), "Unknown shard %s." % summary["shard"]
+        with self.lock:
+            self.summaries[summary["shard"]] = summary
+            self.receivedCount += 1
+            self.lastResult = self.evaluate()
+            return self.lastResult
+
+    def checkR7(self):
+        """
+        Check the global power balance with the power sums of all shards.
+        :return: True if safety rule holds (or not all values are known), False otherwise (violation)
+        """
+        logCheckDescription("R7", indentation=2)
+        passed = True
+        missingShards = [s for s in sorted(self.shardLayout.keys()) if not self.summaries.has_key(s)]
+        unknownTags = sorted([t for s in self.summaries.values() for t in s["unknownPowerTags"]])
+        if missingShards:
+            logDebugUnknownValues("No summary of shards %s." % ", ".join(missingShards), indentation=3)
+        elif unknownTags:
+            logDebugUnknownValues("%s not in ValueStore." % ", ".join(unknownTags), indentation=3)
+        else:
+            sumOfGeneratedPower = sum([s["generatedPower"] for s in self.summaries.values()])
+            sumOfConsumedPower = (-1) * sum([s["consumedPower"] for s in self.summaries.values()])
+            passed = isClose(sumOfGeneratedPower, sumOfConsumedPower)
+            logDebugCheckValues("Global Generated power: %f (==) Global Consumed power: %f." % (sumOfGeneratedPower, sumOfConsumedPower), passed, indentation=3)
+        logCheckPassed("R7", passed, indentation=2)
+        return passed
+
+    def checkP4(self):
+        """
+        Check that voltage and current at the start of lines between shards are the same as at the end.
+        :return: Dictionary with line name as key and True if consistency rule holds (or not all values are known), False otherwise
+        """
+        lineEnds = dict()
+        for summary in self.summaries.values():
+            lineEnds.update(summary["lineEnds"])
+        checkStatus = dict()
+        for l, startShard, endShard in self.boundaryLines:
+            logCheckDescription("P4", indentation=2)
+            keys = [l.startMeter.voltageKey, l.startMeter.currentKey, l.endMeter.voltageKey, l.endMeter.currentKey]
+            unknownKeys = [k for k in keys if not lineEnds.has_key(k)]
+            passed = True
+            if unknownKeys:
+                logDebugUnknownValues("%s not in summaries." % ", ".join(unknownKeys), l.name, indentation=3)
+            else:
+                startVoltage, startCurrent, endVoltage, endCurrent = [lineEnds[k] for k in keys]
+                passed = isClose(startVoltage, endVoltage) and isClose(startCurrent, endCurrent)
+                logDebugCheckValues("Line %s (%s -> %s). Start: V=%f,A=%f (==) End: V=%f,A=%f." %
+                                    (l.name, startShard, endShard, startVoltage, startCurrent, endVoltage, endCurrent), passed, indentation=3)
+            logCheckPassed("P4", passed, indentation=2)
+            checkStatus[l.name] = passed
+        return checkStatus
+
+    def evaluate(self):
+        """
+        Evaluate the rules that span shards with the latest summaries.
+        :return: (consistency, safety) like checkTopology
+        """
+        logAllChecksDescription("CONSISTENCY", "SHARD BOUNDARIES", indentation=1)
+        consistency = all(self.checkP4().values())
+        logAllChecksPassed("CONSISTENCY", "SHARD BOUNDARIES", consistency, indentation=1)
+        logAllChecksDescription("SAFETY", "SHARD BOUNDARIES", indentation=1)
+        safety = self.checkR7()
+        logAllChecksPassed("SAFETY", "SHARD BOUNDARIES", safety, indentation=1)
+        if not consistency or not safety:
+            logger.warning("[Aggregated Evaluation of %s: Consistency: %s, Safety: %s]" % (", ".join(sorted(self.summaries.keys())), consistency, safety))
+        return (consistency, safety)
+
+    def handleConnection(self, connection):
+        """
+        Receive the summaries of a shard connection until it is closed.
+        :param connection: Accepted connection
+        """
+        try:
+            while True:
+                self.receiveSummary(connection.recv())
+        except EOFError:
+            pass
+        except Exception, e:
+            logger.error("Unknown exception or error in shard connection. %s" % e)
+        finally:
+            connection.close()
+
+    def start(self):
+        """
+        Listen for shard connections in a background thread.
+        :return: Listening address
+        """
+        self.listener = Listener(self.address, authkey=self.authkey)
+        self.address = self.listener.address
+        thread = Thread(target=self.serveForever, name="ShardAggregator")
+        thread.daemon = True
+        thread.start()
+        logger.info("Aggregator listening on %s:%d." % self.address)
+        return self.address
+
+    def serveForever(self):
+        """Accept shard connections (one receiving thread per shard)."""
+        while self.listener:
+            try:
+                connection = self.listener.accept()
+            except Exception, e:
+                if self.listener:
+                    logger.error("Unknown exception or error in accepting shard connection. %s" % e)
+                continue
+            thread = Thread(target=self.handleConnection, args=(connection,))
+            thread.daemon = True
+            thread.start()
+
+    def close(self):
+        """Stop listening for shard connections."""
+        listener = self.listener
+        self.listener = None
+        if listener:
+            listener.close()
+
+    def printStatistics(self):
+        """Print statistics about the received summaries."""
+        logger.info("Aggregator: %d summaries received of shards %s." % (self.receivedCount, ", ".join(sorted(self.summaries.keys()))))
@@ -5,18 +5,32 @@
 The state manager listens ons a local python broccoli binding for bro events that indicate either a new reading or a new command.
 Its purpose is the management of the local observed system state T_{o} and the calculation of the anticipated state T_{c}.
 Depending on the result of the consistency checks (P) and the safety requirement checks (R) actions are expressed as an alert to the system operator.
+All state is kept in StateManager instances with their own lock, so several instances can run in one process (e.g. for offline analysis).
+The module functions operate on the default instance (stateManager) that is used by the broccoli scripts.
 '''
 import logging
+import os
 import sys
 import time
-from threading import Lock
-
-from GridComponents.Meter import getMeterBySetPointTag
+from threading import Lock, local
+
+from CommandEvaluation import evaluateCommandBatch, printBatchResult, getCommandTarget, applyCommand, getAffectedNodes, \
+    evaluateRegionSafety, screenSwitchOpening, COMMAND_SAFETY_RULES, COMMAND_DESCRIPTIONS, COMMAND_SUBJECTS
+from CompactTransport import CompactRecordReader
+from EvaluationScheduler import EvaluationScheduler
+from EventCoalescer import EventCoalescer
+from GridComponents.LocalRTU import assertSingleTopology
 from GridComponents.Switch import getSwitchByTag
 from GridComponents.Transformer import getTransformerByTag
 from LoggerUtilities import initializeLogging
-from StateManagerUtilities import formatTimestamp, normalize_value, doublefy_value, KeyPoller
+from PowerFlow import PowerFlowSolver
+from RuleResultCache import enableRuleResultCache, disableRuleResultCache
+from ShardAggregation import ShardPublisher, getShardTopology, SHARD_LAYOUTS
+from StateManagerUtilities import formatTimestamp, KeyPoller
 from TestUtilities import checkTopology
+from TopologyGraph import TopologyGraph
+from TopologyIndex import TopologyIndex
+from ValueConverters import TagConverters, POLICY_GENERATOR_PATH
 from ValueStore import ValueStore, loadValuesFromFile, saveValuesToFile
 
 sys.path.append('/usr/local/lib/python')
@@ -28,100 +42,19 @@ BROCCOLI_HOST = "127.0.0.1"
 BROCCOLI_PORT = 47758
 BROCCOLI_CONNECT = "%s:%d" % (BROCCOLI_HOST, BROCCOLI_PORT)
 BROCCOLI_MAIN_LOOP_SLEEP = 0.001
+EVENT_COALESCING_ENABLED = False
+EVENT_COALESCING_WINDOW = 0.5
+EVENT_COALESCING_FULL_HISTORY = True
+COMPACT_TRANSPORT_ENABLED = False
+POWER_FLOW_ESTIMATION_ENABLED = False
+COMPACT_TRANSPORT_FILE = "/data/compact/T104_CompactRecords.hex"
+RTU_CONFIGURATION_FILE = os.path.join(POLICY_GENERATOR_PATH, "rtu-configs", "%s_GlobalKnowledge_Normalized_RTU_Configuration.csv")
+AUTOMATIC_SAVE_ENABLED = True
+AUTOMATIC_SAVE_INTERVAL = 10
+VALUE_INVALIDATION_ALLOWED_AGE = 7
 logger = logging.getLogger(__name__)
-lock = Lock()
-broccoliConnection = None
-scenario = None
-topology = None
-observedValuesStore = None
-lastValueUpdate = None
-lastEvaluatedCommand = (None, None)
-receivedCount = 0
-
-
-def evaluateCommand(tagName, value):
-    """
-    Evaluate the safety of a command.
-    :param tagName: Tag name that is changed with the command
-    :param value: New value
-    """
-    global observedValuesStore
-    logger.warning("Command detected: Set %s to %s" % (tagName, str(value)))
-    try:
-        calculatedState = observedValuesStore.getCopy()
-        calculatedState.updateValue(tagName, value)
-        meter = getMeterBySetPointTag(tagName)
-        transformer = getTransformerByTag(tagName)
-        switch = getSwitchByTag(tagName)
-        if meter:
-            if tagName == meter.setPointVKey:
-                logger.warning("(Voltage set point change)")
-                logger.info("Observed state evaluation:")
-                resultObserved = meter.connectedNode.safetyCheckR8a(observedValuesStore)
-                logger.info("Calculated state evaluation:")
-                resultCalculated = meter.connectedNode.safetyCheckR8a(calculatedState)
-                logger.info("Safety before command (R8a): %s" % resultObserved)
-                logger.info("Safety after command (R8a): %s" % resultCalculated)
-                if resultCalculated:
-                    logger.warning("New set point is safe.")
-                else:
-                    logger.warning("New set point is NOT safe.")
-            else:
-                logger.warning("(Current set point change)")
-                logger.info("Observed state evaluation:")
-                resultObserved = meter.connectedNode.safetyCheckR8b(observedValuesStore)
-                logger.info("Calculated state evaluation:")
-                resultCalculated = meter.connectedNode.safetyCheckR8b(calculatedState)
-                logger.info("Safety before command (R8b): %s" % resultObserved)
-                logger.info("Safety after command (R8b): %s" % resultCalculated)
-                if resultCalculated:
-                    logger.warning("New set point is safe.")
-                else:
-                    logger.warning("New set point is NOT safe.")
-        elif transformer:
-            logger.warning("(Transformer tap position change)")
-            if transformer.calculateCommandEffects(calculatedState):
-                logger.info("Observed state evaluation:")
-                resultObserved = transformer.executeSafetyCheck(observedValuesStore)
-                observedSafety = resultObserved["R1"] and resultObserved["R2"] and resultObserved["R4"] and resultObserved["R5a"] and resultObserved["R5b"]
-                logger.info("Calculated state evaluation:")
-                resultCalculated = transformer.executeSafetyCheck(calculatedState)
-                calculatedSafety = resultCalculated["R1"] and resultCalculated["R2"] and resultCalculated["R4"] and resultCalculated["R5a"] and resultCalculated["R5b"]
-                logger.info("Safety before command (R1,R2,R4,R5a,R5b): %s" % observedSafety)
-                logger.info("Safety after command (R1,R2,R4,R5a,R5b): %s" % calculatedSafety)
-                if calculatedSafety:
-                    logger.warning("New transformer tap position is safe.")
-                else:
-                    if observedSafety:
-                        logger.warning("New transformer tap position is NOT safe.")
-                    else:
-                        logger.warning("New transformer tap position is NOT safe. (Note: Observed safe is also NOT safe)")
-            else:
-                logger.warning("New transformer tap position can not be evaluated due to missing or invalidated values.")
-        elif switch:
-            logger.warning("(Switch command)")
-            if switch.calculateCommandEffects(calculatedState):
-                logger.info("Observed state evaluation:")
-                resultObserved = switch.connectedNode.executeSafetyCheck(observedValuesStore)
-                observedSafety = resultObserved["R1"] and resultObserved["R4"] and resultObserved["R9a"] and resultObserved["R9b"]
-                logger.info("Calculated state evaluation:")
-                resultCalculated = switch.connectedNode.executeSafetyCheck(calculatedState)
-                calculatedSafety = resultCalculated["R1"] and resultCalculated["R4"] and resultCalculated["R9a"] and resultCalculated["R9b"]
-                logger.info("Safety before command (R1,R4,R9a,R9b): %s" % observedSafety)
-                logger.info("Safety after command (R1,R4,R9a,R9b): %s" % calculatedSafety)
-                if calculatedSafety:
-                    logger.warning("New switch position is safe.")
-                else:
-                    if observedSafety:
-                        logger.warning("New switch position is NOT safe.")
-                    else:
-                        logger.warning("New switch position is NOT safe. (Note: Observed safe is also NOT safe)")
-            else:
-                logger.warning("New switch position can not be evaluated due to missing or invalidated values.")
-        else:
-            logger.warning("(Unknown command (no set point, no transformer tap position, no switch command))")
-    except Exception, e:
-        logger.error("Unknown exception or error in command evaluation. %s" % e.message)
+stateManager = None
+broccoliReceiver = local()
 
 
 def invalidateStateValues(tagName, value, observedValuesStore):
@@ -132,7 +65,6 @@ def invalidateStateValues(tagName, value, observedValuesStore):
     :param observedValuesStore: observed state object
     """
     try:
-        VALUE_INVALIDATION_ALLOWED_AGE = 7
         if observedValuesStore.hasValue(tagName) and value <> observedValuesStore.retrieveValue(tagName, True):
             transformer = getTransformerByTag(tagName)
             switch = getSwitchByTag(tagName)
@@ -163,79 +95,433 @@ def invalidateStateValues(tagName, value, observedValuesStore):
         logger.error("Unknown exception or error in measurement invalidation. %s" % e.message)
 
 
-def processRecieved(timestamp, tagName, context, value):
-    """
-    Process a received measured or commanded value (independent of value type).
-    :param timestamp: Timestamp of event
-    :param tagName: Tag name of measured value
-    :param context: "measured" or "commanded"
-    :param value: Real process value with right type
-    """
-    global lock
-    global scenario
-    global observedValuesStore
-    global lastValueUpdate
-    global lastEvaluatedCommand
-    global receivedCount
-    COMMAND_EVALUATION = True
-    with lock:
-        receivedCount += 1
-        if type(value) == float:
-            logger.debug("[%s] [%s] Tag: %s, Value: %2.5f" % (context, formatTimestamp(timestamp), tagName, value))
-        elif type(value) == bool:
-            logger.debug("[%s] [%s] Tag: %s, Value: %s" % (context, formatTimestamp(timestamp), tagName, str(value)))
-        else:
-            logger.debug(
-                "[%s] [%s] Tag: %s, Value: %s (unknown type)" % (context, formatTimestamp(timestamp), tagName, str(value)))
-        if context == "measured":
+class StateManager():
+    def __init__(self, topology, scenario, shardName=None, eventCoalescing=EVENT_COALESCING_ENABLED, powerFlowEstimation=POWER_FLOW_ESTIMATION_ENABLED):
+        """
+        Initialize a state manager with an empty value store (without connection to Bro).
+        Several instances can share a topology, the rules of the grid components only read the given state.
+        All instances of a process must use the same topology (the component registry is global, see assertSingleTopology).
+        :param topology: Topology list of RTUs
+        :param scenario: Used underlaying scenario topology like "Masterthesis" or "Alpha"
+        :param shardName: Name of shard in SHARD_LAYOUTS (only the RTUs of the shard are evaluated, summaries are sent to the aggregator)
+        :param eventCoalescing: Coalesce bursts of measurements (see EventCoalescer)
+        :param powerFlowEstimation: Estimate the effects of switch and transformer commands on all lines (see PowerFlow.py)
+        """
+        assertSingleTopology(topology)
+        self.scenario = scenario
+        self.topology = topology
+        self.lock = Lock()
+        self.broccoliConnection = None
+        self.compactRecordReader = None
+        self.tagConverters = TagConverters()
+        self.lastValueUpdate = 0
+        self.lastEvaluatedCommand = (None, None)
+        self.receivedCount = 0
+        self.eventCoalescer = None
+        self.shardPublisher = None
+        if shardName:
+            self.shardPublisher = ShardPublisher(shardName, topology, SHARD_LAYOUTS[scenario])
+            self.topology = getShardTopology(topology, SHARD_LAYOUTS[scenario], shardName)
+            logger.info("Shard %s of RTUs %s." % (shardName, ", ".join([rtu.name for rtu in self.topology])))
+        self.observedValuesStore = None
+        self.ruleResultCache = None
+        self.setObservedValuesStore(ValueStore("T_{o}"))
+        self.evaluationScheduler = EvaluationScheduler(TopologyIndex(self.topology))
+        if eventCoalescing:
+            self.eventCoalescer = EventCoalescer(EVENT_COALESCING_WINDOW, keepFullHistory=EVENT_COALESCING_FULL_HISTORY)
+        self.powerFlow = PowerFlowSolver(TopologyGraph(self.topology)) if powerFlowEstimation else None
+
+    def setObservedValuesStore(self, observedValuesStore):
+        """
+        Replace the observed state (e.g. by a state loaded from file) and cache its rule results.
+        :param observedValuesStore: New observed state
+        """
+        if self.observedValuesStore:
+            disableRuleResultCache(self.observedValuesStore)
+        self.observedValuesStore = observedValuesStore
+        self.ruleResultCache = enableRuleResultCache(observedValuesStore)
+
+    def evaluateCommand(self, tagName, value):
+        """
+        Evaluate the safety of a command.
+        Only the relevant rules of the nodes affected by the command are evaluated.
+        :param tagName: Tag name that is changed with the command
+        :param value: New value
+        """
+        logger.warning("Command detected: Set %s to %s" % (tagName, str(value)))
+        try:
+            commandType, component, node = getCommandTarget(tagName)
+            if not commandType:
+                logger.warning("(Unknown command (no set point, no transformer tap position, no switch command))")
+                return
+            logger.warning("(%s)" % COMMAND_DESCRIPTIONS[commandType])
+            subject = COMMAND_SUBJECTS[commandType]
+            screening = screenSwitchOpening(tagName, value, self.observedValuesStore, self.powerFlow)
+            if screening is not None:
+                logger.info("Line outage screening (R1, R4): %s" % (", ".join(screening) if screening else "no line above limits"))
+            calculatedState = self.observedValuesStore.getOverlay()
+            if not applyCommand(tagName, value, calculatedState, self.powerFlow):
+                logger.warning("New %s can not be evaluated due to missing or invalidated values." % subject)
+                return
+            affectedNodes = getAffectedNodes(tagName, calculatedState.getModifiedKeys(), self.evaluationScheduler.topologyIndex)
+            rules = COMMAND_SAFETY_RULES[commandType]
+            logger.info("Affected nodes: %s" % ", ".join([n.name for n in affectedNodes]))
+            logger.info("Observed state evaluation:")
+            observedSafety = evaluateRegionSafety(self.observedValuesStore, affectedNodes, rules)
+            logger.info("Calculated state evaluation:")
+            calculatedSafety = evaluateRegionSafety(calculatedState, affectedNodes, rules)
+            logger.info("Safety before command (%s): %s" % (",".join(rules), observedSafety))
+            logger.info("Safety after command (%s): %s" % (",".join(rules), calculatedSafety))
+            if calculatedSafety:
+                logger.warning("New %s is safe." % subject)
+            elif observedSafety:
+                logger.warning("New %s is NOT safe." % subject)
+            else:
+                logger.warning("New %s is NOT safe. (Note: Observed safe is also NOT safe)" % subject)
+        except Exception, e:
+            logger.error("Unknown exception or error in command evaluation. %s" % e.message)
+
+    def evaluateCommands(self, commands):
+        """
+        Evaluate the safety of a list of candidate commands (as alternatives and as cumulative sequence).
+        :param commands: List of (tagName, value) tuples
+        :return: Result of the batch evaluation (see CommandEvaluation.evaluateCommandBatch)
+        """
+        with self.lock:
+            self.applyCoalescedValues()
+            result = evaluateCommandBatch(commands, self.observedValuesStore, self.evaluationScheduler.topologyIndex, powerFlow=self.powerFlow)
+        printBatchResult(result)
+        return result
+
+    def storeMeasurement(self, tagName, value, timestamp=None, now=None):
+        """
+        Store a measured value in the observed state (invalidating dependent values if required).
+        Must be called while holding the lock.
+        :param tagName: Tag name of measured value
+        :param value: Real process value with right type
+        :param timestamp: Timestamp of measurement (if available)
+        :param now: Time of change for the evaluation scheduler (time.time() if not given, capture time in offline analysis)
+        """
+        try:
+            self.lastValueUpdate = now if now is not None else time.time()
+            self.evaluationScheduler.notifyTagChange(tagName, self.lastValueUpdate)
+            if self.scenario == "Alpha" or self.scenario == "Masterthesis":
+                VALUE_INVALIDATION = False
+            if VALUE_INVALIDATION:
+                invalidateStateValues(tagName, value, self.observedValuesStore)
+            if self.scenario == "Alpha" or self.scenario == "Masterthesis":
+                self.observedValuesStore.updateValue(tagName, value, timestamp)
+            else:
+                assert False
+        except Exception, e:
+            logger.error("Unknown exception or error in receiving measurement. %s" % e.message)
+
+    def applyCoalescedValues(self):
+        """
+        Apply the latest buffered value of every coalesced tag to the observed state.
+        Must be called while holding the lock.
+        """
+        if self.eventCoalescer:
+            for tagName, value, timestamp in self.eventCoalescer.flush():
+                self.storeMeasurement(tagName, value, timestamp)
+
+    def processRecieved(self, timestamp, tagName, context, value, now=None):
+        """
+        Process a received measured or commanded value (independent of value type).
+        :param timestamp: Timestamp of event (logged only, measurements are stored with the time of reception)
+        :param tagName: Tag name of measured value
+        :param context: "measured" or "commanded"
+        :param value: Real process value with right type
+        :param now: Time of event for the evaluation scheduler (time.time() if not given, capture time in offline analysis)
+        """
+        COMMAND_EVALUATION = True
+        if self.eventCoalescer and context == "measured":
+            # Coalesced measurements are applied in the main loop (no lock required), stored with the time of reception
+            # like measurements without coalescing
+            self.eventCoalescer.add(tagName, value)
+            return
+        with self.lock:
+            self.receivedCount += 1
+            if type(value) == float:
+                logger.debug("[%s] [%s] Tag: %s, Value: %2.5f" % (context, formatTimestamp(timestamp), tagName, value))
+            elif type(value) == bool:
+                logger.debug("[%s] [%s] Tag: %s, Value: %s" % (context, formatTimestamp(timestamp), tagName, str(value)))
+            else:
+                logger.debug(
+                    "[%s] [%s] Tag: %s, Value: %s (unknown type)" % (context, formatTimestamp(timestamp), tagName, str(value)))
+            if context == "measured":
+                self.storeMeasurement(tagName, value, now=now)
+
+            elif COMMAND_EVALUATION and context == "commanded":
+                try:
+                    if self.lastEvaluatedCommand <> (tagName, value):
+                        self.lastEvaluatedCommand = (tagName, value)
+                        # Commands are evaluated on the latest measurements and before automatic evaluations
+                        self.applyCoalescedValues()
+                        self.evaluationScheduler.notifyCommand(now)
+                        if self.scenario == "Alpha" or self.scenario == "Masterthesis":
+                            self.evaluateCommand(tagName, value)
+                        else:
+                            assert False
+                except Exception, e:
+                    logger.error("Unknown exception or error in receiving command. %s" % e.message)
+
+    def convertRaw(self, rawValue, rawType, tagName=None):
+        """
+        Convert a raw Bro value depending on type with the converter of the tag.
+        :param rawValue: Raw Bro representation (bitarray interpreted as int)
+        :param rawType: Type ("normalized", "double", "real", "doublePoint")
+        :param tagName: Tag name (normalized values are denormalized with the interval of the RTU configuration if known)
+        :return: Converted real process value with right type
+        """
+        try:
+            return self.tagConverters.getConverter(tagName, rawType)(rawValue)
+        except AssertionError, e:
+            raise e
+        except Exception, e:
+            logger.error("Unknown exception or error in value conversion. %s" % e.message)
+            return rawValue
+
+    def evaluateTopology(self, rtusToTest=None):
+        """
+        Evaluate all rules (of the given RTUs) on the observed state.
+        :param rtusToTest: RTU names which should be tested (all RTUs if not given)
+        :return: (consistency, safety) like checkTopology
+        """
+        with self.lock:
+            self.applyCoalescedValues()
+        if rtusToTest is None:
+            self.evaluationScheduler.markAllEvaluated()
+        return checkTopology(self.topology, self.observedValuesStore, rtusToTest)
+
+    def runAutomaticEvaluation(self, now=None):
+        """
+        Evaluate the RTUs with changed tags that are due (debounced, forced after max. staleness).
+        :param now: Current time (time.time() if not given)
+        :return: (consistency, safety) of the evaluated RTUs or None if no RTU is due
+        """
+        dueRTUs, forced = self.evaluationScheduler.collectDueRTUs(now)
+        if not dueRTUs:
+            return None
+        updateDescr = "(%ds Update delay (max. %ds)%s)" % (self.evaluationScheduler.debounce, self.evaluationScheduler.maxStaleness, " FORCED" if forced else "")
+        logger.warning("[Automatic Evaluation %s of %s]" % (updateDescr, ", ".join(dueRTUs)))
+        result = checkTopology(self.topology, self.observedValuesStore, dueRTUs)
+        logger.warning("[Automatic Evaluation: Consistency: %s, Safety: %s]" % (str(result[0]), str(result[1])))
+        return result
+
+    def initializeTagConverters(self, rtuConfigurationFilename=None):
+        """
+        Initialize the value converters of the tags of the RTU configuration.
+        :param rtuConfigurationFilename: Path to RTU configuration (RTU_CONFIGURATION_FILE of the scenario if not given)
+        """
+        try:
+            self.tagConverters = TagConverters(rtuConfigurationFilename or RTU_CONFIGURATION_FILE % self.scenario)
+        except IOError, e:
+            logger.warning("RTU configuration not available, normalized values are not denormalized. %s" % e)
+            self.tagConverters = TagConverters()
+
+    def initializeBroccoli(self, connect=None):
+        """
+        Initialize connection to Bro.
+        :param connect: "host:port" of Bro (BROCCOLI_CONNECT if not given)
+        """
+        failed = True
+        while failed:
             try:
-                lastValueUpdate = time.time()
-                if scenario == "Alpha" or scenario == "Masterthesis":
-                    VALUE_INVALIDATION = False
-                if VALUE_INVALIDATION:
-                    invalidateStateValues(tagName, value, observedValuesStore)
-                if scenario == "Alpha" or scenario == "Masterthesis":
-                    observedValuesStore.updateValue(tagName, value)
-                else:
-                    assert False
+                self.broccoliConnection = broccoli.Connection(connect or BROCCOLI_CONNECT)
+                failed = False
+                logger.info("Connected to Bro!")
             except Exception, e:
-                logger.error("Unknown exception or error in receiving measurement. %s" % e.message)
-
-        elif COMMAND_EVALUATION and context == "commanded":
+                logger.error("Unknown exception or error in broccoli initialization. %s" % e.message)
+
+    def initializeCompactTransport(self, filename=None):
+        """
+        Initialize the reader of compact records written by Bro (T104_CompactExport.bro).
+        :param filename: Path to record file (COMPACT_TRANSPORT_FILE if not given)
+        """
+        filename = filename or COMPACT_TRANSPORT_FILE
+        self.compactRecordReader = CompactRecordReader(filename, self.tagConverters)
+        logger.info("Reading compact records from %s." % filename)
+
+    def processInput(self):
+        """Process the events received since the last call (compact records or broccoli events)."""
+        if self.compactRecordReader:
+            for timestamp, tagName, context, value in self.compactRecordReader.readValues():
+                self.processRecieved(int(timestamp), tagName, context, value)
+        elif self.broccoliConnection:
+            broccoliReceiver.stateManager = self
+            self.broccoliConnection.processInput()
+
+    def handleKey(self, c):
+        """
+        Execute a keyboard command.
+        :param c: Pressed key
+        """
+        if c == "c" or c == "q":
+            logger.warning("[Keyboard command] Closing application")
+            finishStateManager(self)
+        elif c == "e":
+            logger.warning("[Keyboard command] Evaluating current state")
+            self.evaluateTopology()
+        elif c == "d" or c == "3":
+            logger.warning("[Keyboard command] Set log level to DEBUG")
+            logging.getLogger().setLevel(logging.DEBUG)
+        elif c == "i" or c == "2":
+            logger.warning("[Keyboard command] Set log level to INFO")
+            logging.getLogger().setLevel(logging.INFO)
+        elif c == "w" or c == "1":
+            logger.warning("[Keyboard command] Set log level to WARNING")
+            logging.getLogger().setLevel(logging.WARNING)
+        elif c == "v":
+            logger.warning("[Keyboard command] Print current values")
+            self.observedValuesStore.printCurrentState()
+        elif c == "s":
+            logger.warning("[Keyboard command] Save values to file")
+            try:
+                saveValuesToFile(self.observedValuesStore, autosave=False)
+            except Exception, e:
+                logger.warning("ERROR saving file: %s" % e)
+        elif c == "l":
+            logger.warning("[Keyboard command] Load values from file")
             try:
-                if lastEvaluatedCommand <> (tagName, value):
-                    lastEvaluatedCommand = (tagName, value)
-                    if scenario == "Alpha" or scenario == "Masterthesis":
-                        evaluateCommand(tagName, value)
-                    else:
-                        assert False
+                self.setObservedValuesStore(loadValuesFromFile())
             except Exception, e:
-                logger.error("Unknown exception or error in receiving command. %s" % e.message)
+                logger.warning("ERROR loading file: %s" % e)
+        elif c == "r":
+            logger.warning("[Keyboard command] Resuming last session from autosave file")
+            try:
+                self.setObservedValuesStore(loadValuesFromFile(loadAutosave=True))
+            except Exception, e:
+                logger.warning("ERROR loading file: %s" % e)
+        elif c == "a":
+            if self.evaluationScheduler.enabled:
+                logger.warning("[Keyboard command] Automatic evaluation disabled")
+                self.evaluationScheduler.enabled = False
+            else:
+                logger.warning("[Keyboard command] Automatic evaluation enabled")
+                self.evaluationScheduler.enabled = True
+        elif c == "t":
+            logger.warning("[Keyboard command] Print evaluation scheduler statistics")
+            self.evaluationScheduler.printStatistics()
+
+    def runMainLoop(self):
+        """Start infinite event listener loop (infinite)."""
+        printUsage()
+        lastAutomaticSave = time.time()
+        self.lastValueUpdate = 0
+        with KeyPoller() as keyPoller:
+            while True:
+                try:
+                    # Key handling
+                    c = keyPoller.poll()
+                    if not c is None:
+                        self.handleKey(c)
+
+                    # Apply coalesced measurements after their coalescing window
+                    if self.eventCoalescer and self.eventCoalescer.isDue():
+                        with self.lock:
+                            self.applyCoalescedValues()
+
+                    # Automatic evaluation of RTUs with changed tags (debounced, forced after max. staleness)
+                    self.runAutomaticEvaluation()
+
+                    if AUTOMATIC_SAVE_ENABLED and lastAutomaticSave < self.lastValueUpdate:
+                        # Automatic save
+                        if lastAutomaticSave + AUTOMATIC_SAVE_INTERVAL < time.time():
+                            try:
+                                logger.info("Automatically saving values to file.")
+                                lastAutomaticSave = time.time()
+                                saveValuesToFile(self.observedValuesStore, autosave=True)
+                            except Exception, e:
+                                logger.warning("ERROR saving file (auto-save): %s" % e)
+
+                    # Event handling (compact records or broccoli events)
+                    self.processInput()
+
+                    # Summary for the aggregator (sharded deployment)
+                    if self.shardPublisher:
+                        with self.lock:
+                            self.shardPublisher.publish(self.observedValuesStore)
+
+                    # Sleep
+                    time.sleep(BROCCOLI_MAIN_LOOP_SLEEP)
+                except KeyboardInterrupt:
+                    logger.warning("[Received Signal SIGINT] Closing application")
+                    finishStateManager(self)
+                except Exception, e:
+                    logger.error("Unknown exception or error in broccoli main loop. %s" % e.message)
+
+    def finish(self, printValues=True, printStatistics=True):
+        """
+        Apply pending values, print the statistics and close connections.
+        :param printValues: Print the current state and full history of the observed state
+        :param printStatistics: Print the statistics of coalescer, scheduler, transport, cache and shard publisher
+        :return: Number of successfully received and parsed measurements and commands
+        """
+        with self.lock:
+            self.applyCoalescedValues()
+        if printValues:
+            self.observedValuesStore.printCurrentState()
+            self.observedValuesStore.printFullHistory()
+        if self.eventCoalescer:
+            if printStatistics:
+                self.eventCoalescer.printStatistics()
+                if self.eventCoalescer.fullHistory:
+                    self.eventCoalescer.fullHistory.printLog()
+            self.receivedCount += self.eventCoalescer.receivedCount
+        if printStatistics:
+            self.evaluationScheduler.printStatistics()
+        if self.compactRecordReader:
+            if printStatistics:
+                self.compactRecordReader.printStatistics()
+            self.compactRecordReader.close()
+        if self.ruleResultCache:
+            if printStatistics:
+                self.ruleResultCache.printStatistics()
+            disableRuleResultCache(self.observedValuesStore)
+        if self.shardPublisher:
+            if printStatistics:
+                self.shardPublisher.printStatistics()
+            self.shardPublisher.close()
+        logger.info("Total successfully received and parsed measurements and commands: %d" % self.receivedCount)
+        return self.receivedCount
+
+
+def getBroccoliReceiver():
+    """
+    Return the state manager that is processing broccoli events in the current thread.
+    :return: StateManager instance (default instance if events are processed outside of StateManager.processInput)
+    """
+    return getattr(broccoliReceiver, "stateManager", None) or stateManager
 
 
-def convertRaw(rawValue, rawType):
+def evaluateCommand(tagName, value):
     """
-    Convert a raw Bro value depending on type.
-    :param rawValue: Raw Bro representation (bitarray interpreted as int)
-    :param rawType: Type ("normalized", "double", "real", "doublePoint")
-    :return: Converted real process value with right type
+    Evaluate the safety of a command with the default state manager.
+    :param tagName: Tag name that is changed with the command
+    :param value: New value
     """
-    try:
-        if rawType == "normalized":
-            return normalize_value(rawValue)
-        elif rawType == "double":
-            return doublefy_value(rawValue)
-        elif rawType == "real":
-            return rawValue
-        elif rawType == "doublePoint":
-            return rawValue
-        else:
-            raise AssertionError("rawType not recognized. Valid values: normalized, double, real")
-    except AssertionError, e:
-        raise e
-    except Exception, e:
-        logger.error("Unknown exception or error in value conversion. %s" % e.message)
-        return rawValue
+    stateManager.evaluateCommand(tagName, value)
+
+
+def evaluateCommands(commands):
+    """
+    Evaluate the safety of a list of candidate commands with the default state manager.
+    :param commands: List of (tagName, value) tuples
+    :return: Result of the batch evaluation (see CommandEvaluation.evaluateCommandBatch)
+    """
+    return stateManager.evaluateCommands(commands)
+
+
+def processRecieved(timestamp, tagName, context, value):
+    """
+    Process a received measured or commanded value with the default state manager.
+    :param timestamp: Timestamp of event
+    :param tagName: Tag name of measured value
+    :param context: "measured" or "commanded"
+    :param value: Real process value with right type
+    """
+    stateManager.processRecieved(timestamp, tagName, context, value)
 
 
 @broccoli.event(broccoli.time, str, str, int, str)
@@ -250,9 +536,10 @@ def receiveTagRawValue(loggedNetworkTime, tagName, context, rawValue, rawType):
     :param rawType: Type of raw format (e.g. "normalized", "double", "real", "doublePoint")
     """
     try:
+        receiver = getBroccoliReceiver()
         timestamp = int(loggedNetworkTime.val)
-        measuredValue = convertRaw(rawValue, rawType)
-        processRecieved(timestamp, tagName, context, measuredValue)
+        measuredValue = receiver.convertRaw(rawValue, rawType, tagName)
+        receiver.processRecieved(timestamp, tagName, context, measuredValue)
     except Exception, e:
         logger.error("Unknown exception or error in broccoli event receiveTagRawValue. %s" % e.message)
 
@@ -269,11 +556,29 @@ def receiveTagSinglePoint(loggedNetworkTime, tagName, context, singlePoint):
     """
     try:
         timestamp = int(loggedNetworkTime.val)
-        processRecieved(timestamp, tagName, context, singlePoint)
+        getBroccoliReceiver().processRecieved(timestamp, tagName, context, singlePoint)
     except Exception, e:
         logger.error("Unknown exception or error in broccoli event receiveTagSinglePoint. %s" % e.message)
 
 
+@broccoli.event(broccoli.time, str, str, str, float)
+def receiveRuleViolation(loggedNetworkTime, tagName, rule, nodeName, value):
+    """
+    Bro is calling this function upon a violation of a bound safety rule (evaluated in Bro, see T104_SafetyRules_*.bro).
+
+    :param loggedNetworkTime: Timestamp of event
+    :param tagName: Tag name of measured value
+    :param rule: Violated rule (R1, R2, R3, R8a or R8b)
+    :param nodeName: Name of node the rule belongs to
+    :param value: Measured value (bool values as 0.0 or 1.0)
+    """
+    try:
+        logger.warning("[%s] Bound rule violation detected by Bro: %s at node %s (%s = %s)" %
+                       (formatTimestamp(int(loggedNetworkTime.val)), rule, nodeName, tagName, str(value)))
+    except Exception, e:
+        logger.error("Unknown exception or error in broccoli event receiveRuleViolation. %s" % e.message)
+
+
 def printUsage():
     """Print the keyboard layout."""
     logger.warning("Starting Broccoli Main Loop.")
@@ -288,151 +593,37 @@ def printUsage():
     logger.warning("s: <S>ave values to file")
     logger.warning("l: <L>oad values from file")
     logger.warning("r: <r>esume session from last auto-save")
+    logger.warning("t: Print evaluation scheduler s<t>atistics")
 
 
-def startBroccoliMainLoop():
-    """Start infinite event listener loop (infinite)."""
-    global topology
-    global observedValuesStore
-    global lastValueUpdate
-    printUsage()
-    AUTOMATIC_EVALUATION_ENABLED = True
-    AUTOMATIC_EVALUATION_INTERVAL = 3
-    AUTOMATIC_EVALUATION_UPDATE_DELAY = 2
-    AUTOMATIC_EVALUATION_UPDATE_DELAY_MAX = 10
-    AUTOMATIC_SAVE_ENABLED = True
-    AUTOMATIC_SAVE_INTERVAL = 10
-    lastAutomaticEvaluation = time.time()
-    lastAutomaticSave = time.time()
-    lastValueUpdate = 0
-    with KeyPoller() as keyPoller:
-        while True:
-            try:
-                # Key handling
-                c = keyPoller.poll()
-                if not c is None:
-                    if c == "c" or c == "q":
-                        logger.warning("[Keyboard command] Closing application")
-                        finishStateManager()
-                    elif c == "e":
-                        logger.warning("[Keyboard command] Evaluating current state")
-                        checkTopology(topology, observedValuesStore)
-                    elif c == "d" or c == "3":
-                        logger.warning("[Keyboard command] Set log level to DEBUG")
-                        logging.getLogger().setLevel(logging.DEBUG)
-                    elif c == "i" or c == "2":
-                        logger.warning("[Keyboard command] Set log level to INFO")
-                        logging.getLogger().setLevel(logging.INFO)
-                    elif c == "w" or c == "1":
-                        logger.warning("[Keyboard command] Set log level to WARNING")
-                        logging.getLogger().setLevel(logging.WARNING)
-                    elif c == "v":
-                        logger.warning("[Keyboard command] Print current values")
-                        observedValuesStore.printCurrentState()
-                    elif c == "s":
-                        logger.warning("[Keyboard command] Save values to file")
-                        try:
-                            saveValuesToFile(observedValuesStore, autosave=False)
-                        except Exception, e:
-                            logger.warning("ERROR saving file: %s" % e)
-                    elif c == "l":
-                        logger.warning("[Keyboard command] Load values from file")
-                        try:
-                            observedValuesStore = loadValuesFromFile()
-                        except Exception, e:
-                            logger.warning("ERROR loading file: %s" % e)
-                    elif c == "r":
-                        logger.warning("[Keyboard command] Resuming last session from autosave file")
-                        try:
-                            observedValuesStore = loadValuesFromFile(loadAutosave=True)
-                        except Exception, e:
-                            logger.warning("ERROR loading file: %s" % e)
-                    elif c == "a":
-                        if AUTOMATIC_EVALUATION_ENABLED:
-                            logger.warning("[Keyboard command] Automatic evaluation disabled")
-                            AUTOMATIC_EVALUATION_ENABLED = False
-                        else:
-                            logger.warning("[Keyboard command] Automatic evaluation enabled")
-                            AUTOMATIC_EVALUATION_ENABLED = True
-
-                if AUTOMATIC_EVALUATION_ENABLED and lastAutomaticEvaluation < lastValueUpdate:
-                    # Automatic Evaluation with update delay
-                    if lastAutomaticEvaluation + AUTOMATIC_EVALUATION_INTERVAL < time.time() and lastValueUpdate + AUTOMATIC_EVALUATION_UPDATE_DELAY < time.time():
-                        updateDescr = "(%ds Interval, %ds Update delay (max. %s)]" % (AUTOMATIC_EVALUATION_INTERVAL, AUTOMATIC_EVALUATION_UPDATE_DELAY, AUTOMATIC_EVALUATION_UPDATE_DELAY_MAX)
-                        logger.warning("[Automatic Evaluation %s]" % updateDescr)
-                        lastAutomaticEvaluation = time.time()
-                        result = checkTopology(topology, observedValuesStore)
-                        logger.warning("[Automatic Evaluation: Consistency: %s, Safety: %s]" % (str(result[0]), str(result[1])))
-
-                    # Automatic Evaluation after update delay threshold
-                    if lastAutomaticEvaluation + AUTOMATIC_EVALUATION_INTERVAL + AUTOMATIC_EVALUATION_UPDATE_DELAY_MAX < time.time():
-                        logger.warning("[Automatic Evaluation (FORCED)]")
-                        lastAutomaticEvaluation = time.time()
-                        result = checkTopology(topology, observedValuesStore)
-                        logger.warning("[Automatic Evaluation: Consistency: %s, Safety: %s]" % (str(result[0]), str(result[1])))
-
-                if AUTOMATIC_SAVE_ENABLED and lastAutomaticSave < lastValueUpdate:
-                    # Automatic save
-                    if lastAutomaticSave + AUTOMATIC_SAVE_INTERVAL < time.time():
-                        try:
-                            logger.info("Automatically saving values to file.")
-                            lastAutomaticSave = time.time()
-                            saveValuesToFile(observedValuesStore, autosave=True)
-                        except Exception, e:
-                            logger.warning("ERROR saving file (auto-save): %s" % e)
-
-                # Broccoli event handling
-                global broccoliConnection
-                broccoliConnection.processInput()
-
-                # Sleep
-                time.sleep(BROCCOLI_MAIN_LOOP_SLEEP)
-            except KeyboardInterrupt:
-                logger.warning("[Received Signal SIGINT] Closing application")
-                finishStateManager()
-            except Exception, e:
-                logger.error("Unknown exception or error in broccoli main loop. %s" % e.message)
-
-
-def initializeBroccoli():
-    """Initialize connection to Bro."""
-    failed = True
-    while failed:
-        try:
-            global broccoliConnection
-            broccoliConnection = broccoli.Connection(BROCCOLI_CONNECT)
-            failed = False
-            logger.info("Connected to Bro!")
-        except Exception, e:
-            logger.error("Unknown exception or error in broccoli initialization. %s" % e.message)
-
-
-def initializeStateManager(topologyCreationFunction, currentScenario):
+def initializeStateManager(topologyCreationFunction, currentScenario, shardName=None):
     """
-    Initialize StateManager with a Brocooli connection and an empty value store.
+    Initialize the default StateManager with a Brocooli connection and an empty value store.
     :param topologyCreationFunction: Function for topology creation
     :param currentScenario: Used underlaying scenario topology like "Masterthesis" or "Alpha"
+    :param shardName: Name of shard in SHARD_LAYOUTS (only the RTUs of the shard are evaluated, summaries are sent to the aggregator)
+    :return: Default StateManager instance
     """
     initializeLogging(level=logging.INFO, logLevel=False, logLocation=False, logTime=True, logToFile=True)
-    global scenario
-    global topology
-    global observedValuesStore
-    scenario = currentScenario
-    topology = topologyCreationFunction()
-    observedValuesStore = ValueStore("T_{o}")
-    initializeBroccoli()
+    global stateManager
+    stateManager = StateManager(topologyCreationFunction(), currentScenario, shardName)
+    stateManager.initializeTagConverters()
+    if COMPACT_TRANSPORT_ENABLED:
+        stateManager.initializeCompactTransport()
+    else:
+        stateManager.initializeBroccoli()
+    return stateManager
 
 
 def runStateManagerMainLoop():
     """Start state manager main loop."""
-    startBroccoliMainLoop()
+    stateManager.runMainLoop()
 
 
-def finishStateManager():
-    """Function that is called if StateManager is cancelled with SIGINT / CTRL + C."""
-    global observedValuesStore
-    observedValuesStore.printCurrentState()
-    observedValuesStore.printFullHistory()
-    global receivedCount
-    logger.info("Total successfully received and parsed measurements and commands: %d" % receivedCount)
+def finishStateManager(instance=None):
+    """
+    Function that is called if StateManager is cancelled with SIGINT / CTRL + C.
+    :param instance: Finished StateManager instance (default instance if not given)
+    """
+    (instance or stateManager).finish()
     sys.exit(0)
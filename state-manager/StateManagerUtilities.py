@@ -13,6 +13,9 @@ import termios
 FLOAT_TOLERANCE_REL = 5 * 1e-02
 FLOAT_TOLERANCE_ABS = 1 * 1e-04
 ZERO_TOLERANCE = 1 * 1e-04
+BRO_UNBOUNDED = 1e300
+UINT_STRUCT = struct.Struct("I")
+FLOAT_STRUCT = struct.Struct("f")
 
 
 def isClose(a, b, rel_tol=FLOAT_TOLERANCE_REL, abs_tol=FLOAT_TOLERANCE_ABS):
@@ -59,6 +62,17 @@ def typecheck(types, ranges=None):
     return __f
 
 
+def formatBroDouble(value):
+    """
+    Format a float value as bro double constant.
+    :param value: Float value
+    :return: Bro double constant (exponent notation for huge values like BRO_UNBOUNDED)
+    """
+    if abs(value) < 1e15:
+        return "%f" % value
+    return "%e" % value
+
+
 def formatTimestamp(timestamp, fileFormat=False):
     """
     Format the given timestamp to an human readable format
@@ -85,13 +99,24 @@ def normalize_value(value):
     return value / 32768.0 if value / 32768.0 < 1 else (value / 32768.0) - 2
 
 
+def denormalize_value(normalizedValue, lowerBound, upperBound):
+    """
+    Denormalize an iec-104 normalized value (between -1.0 and 1.0) into the real value of the normalization interval
+    :param normalizedValue: Normalized value
+    :param lowerBound: Lower bound of normalization interval
+    :param upperBound: Upper bound of normalization interval
+    :return: Denormalized value
+    """
+    return lowerBound + (upperBound - lowerBound) * (normalizedValue + 1) / 2.0
+
+
 def doublefy_value(value):
     """
     Convert a Bro (as bitarray converted to int) value to a double value
     :param value: Value to convert
     :return: Converted value
     """
-    return struct.unpack('f', struct.pack('I', value))[0]
+    return FLOAT_STRUCT.unpack(UINT_STRUCT.pack(value))[0]
 
 
 class KeyPoller():
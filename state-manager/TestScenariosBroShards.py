@@ -0,0 +1,46 @@
+#!/usr/bin/python
+# -*- coding: utf-8 -*-
+'''
+
+This script starts the aggregator or one shard of a sharded state manager deployment (see SHARD_LAYOUTS in ShardAggregation.py).
+Every shard connects to its own Bro instance (broccoli port) and sends summaries to the aggregator on the same machine.
+Usage: python TestScenariosBroShards.py <Alpha|Masterthesis> aggregator
+       python TestScenariosBroShards.py <Alpha|Masterthesis> <shard name> [broccoli port]
+'''
+import logging
+import sys
+import time
+
+import StateManager
+from LoggerUtilities import initializeLogging
+from ShardAggregation import ShardAggregator, SHARD_LAYOUTS
+from TestTopologies import SCENARIO_TOPOLOGIES
+
+
+def runAggregator(scenario):
+    """
+    Run the aggregator of the shard summaries until SIGINT / CTRL + C.
+    :param scenario: Scenario topology like "Masterthesis" or "Alpha"
+    """
+    initializeLogging(level=logging.INFO, logLevel=False, logLocation=False, logTime=True, logToFile=True)
+    aggregator = ShardAggregator(SCENARIO_TOPOLOGIES[scenario](), SHARD_LAYOUTS[scenario])
+    aggregator.start()
+    try:
+        while True:
+            time.sleep(1)
+    except KeyboardInterrupt:
+        aggregator.close()
+        aggregator.printStatistics()
+
+
+if __name__ == '__main__':
+    if len(sys.argv) < 3 or sys.argv[1] not in SCENARIO_TOPOLOGIES:
+        print __doc__
+        sys.exit(1)
+    if sys.argv[2] == "aggregator":
+        runAggregator(sys.argv[1])
+    else:
+        if len(sys.argv) > 3:
+            StateManager.BROCCOLI_CONNECT = "%s:%d" % (StateManager.BROCCOLI_HOST, int(sys.argv[3]))
+        StateManager.initializeStateManager(SCENARIO_TOPOLOGIES[sys.argv[1]], sys.argv[1], shardName=sys.argv[2])
+        StateManager.runStateManagerMainLoop()
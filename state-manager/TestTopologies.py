@@ -268,4 +268,33 @@ def initiateTopologyMasterthesis():
     rtu3 = LocalRTU("rtu3", [bus3, t1, t2])
     rtu4 = LocalRTU("rtu4", [g1, g2, c1, c2])
     topology = [rtu1, rtu2, rtu3, rtu4]
-    return topology
\ No newline at end of file
+    return topology
+
+
+def initiateTopologySynthetic(rtuCount, consumersPerRtu=2, parallelTies=2):
+    """
+    Initialize a synthetic topology of arbitrary size (e.g. for benchmarks).
+    Every RTU controls a bus with one generator and consumersPerRtu consumers, consecutive buses are connected by
+    parallelTies parallel lines (chain of meshed sections). Lines create their meters and switches implicitly.
+    :param rtuCount: Number of RTUs (buses)
+    :param consumersPerRtu: Number of consumers per bus (at least one)
+    :param parallelTies: Number of parallel lines between consecutive buses
+    :return: Synthetic topology
+    """
+    assert rtuCount > 0 and consumersPerRtu > 0
+    topology = []
+    tiesIn = []
+    for i in xrange(rtuCount):
+        generatorLine = PowerLine("syn%d_lg" % i, 400, 10000)
+        consumerLines = [PowerLine("syn%d_lc%d" % (i, j), 200, 10000) for j in xrange(consumersPerRtu)]
+        tiesOut = [PowerLine("syn%d_lt%d" % (i, j), 300, 10000) for j in xrange(parallelTies)] if i < rtuCount - 1 else []
+        generator = Generator("syn%d_g" % i, [], [generatorLine])
+        bus = Bus("syn%d_bus" % i, [generatorLine] + tiesIn, consumerLines + tiesOut)
+        consumers = [Consumer("syn%d_c%d" % (i, j), [line], []) for j, line in enumerate(consumerLines)]
+        topology.append(LocalRTU("syn%d_rtu" % i, [bus, generator] + consumers))
+        tiesIn = tiesOut
+    return topology
+
+
+# Scenario name -> topology creation function (for scripts that take the scenario as argument)
+SCENARIO_TOPOLOGIES = {"Alpha": initiateTopologyAlpha, "Masterthesis": initiateTopologyMasterthesis}
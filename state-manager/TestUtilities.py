@@ -8,11 +8,75 @@ import logging
 import os
 
 from LoggerUtilities import logAllChecksDescription, logAllChecksPassed, logError
+from StateManagerUtilities import ZERO_TOLERANCE
+from TopologyIndex import getInputTagsOfNode
 from ValueStore import ValueStore
 
 logger = logging.getLogger(__name__)
 
 SCENARIO_PATH = "../../state-manager/Scenarios/"
+BRO_RULES_PATH = os.path.dirname(os.path.abspath(__file__))
+BRO_RULES_FILENAME = "T104_SafetyRules_%s.bro"
+BRO_RULES_HEADER = """# This Bro script is automatically generated and contains the bound safety rules of the topology in BOUND_RULES.
+# Bound rules (R1, R2, R3, R8a, R8b) only depend on a single value and are evaluated in Bro.
+# Measured values are only forwarded to the state manager if they are in FORWARD_TAGS (read by a rule of the state manager) or violate a bound rule.
+
+module T104_SafetyRules;
+
+export
+{
+	# bound rule: value of the tag must be in [min;max] (values close to zero are ignored if ignoreZero)
+	type bound_rule_t: record{
+		rule : string;
+		node : string;
+		line : string;
+		min : double;
+		max : double;
+		ignoreZero : bool;
+	};
+
+	const ZERO_TOLERANCE = %s;
+
+	# hashmap: tag name -> bound rules of the tag
+	global BOUND_RULES : table[string] of vector of bound_rule_t;
+
+	# tags read by rules that are evaluated by the state manager
+	global FORWARD_TAGS : set[string];
+
+	function add_bound_rule(tagName: string, boundRule: bound_rule_t)
+	{
+		if ( tagName !in BOUND_RULES )
+			BOUND_RULES[tagName] = vector();
+		BOUND_RULES[tagName][|BOUND_RULES[tagName]|] = boundRule;
+	}
+
+	# Return all bound rules of a tag that are violated by a value
+	function check_bound_rules(tagName: string, value: double): vector of bound_rule_t
+	{
+		local violated: vector of bound_rule_t = vector();
+		if ( tagName !in BOUND_RULES )
+			return violated;
+		for ( i in BOUND_RULES[tagName] )
+		{
+			local boundRule = BOUND_RULES[tagName][i];
+			if ( boundRule$ignoreZero && |value| <= ZERO_TOLERANCE )
+				next;
+			if ( value < boundRule$min || value > boundRule$max )
+				violated[|violated|] = boundRule;
+		}
+		return violated;
+	}
+
+	function populate_safety_rules()
+	{
+"""
+BRO_RULES_FOOTER = """	}
+}
+# Initialization code
+event bro_init(){
+	populate_safety_rules();
+}
+"""
 
 
 def playScenarios(caseName, topology, rtusToTest=None, filterFunction=lambda filename: True):
@@ -43,12 +107,13 @@ def playScenarios(caseName, topology, rtusToTest=None, filterFunction=lambda fil
         checkTopology(topology, stateScenario, rtusToTest)
 
 
-def checkTopology(topology, state, rtusToTest=None):
+def checkTopology(topology, state, rtusToTest=None, graph=None):
     """
     Evaluate all consistency and safety rules on the topology with the given state information
     :param topology: Topology list of RTUs
     :param state: State object with stateful information
     :param rtusToTest: RTUs which should be tested
+    :param graph: TopologyGraph of the topology (consistency rules P1, P2 and P4 are evaluated vectorized) or None
     :return: (T,T) If all tests are successful, (F,T) if consistency violation, (T,F) if safety violation, (F,F) if violation in both
     """
     logAllChecksDescription("ALL CHECKS", "TOPOLOGY", indentation=0)
@@ -59,8 +124,13 @@ def checkTopology(topology, state, rtusToTest=None):
             relevantRTUs = [rtu for rtu in topology if rtu.name in rtusToTest]
         else:
             relevantRTUs = topology
+        if graph:
+            consistency = graph.executeFullConsistencyChecks(state, [rtu.name for rtu in relevantRTUs])
         for rtu in relevantRTUs:
-            checkStatusConsistency[rtu.name] = all(rtu.executeFullConsistencyCheck(state).values())
+            if graph:
+                checkStatusConsistency[rtu.name] = all(consistency[rtu.name].values())
+            else:
+                checkStatusConsistency[rtu.name] = all(rtu.executeFullConsistencyCheck(state).values())
             checkStatusSafety[rtu.name] = all(rtu.executeFullSafetyCheck(state).values())
         logAllChecksPassed("ALL CHECKS", "TOPOLOGY", all(checkStatusConsistency.values()) and all(checkStatusSafety.values()), indentation=0)
     except Exception, e:
@@ -68,11 +138,41 @@ def checkTopology(topology, state, rtusToTest=None):
     return (all(checkStatusConsistency.values()), all(checkStatusSafety.values()))
 
 
-def generateRules(topology):
+def getForwardedTags(topology):
     """
-    Start the Bro rule generation process.
+    Return all tags which are read by rules that are evaluated by the state manager.
+    Currents and voltages of both line ends are compared by P1, P2 and P4 (currents also by P3 and R4), switch, fuse and
+    relay states are read by P3 and R9, tap positions by P6 and P7 and the generated and consumed power by P5, R6 and R7.
+    Set points are forwarded as well: the state manager evaluates R8a and R8b on the observed state (automatic and command
+    evaluations), so a set point back in bounds has to replace a violating value.
     :param topology: Topology list of RTUs
+    :return: Set of tag names
     """
+    tags = set()
     for rtu in topology:
-        rtu.generateFullBroConsistencyCheck()
-        rtu.generateFullBroSafetyCheck()
+        for node in rtu.controlledNodes:
+            tags.update(getInputTagsOfNode(node))
+    return tags
+
+
+def generateRules(topology, topologyName, path=BRO_RULES_PATH):
+    """
+    Start the Bro rule generation process.
+    :param topology: Topology list of RTUs
+    :param topologyName: Name of topology (e.g. "Masterthesis" or "Alpha")
+    :param path: Directory of generated Bro script
+    :return: Filename of generated Bro script
+    """
+    filename = os.path.join(path, BRO_RULES_FILENAME % topologyName)
+    with open(filename, "w") as f:
+        f.write(BRO_RULES_HEADER % ZERO_TOLERANCE)
+        for rtu in topology:
+            f.write("\t\t# RTU %s\n" % rtu.name)
+            for statement in rtu.generateFullBroConsistencyCheck() + rtu.generateFullBroSafetyCheck():
+                f.write("\t\t%s\n" % statement)
+        f.write("\t\t# Forwarded tags\n")
+        for tag in sorted(getForwardedTags(topology)):
+            f.write("\t\tadd FORWARD_TAGS[\"%s\"];\n" % tag)
+        f.write(BRO_RULES_FOOTER)
+    logger.info("Generated Bro rules of topology %s: %s" % (topologyName, filename))
+    return filename
@@ -0,0 +1,308 @@
+#!/usr/bin/python
+# -*- coding: utf-8 -*-
+'''
+
+The topology graph is a compiled, array-based representation of a topology: node-line incidence matrix and
+index arrays of the meter values (current and voltage at start and end of every line) into one value vector.
+The consistency rules P1 (current law at buses), P2 (equal voltages at buses) and P4 (equal values at both ends of lines)
+are evaluated for all nodes at once with sparse matrix-vector products instead of one rule call per node.
+The other consistency rules are evaluated by the nodes, the results are the same dictionaries as of executeConsistencyCheck.
+Requires numpy and scipy, without them all rules are evaluated by the nodes.
+'''
+from GridComponents.Bus import Bus
+from GridComponents.Consumer import Consumer
+from GridComponents.Generator import Generator
+from GridComponents.Transformer import Transformer
+from LoggerUtilities import logAllChecksDescription, logAllChecksPassed, logError
+from StateManagerUtilities import FLOAT_TOLERANCE_REL, FLOAT_TOLERANCE_ABS
+from ValueStore import ValueNotStoredException, OverlayValueStore
+
+try:
+    import numpy
+    import scipy.sparse
+except ImportError:
+    numpy = None
+
+# node type -> consistency rules in order of executeConsistencyCheck
+CONSISTENCY_RULES = [(Bus, ["P1", "P2", "P3", "P4"]),
+                     (Generator, ["P3", "P4", "P5a"]),
+                     (Consumer, ["P3", "P4", "P5b"]),
+                     (Transformer, ["P3", "P4", "P6a", "P6b", "P7"])]
+VECTORIZED_RULES = ["P1", "P2", "P4"]
+
+
+def isCloseArray(a, b):
+    """
+    Elementwise isClose of StateManagerUtilities.
+    :param a: numpy array
+    :param b: numpy array
+    :return: Boolean numpy array
+    """
+    return numpy.abs(a - b) <= numpy.maximum(FLOAT_TOLERANCE_REL * numpy.maximum(numpy.abs(a), numpy.abs(b)), FLOAT_TOLERANCE_ABS)
+
+
+def getConsistencyRules(node):
+    """
+    Return the consistency rules of a node in order of its executeConsistencyCheck.
+    :param node: Node of the topology (bus, generator, consumer, transformer)
+    :return: List of rule names (empty list for unknown node types)
+    """
+    for nodeType, rules in CONSISTENCY_RULES:
+        if isinstance(node, nodeType):
+            return rules
+    return []
+
+
+class StateVector():
+    def __init__(self, keys):
+        """
+        Initialize the vector of the values of some tags.
+        :param keys: List of tag names (positions in the vector)
+        """
+        self.keys = keys
+        self.keyIndex = dict([(key, i) for i, key in enumerate(keys)])
+        self.cached = None
+
+    def retrieve(self, state):
+        """
+        Read the values of the tags from a state. The values of a ValueStore are kept until its version changes,
+        for overlays only the values changed in the overlay are read. The returned arrays must not be modified.
+        :param state: State object (observed or calculated)
+        :return: (numpy array of values, boolean numpy array: value known and valid)
+        """
+        if isinstance(state, OverlayValueStore):
+            values, known = self.retrieve(state.baseStore)
+            values = values.copy()
+            known = known.copy()
+            for key in state.getModifiedKeys():
+                i = self.keyIndex.get(key)
+                if i is not None:
+                    try:
+                        values[i] = state.retrieveValue(key)
+                        known[i] = True
+                    except ValueNotStoredException:
+                        known[i] = False
+            return values, known
+        cached = self.cached
+        version = getattr(state, "version", None)
+        if cached and cached[0] is state and version is not None and cached[1] == version:
+            return cached[2], cached[3]
+        values = numpy.zeros(len(self.keys))
+        known = numpy.zeros(len(self.keys), dtype=bool)
+        for i, key in enumerate(self.keys):
+            try:
+                values[i] = state.retrieveValue(key)
+                known[i] = True
+            except ValueNotStoredException:
+                pass
+        self.cached = (state, version, values, known)
+        return values, known
+
+
+class TopologyGraph():
+    def __init__(self, topology):
+        """
+        Compile a topology into incidence matrices and index arrays.
+        :param topology: Topology list of RTUs
+        """
+        assert numpy, "TopologyGraph requires numpy and scipy."
+        self.topology = topology
+        self.nodes = []
+        self.lines = []
+        self.keys = []
+        self.nodeIndex = dict()
+        self.lineIndex = dict()
+        self.keyIndex = dict()
+        for rtu in topology:
+            for node in rtu.controlledNodes:
+                if node.name not in self.nodeIndex:
+                    self.nodeIndex[node.name] = len(self.nodes)
+                    self.nodes.append(node)
+        for node in self.nodes:
+            for l in node.getAllConnectedLines():
+                if l.name not in self.lineIndex:
+                    self.lineIndex[l.name] = len(self.lines)
+                    self.lines.append(l)
+        self.startCurrent = self.getKeyIndexes([l.startMeter.currentKey for l in self.lines])
+        self.startVoltage = self.getKeyIndexes([l.startMeter.voltageKey for l in self.lines])
+        self.endCurrent = self.getKeyIndexes([l.endMeter.currentKey for l in self.lines])
+        self.endVoltage = self.getKeyIndexes([l.endMeter.voltageKey for l in self.lines])
+        self.buses = numpy.array([i for i, n in enumerate(self.nodes) if isinstance(n, Bus)], dtype=numpy.intp)
+        self.incidence = self.createIncidenceMatrix()
+        self.nodeLines = abs(self.incidence).tocsr()
+        busCurrents, self.busVoltageKeys, self.busVoltagePointers = self.createBusIndexes()
+        self.busIngoing = busCurrents.multiply(busCurrents > 0).tocsr()
+        self.busOutgoing = -busCurrents.multiply(busCurrents < 0).tocsr()
+        self.busCurrentLines = abs(busCurrents).tocsr()
+        self.values = StateVector(self.keys)
+
+    def getKeyIndexes(self, keys):
+        """
+        Return the positions of tags in the value vector (tags are added if not known yet).
+        :param keys: List of tag names
+        :return: numpy array of positions
+        """
+        for key in keys:
+            if key not in self.keyIndex:
+                self.keyIndex[key] = len(self.keys)
+                self.keys.append(key)
+        return numpy.array([self.keyIndex[key] for key in keys], dtype=numpy.intp)
+
+    def createIncidenceMatrix(self):
+        """
+        Create the node-line incidence matrix: +1 for the start node, -1 for the end node of a line (nodes of the topology only).
+        :return: scipy.sparse CSR matrix (nodes x lines)
+        """
+        rows, columns, data = [], [], []
+        for j, l in enumerate(self.lines):
+            for node, sign in [(l.startNode, 1.0), (l.endNode, -1.0)]:
+                if node is not None and node.name in self.nodeIndex:
+                    rows.append(self.nodeIndex[node.name])
+                    columns.append(j)
+                    data.append(sign)
+        return scipy.sparse.csr_matrix((data, (rows, columns)), shape=(len(self.nodes), len(self.lines)))
+
+    def createBusIndexes(self):
+        """
+        Create the indexes of P1 and P2: signed local currents per bus (+1 ingoing, -1 outgoing line)
+        and the local voltages of all lines of a bus (concatenated, one segment per bus).
+        :return: (scipy.sparse CSR matrix (buses x values), numpy array of value positions, numpy array of segment starts)
+        """
+        rows, columns, data = [], [], []
+        voltageKeys = []
+        voltagePointers = []
+        for b, i in enumerate(self.buses):
+            bus = self.nodes[i]
+            voltagePointers.append(len(voltageKeys))
+            for lines, sign in [(bus.linesIn, 1.0), (bus.linesOut, -1.0)]:
+                for l in lines:
+                    rows.append(b)
+                    columns.append(self.getKeyIndexes([l.getLocalComponent(bus, "local", "meter").currentKey])[0])
+                    data.append(sign)
+            for l in bus.getAllConnectedLines():
+                voltageKeys.append(self.getKeyIndexes([l.getLocalComponent(bus, "local", "meter").voltageKey])[0])
+        busCurrents = scipy.sparse.csr_matrix((data, (rows, columns)), shape=(len(self.buses), len(self.keys)))
+        return busCurrents, numpy.array(voltageKeys, dtype=numpy.intp), numpy.array(voltagePointers, dtype=numpy.intp)
+
+    def retrieveValues(self, state):
+        """
+        Read the meter values of all lines from a state (see StateVector.retrieve).
+        :param state: State object (observed or calculated)
+        :return: (numpy array of values, boolean numpy array: value known and valid)
+        """
+        return self.values.retrieve(state)
+
+    def evaluateArrays(self, values, known):
+        """
+        Evaluate P1, P2 and P4 on a value vector.
+        :param values: numpy array of values (see retrieveValues)
+        :param known: Boolean numpy array: value known and valid
+        :return: Dictionary of numpy arrays: "busImbalance" (ingoing - outgoing current per bus), "P1" and "P2" (per bus),
+                 "P2Undefined" (per bus: no voltage different from 0), "lineVoltageMismatch" and "lineCurrentMismatch"
+                 (start - end per line), "P4" (per node)
+        """
+        unknown = (~known).astype(numpy.float64)
+        # P1: sum of ingoing current == sum of outgoing current (passed if any current is unknown)
+        ingoing = self.busIngoing.dot(values)
+        outgoing = self.busOutgoing.dot(values)
+        p1Unknown = self.busCurrentLines.dot(unknown) > 0
+        p1 = p1Unknown | isCloseArray(ingoing, outgoing)
+        # P2: min and max of the voltages different from 0 are equal (passed if any voltage is unknown)
+        busVoltages = values[self.busVoltageKeys]
+        relevant = ~isCloseArray(busVoltages, numpy.zeros(len(busVoltages)))
+        if len(self.buses):
+            p2Unknown = numpy.logical_or.reduceat(~known[self.busVoltageKeys], self.busVoltagePointers)
+            anyRelevant = numpy.logical_or.reduceat(relevant, self.busVoltagePointers)
+            minimum = numpy.minimum.reduceat(numpy.where(relevant, busVoltages, numpy.inf), self.busVoltagePointers)
+            maximum = numpy.maximum.reduceat(numpy.where(relevant, busVoltages, -numpy.inf), self.busVoltagePointers)
+            minimum[~anyRelevant] = maximum[~anyRelevant] = 0.0
+            p2 = p2Unknown | isCloseArray(minimum, maximum)
+            p2Undefined = ~p2Unknown & ~anyRelevant
+        else:
+            p2 = p2Undefined = numpy.zeros(0, dtype=bool)
+        # P4: voltage and current at both ends of a line are equal (lines with unknown values are skipped)
+        voltageMismatch = values[self.startVoltage] - values[self.endVoltage]
+        currentMismatch = values[self.startCurrent] - values[self.endCurrent]
+        lineKnown = known[self.startVoltage] & known[self.endVoltage] & known[self.startCurrent] & known[self.endCurrent]
+        lineViolated = lineKnown & ~(isCloseArray(values[self.startVoltage], values[self.endVoltage]) &
+                                     isCloseArray(values[self.startCurrent], values[self.endCurrent]))
+        p4 = self.nodeLines.dot(lineViolated.astype(numpy.float64)) == 0
+        return {"busImbalance": ingoing - outgoing, "P1": p1, "P2": p2, "P2Undefined": p2Undefined,
+                "lineVoltageMismatch": voltageMismatch, "lineCurrentMismatch": currentMismatch, "P4": p4}
+
+    def evaluateConsistency(self, state):
+        """
+        Evaluate P1, P2 and P4 of all nodes.
+        :param state: State object (observed or calculated)
+        :return: Dictionary node name -> dictionary rule -> True if rule holds (P1 and P2 for buses only,
+                 P2 is None if no voltage of the bus is different from 0)
+        """
+        results = self.evaluateArrays(*self.retrieveValues(state))
+        checkStatus = dict([(n.name, {"P4": bool(p4)}) for n, p4 in zip(self.nodes, results["P4"])])
+        for b, i in enumerate(self.buses):
+            busStatus = checkStatus[self.nodes[i].name]
+            busStatus["P1"] = bool(results["P1"][b])
+            busStatus["P2"] = None if results["P2Undefined"][b] else bool(results["P2"][b])
+        return checkStatus
+
+    def executeConsistencyChecks(self, state, nodes=None):
+        """
+        Execute the consistency checks of nodes: P1, P2 and P4 vectorized, all other rules by the nodes.
+        :param state: State object which contains state information
+        :param nodes: Nodes to check (all nodes of the graph if not given)
+        :return: Dictionary node name -> dictionary rule -> result (same as executeConsistencyCheck of the node)
+        """
+        vectorized = self.evaluateConsistency(state)
+        checkStatus = dict()
+        for n in nodes if nodes is not None else self.nodes:
+            logAllChecksDescription("CONSISTENCY", "%s %s" % (n.__class__.__name__.upper(), n.name), indentation=2)
+            nodeStatus = dict()
+            try:
+                for rule in getConsistencyRules(n):
+                    if rule in VECTORIZED_RULES:
+                        if vectorized[n.name][rule] is None:
+                            # P2 of a node raises an error (min of empty list), later rules are not evaluated
+                            raise ValueError("No voltage different from 0 at %s." % n.name)
+                        nodeStatus[rule] = vectorized[n.name][rule]
+                    else:
+                        nodeStatus[rule] = getattr(n, "consistencyCheck" + rule)(state)
+                logAllChecksPassed("CONSISTENCY", "%s %s" % (n.__class__.__name__.upper(), n.name), all(nodeStatus.values()), indentation=2)
+            except Exception, e:
+                logError("Unknown exception or error: %s" % e.message, indentation=2)
+            checkStatus[n.name] = nodeStatus
+        return checkStatus
+
+    def executeFullConsistencyChecks(self, state, rtusToTest=None):
+        """
+        Execute the consistency checks of RTUs (same results as executeFullConsistencyCheck of the RTUs).
+        :param state: State object which contains state information
+        :param rtusToTest: RTU names which should be tested (all RTUs if not given)
+        :return: Dictionary RTU name -> dictionary node name -> True if all consistency rules of the node hold
+        """
+        relevantRTUs = [rtu for rtu in self.topology if rtusToTest is None or rtu.name in rtusToTest]
+        nodes = dict()
+        for rtu in relevantRTUs:
+            for n in rtu.controlledNodes:
+                nodes[n.name] = n
+        nodeStatus = self.executeConsistencyChecks(state, nodes.values())
+        checkStatus = dict()
+        for rtu in relevantRTUs:
+            checkStatus[rtu.name] = dict([(n.name, all(nodeStatus[n.name].values())) for n in rtu.controlledNodes])
+        return checkStatus
+
+
+def executeConsistencyChecks(topology, state, graph=None):
+    """
+    Execute the consistency checks of all nodes of a topology (vectorized if numpy and scipy are available).
+    :param topology: Topology list of RTUs
+    :param state: State object which contains state information
+    :param graph: TopologyGraph of the topology (compiled if not given)
+    :return: Dictionary node name -> dictionary rule -> result (same as executeConsistencyCheck of the node)
+    """
+    if numpy:
+        return (graph or TopologyGraph(topology)).executeConsistencyChecks(state)
+    checkStatus = dict()
+    for rtu in topology:
+        for n in rtu.controlledNodes:
+            checkStatus[n.name] = n.executeConsistencyCheck(state)
+    return checkStatus
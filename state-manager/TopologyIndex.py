@@ -0,0 +1,87 @@
+#!/usr/bin/python
+# -*- coding: utf-8 -*-
+'''
+
+The topology index maps tags to the nodes and RTUs whose consistency and safety rules read them.
+It is used to restrict evaluations to the part of the topology that is affected by changed values.
+'''
+from collections import defaultdict
+
+
+def getInputTagsOfNode(node):
+    """
+    Return all tags that are read by the rules of a node.
+    :param node: Node of the topology (bus, generator, consumer, transformer)
+    :return: Set of tag names
+    """
+    tags = set()
+    for l in node.getAllConnectedLines():
+        for location in ["local", "remote"]:
+            meter = l.getLocalComponent(node, location, "meter")
+            tags.update([meter.currentKey, meter.voltageKey, meter.setPointIKey, meter.setPointVKey])
+            for type in ["switch", "fuse", "protectiveRelay"]:
+                component = l.getLocalComponent(node, location, type)
+                if component:
+                    tags.add(component.stateKey)
+        localSwitch = l.getLocalComponent(node, "local", "switch")
+        if localSwitch:
+            for interlock in localSwitch.interlocks:
+                tags.update([s.stateKey for s in interlock.interlockedSwitches])
+    for keyAttribute in ["tapPositionKey", "generatedPowerKey", "consumedPowerKey"]:
+        key = getattr(node, keyAttribute, None)
+        if key:
+            tags.add(key)
+    return tags
+
+
+class TopologyIndex():
+    def __init__(self, topology):
+        """
+        Build the index for a topology.
+        :param topology: Topology list of RTUs
+        """
+        self.topology = topology
+        self.nodesByTag = defaultdict(set)
+        self.rtusByTag = defaultdict(set)
+        self.tagsByNode = dict()
+        self.rtuByNode = dict()
+        for rtu in topology:
+            for node in rtu.controlledNodes:
+                tags = getInputTagsOfNode(node)
+                self.tagsByNode[node.name] = frozenset(tags)
+                self.rtuByNode[node.name] = rtu.name
+                for tag in tags:
+                    self.nodesByTag[tag].add(node)
+                    self.rtusByTag[tag].add(rtu.name)
+
+    def getNodesOfTags(self, tagNames):
+        """
+        Return all nodes whose rules read at least one of the given tags.
+        :param tagNames: Iterable of tag names
+        :return: Set of nodes
+        """
+        nodes = set()
+        for tag in tagNames:
+            if self.nodesByTag.has_key(tag):
+                nodes.update(self.nodesByTag[tag])
+        return nodes
+
+    def getRTUsOfTags(self, tagNames):
+        """
+        Return the names of all RTUs whose rules read at least one of the given tags.
+        :param tagNames: Iterable of tag names
+        :return: Set of RTU names
+        """
+        rtus = set()
+        for tag in tagNames:
+            if self.rtusByTag.has_key(tag):
+                rtus.update(self.rtusByTag[tag])
+        return rtus
+
+    def getInputTags(self, node):
+        """
+        Return all tags that are read by the rules of a node.
+        :param node: Indexed node
+        :return: Frozen set of tag names
+        """
+        return self.tagsByNode[node.name]
@@ -0,0 +1,181 @@
+#!/usr/bin/python
+# -*- coding: utf-8 -*-
+'''
+
+The value converters turn raw Bro values (bitarrays interpreted as int) into real process values.
+A converter function is resolved once per tag and raw type from the RTU configuration (normalization interval)
+instead of dispatching on the raw type for every received value.
+Batches of raw values (e.g. of the compact transport) are converted at once with NumPy if available.
+The RTU configuration is loaded with the cached model of the policy generator (RTUConfiguration.py next to this module
+or in the policy-generator directory of the repository).
+'''
+import logging
+import os
+import sys
+
+from StateManagerUtilities import normalize_value, denormalize_value, UINT_STRUCT, FLOAT_STRUCT
+
+POLICY_GENERATOR_PATH = os.path.join(os.path.dirname(os.path.abspath(__file__)), os.pardir, "policy-generator")
+if POLICY_GENERATOR_PATH not in sys.path:
+    sys.path.append(POLICY_GENERATOR_PATH)
+from RTUConfiguration import loadRTUConfiguration
+
+try:
+    import numpy
+except ImportError:
+    numpy = None
+
+logger = logging.getLogger(__name__)
+
+RAW_TYPES = ["normalized", "double", "real", "doublePoint", "singlePoint"]
+
+
+def doublefyRaw(rawValue):
+    """
+    Convert a raw value (bits of an IEEE 754 single precision value) to a double value.
+    :param rawValue: Raw value
+    :return: Converted value
+    """
+    return FLOAT_STRUCT.unpack(UINT_STRUCT.pack(int(rawValue)))[0]
+
+
+def createConverter(rawType, lowerBound=None, upperBound=None):
+    """
+    Create the converter function of a raw type.
+    :param rawType: Type ("normalized", "double", "real", "doublePoint", "singlePoint")
+    :param lowerBound: Lower bound of normalization interval (normalized values are not denormalized if not given)
+    :param upperBound: Upper bound of normalization interval
+    :return: Function that converts a raw value to the real process value with right type
+    """
+    if rawType == "normalized":
+        if lowerBound is None or upperBound is None:
+            return normalize_value
+        return lambda rawValue: denormalize_value(normalize_value(rawValue), lowerBound, upperBound)
+    elif rawType == "double":
+        return doublefyRaw
+    elif rawType == "real":
+        return lambda rawValue: rawValue
+    elif rawType == "doublePoint":
+        return int
+    elif rawType == "singlePoint":
+        return bool
+    else:
+        raise AssertionError("rawType not recognized. Valid values: %s" % ", ".join(RAW_TYPES))
+
+
+def convertRawValues(rawValues, rawType, lowerBounds=None, upperBounds=None):
+    """
+    Convert a batch of raw values of the same type.
+    :param rawValues: List (or array) of raw values
+    :param rawType: Type ("normalized", "double", "real", "doublePoint", "singlePoint")
+    :param lowerBounds: Lower bound or list of lower bounds (one per value) of the normalization intervals
+    :param upperBounds: Upper bound or list of upper bounds (one per value) of the normalization intervals
+    :return: List of converted values
+    """
+    if rawType not in RAW_TYPES:
+        raise AssertionError("rawType not recognized. Valid values: %s" % ", ".join(RAW_TYPES))
+    if not numpy:
+        if lowerBounds is None or upperBounds is None or rawType != "normalized":
+            return map(createConverter(rawType), rawValues)
+        count = len(rawValues)
+        lowerBounds = lowerBounds if isinstance(lowerBounds, (list, tuple)) else [lowerBounds] * count
+        upperBounds = upperBounds if isinstance(upperBounds, (list, tuple)) else [upperBounds] * count
+        return [createConverter(rawType, l, u)(r) for r, l, u in zip(rawValues, lowerBounds, upperBounds)]
+    if rawType == "real":
+        return numpy.asarray(rawValues, dtype=numpy.float64).tolist()
+    raw = numpy.asarray(rawValues, dtype=numpy.float64).astype(numpy.uint32)
+    if rawType == "normalized":
+        values = raw / 32768.0
+        values[values >= 1] -= 2
+        if lowerBounds is not None and upperBounds is not None:
+            lowerBounds = numpy.asarray(lowerBounds, dtype=numpy.float64)
+            upperBounds = numpy.asarray(upperBounds, dtype=numpy.float64)
+            values = lowerBounds + (upperBounds - lowerBounds) * (values + 1) / 2.0
+        return values.tolist()
+    elif rawType == "double":
+        return raw.view(numpy.float32).astype(numpy.float64).tolist()
+    elif rawType == "doublePoint":
+        return raw.astype(int).tolist()
+    else:
+        return (raw != 0).tolist()
+
+
+class TagConverters():
+    def __init__(self, rtuConfigurationFilename=None):
+        """
+        Initialize the converters of the tags of an RTU configuration.
+        :param rtuConfigurationFilename: Path to RTU configuration (csv format), no normalization intervals are known if not given
+        """
+        self.intervals = dict()
+        self.addresses = dict()
+        self.converters = dict()
+        if rtuConfigurationFilename:
+            self.loadConfiguration(rtuConfigurationFilename)
+
+    def loadConfiguration(self, rtuConfigurationFilename):
+        """
+        Load tag names, addresses and normalization intervals of an RTU configuration.
+        :param rtuConfigurationFilename: Path to RTU configuration (csv format)
+        """
+        rtuConfiguration = loadRTUConfiguration(rtuConfigurationFilename)
+        self.intervals.update(rtuConfiguration.intervals)
+        for address, tag in rtuConfiguration.tagsByAddress.iteritems():
+            self.addresses[address] = tag.tagName
+        self.converters.clear()
+
+    def getTagName(self, rtuNumber, address):
+        """
+        Return the tag name of an address.
+        :param rtuNumber: RTU number
+        :param address: Information object address
+        :return: Tag name or None if the address is unknown
+        """
+        return self.addresses.get((rtuNumber, address))
+
+    def getConverter(self, tagName, rawType):
+        """
+        Return the converter function of a tag (created on first use).
+        :param tagName: Tag name
+        :param rawType: Type ("normalized", "double", "real", "doublePoint", "singlePoint")
+        :return: Function that converts a raw value of the tag to the real process value
+        """
+        key = (tagName, rawType)
+        converter = self.converters.get(key)
+        if converter is None:
+            lowerBound, upperBound = self.intervals.get(tagName, (None, None))
+            converter = createConverter(rawType, lowerBound, upperBound)
+            self.converters[key] = converter
+        return converter
+
+    def convertValue(self, tagName, rawValue, rawType):
+        """
+        Convert a raw value of a tag.
+        :param tagName: Tag name
+        :param rawValue: Raw value
+        :param rawType: Type ("normalized", "double", "real", "doublePoint", "singlePoint")
+        :return: Converted real process value
+        """
+        return self.getConverter(tagName, rawType)(rawValue)
+
+    def convertValues(self, tagNames, rawValues, rawTypes):
+        """
+        Convert a batch of raw values of several tags and types (grouped by type and converted at once).
+        :param tagNames: List of tag names
+        :param rawValues: List of raw values
+        :param rawTypes: List of types
+        :return: List of converted values in order of the raw values
+        """
+        values = [None] * len(rawValues)
+        groups = dict()
+        for i, rawType in enumerate(rawTypes):
+            groups.setdefault(rawType, []).append(i)
+        for rawType, indices in groups.iteritems():
+            groupValues = [rawValues[i] for i in indices]
+            if rawType == "normalized":
+                intervals = [self.intervals.get(tagNames[i], (-1.0, 1.0)) for i in indices]
+                converted = convertRawValues(groupValues, rawType, [l for l, u in intervals], [u for l, u in intervals])
+            else:
+                converted = convertRawValues(groupValues, rawType)
+            for i, value in zip(indices, converted):
+                values[i] = value
+        return values
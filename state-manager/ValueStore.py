@@ -13,6 +13,7 @@ import time
 from collections import defaultdict
 
 from LoggerUtilities import initializeLogging
+from ScenarioFiles import iterScenarioEvents
 from StateManagerUtilities import formatTimestamp
 
 logger = logging.getLogger(__name__)
@@ -43,6 +44,18 @@ class ValueStore():
         self.description = description
         self.store = initialValues if type(initialValues) == dict else dict()
         self.history = defaultdict(pickleableLambdaSubstitute)
+        self.version = 0
+        self.tagVersions = dict()
+
+    def __setstate__(self, state):
+        """
+        Restore a pickled or copied ValueStore (dumps of older versions contain no version counters).
+        :param state: Attribute dictionary
+        """
+        self.__dict__.update(state)
+        if not self.__dict__.has_key("tagVersions"):
+            self.version = 0
+            self.tagVersions = dict()
 
     def updateValue(self, name, value, timestamp=None):
         """
@@ -53,17 +66,53 @@ class ValueStore():
         """
         if not timestamp:
             timestamp = time.time()
-        if self.store.has_key(name):
-            self.history[name].append(self.store[name])
+        if self.hasValue(name):
+            self.history[name].append(self._retrieveEntry(name))
         self.store[name] = (value, timestamp, True)
+        self.version += 1
+        self.tagVersions[name] = self.version
 
     def invalidateValue(self, name):
         """
         Invalidates a value in the ValueStore.
         :param name: Reference key
         """
-        if self.store.has_key(name):
-            self.store[name] = (self.store[name][0], self.store[name][1], False)
+        if self.hasValue(name):
+            entry = self._retrieveEntry(name)
+            self.store[name] = (entry[0], entry[1], False)
+            self.version += 1
+            self.tagVersions[name] = self.version
+
+    def retrieveVersion(self, name):
+        """
+        Return the version of a value. The version changes whenever the value is updated or invalidated.
+        :param name: Reference key
+        :return: Version number (0 if value was never stored)
+        """
+        return self.tagVersions.get(name, 0)
+
+    def _retrieveEntry(self, name):
+        """
+        Return the stored entry of a value.
+        :param name: Reference key (must be stored)
+        :return: Tuple (value, timestamp, valid)
+        """
+        return self.store[name]
+
+    def _retrieveHistory(self, name):
+        """
+        Return the history entries of a value (reading never adds keys to the history).
+        :param name: Reference key
+        :return: List of (value, timestamp, valid) tuples
+        """
+        return self.history.get(name, [])
+
+    def getEntries(self):
+        """
+        Return the stored entries of all values.
+        :return: Dictionary reference key -> (value, timestamp, valid) tuple (must not be modified)
+        """
+        return self.store
 
     def retrieveValue(self, name, retrieveInvalidValues=False):
         """
@@ -73,11 +122,12 @@ class ValueStore():
         :param retrieveInvalidValues: True if also invalidated values should be returned, ValueNotStoredException otherwise
         :return: Stored value
         """
-        if not self.store.has_key(name):
+        if not self.hasValue(name):
             raise ValueNotStoredException("%s not in ValueStore." % name)
-        if not retrieveInvalidValues and not self.store[name][2]:
+        entry = self._retrieveEntry(name)
+        if not retrieveInvalidValues and not entry[2]:
             raise ValueNotStoredException("%s in ValueStore, but was invalidated." % name)
-        return self.store[name][0]
+        return entry[0]
 
     def retrieveAge(self, name):
         """
@@ -86,9 +136,9 @@ class ValueStore():
         :param name: Reference key
         :return: Age of value
         """
-        if not self.store.has_key(name):
+        if not self.hasValue(name):
             raise ValueNotStoredException("%s not in ValueStore." % name)
-        return time.time() - self.store[name][1]
+        return time.time() - self._retrieveEntry(name)[1]
 
     def retrieveValueBefore(self, name, timestamp):
         """
@@ -98,15 +148,16 @@ class ValueStore():
         :param timestamp: Timestamp
         :return: Stored value
         """
-        if not self.store.has_key(name):
+        if not self.hasValue(name):
             raise ValueNotStoredException("%s not in ValueStore." % name)
-        if not self.store[name][2]:
+        entry = self._retrieveEntry(name)
+        if not entry[2]:
             raise ValueNotStoredException("%s in ValueStore, but was invalidated." % name)
-        if self.store[name][1] < timestamp:
-            return self.store[name][0]
+        if entry[1] < timestamp:
+            return entry[0]
         else:
             latestValue = None
-            for v in sorted(self.history[name], key=lambda (a, b, c): b):
+            for v in sorted(self._retrieveHistory(name), key=lambda (a, b, c): b):
                 if v[1] > timestamp:
                     break
                 latestValue = v[0]
@@ -134,16 +185,27 @@ class ValueStore():
             copied.name = newName
         return copied
 
+    def getOverlay(self, newName=None):
+        """
+        Generate a ValueStore that reads through to this ValueStore and keeps its own changes separately.
+        Unchanged values are shared with this ValueStore instead of being copied.
+        This ValueStore must not be modified while the overlay is in use, reading through the overlay never modifies it.
+        :param newName: Name of new ValueStore
+        :return: New OverlayValueStore object
+        """
+        return OverlayValueStore(self, newName)
+
     def _printKeyInfo(self, key):
         """
         Prints value information about a stored value.
         :param key: Reference key
         """
-        valid = "(invalidated)" if not self.store[key][2] else ""
-        if type(self.store[key]) == float:
-            logger.info("\t%s[%s]: %8f %s" % (self.name, key, self.store[key][0], valid))
+        entry = self._retrieveEntry(key)
+        valid = "(invalidated)" if not entry[2] else ""
+        if type(entry[0]) == float:
+            logger.info("\t%s[%s]: %8f %s" % (self.name, key, entry[0], valid))
         else:
-            logger.info("\t%s[%s]: %s %s" % (self.name, key, self.store[key][0], valid))
+            logger.info("\t%s[%s]: %s %s" % (self.name, key, entry[0], valid))
 
     def compareTo(self, otherValueStore):
         """
@@ -151,13 +213,15 @@ class ValueStore():
         :param otherValueStore: Other ValueStore
         """
         logger.info("Comparing ValueStore %s with ValueStore %s." % (self.name, otherValueStore.name))
-        keys1 = set(self.store.keys())
-        keys2 = set(otherValueStore.store.keys())
+        entries1 = self.getEntries()
+        entries2 = otherValueStore.getEntries()
+        keys1 = set(entries1.keys())
+        keys2 = set(entries2.keys())
         added = keys1 - keys2
         removed = keys2 - keys1
         intersection = keys1.intersection(keys2)
-        modified = {key for key in intersection if self.store[key] <> otherValueStore.store[key]}
-        equal = {key for key in intersection if self.store[key] == otherValueStore.store[key]}
+        modified = {key for key in intersection if entries1[key] <> entries2[key]}
+        equal = {key for key in intersection if entries1[key] == entries2[key]}
         logger.info("Equal key-values:")
         for k in equal:
             self._printKeyInfo(k)
@@ -177,35 +241,38 @@ class ValueStore():
     def printCurrentState(self):
         """Print the currently stored values."""
         logger.info("Currently stored values:")
-        for k, v in sorted(self.store.iteritems(), key=lambda (a, b): a):
+        entries = self.getEntries()
+        for k, v in sorted(entries.iteritems(), key=lambda (a, b): a):
             valid = "(invalidated)" if not v[2] else ""
             if type(v[0]) == float:
                 logger.info("\t%-10s:%8f %s (since %s)" % (k, v[0], valid, formatTimestamp(v[1])))
             else:
                 logger.info("\t%-10s:%s %s (since %s)" % (k, v[0], valid, formatTimestamp(v[1])))
-        logger.info("Total stored values: %d" % len(self.store))
+        logger.info("Total stored values: %d" % len(entries))
 
     def printFullHistory(self):
         """Print the value history."""
         logger.debug("Full value history:")
-        for n in sorted(self.store.keys()):
+        keys = sorted(self.getEntries().keys())
+        for n in keys:
             self.printHistory(n)
-        logger.debug("Total history entries: %d" % sum([len(self.history[n]) for n in self.store.keys()]))
+        logger.debug("Total history entries: %d" % sum([len(self._retrieveHistory(n)) for n in keys]))
 
     def printHistory(self, name):
         """
         Print the value history for a specific value.
         :param name: Reference key
         """
-        if not self.store.has_key(name):
+        if not self.hasValue(name):
             logger.debug("No value found for %s." % name)
         else:
             logger.debug("Value history for %s:" % name)
-            if type(self.store[name][0]) == float:
-                logger.debug("\t%s: %8f (current)" % (formatTimestamp(self.store[name][1]), self.store[name][0]))
+            entry = self._retrieveEntry(name)
+            if type(entry[0]) == float:
+                logger.debug("\t%s: %8f (current)" % (formatTimestamp(entry[1]), entry[0]))
             else:
-                logger.debug("\t%s: %s (current)" % (formatTimestamp(self.store[name][1]), self.store[name][0]))
-            for v, t, valid in sorted(self.history[name], key=lambda (a, b, c): b, reverse=True):
+                logger.debug("\t%s: %s (current)" % (formatTimestamp(entry[1]), entry[0]))
+            for v, t, valid in sorted(self._retrieveHistory(name), key=lambda (a, b, c): b, reverse=True):
                 if type(v) == float:
                     logger.debug("\t%s: %8f" % (formatTimestamp(t), v))
                 else:
@@ -213,54 +280,167 @@ class ValueStore():
 
     def loadFromFile(self, filename):
         """
-        Load values from a scenario file.
+        Load values from a scenario file (text or compiled format, see ScenarioFiles.py).
         :param filename: Absolute or relative filepath of scenario file
         """
-        with open(filename, "r") as f:
-            i = 1
-            for line in f:
-                line = line.strip()
-                if line:
-                    if not line.startswith("#"):
-                        tmp = line.split(" ")
-                        eventType = tmp[0]
-                        if eventType == "OPTION":
-                            optionType = tmp[1]
-                            if optionType == "description":
-                                self.description = line[len("OPTION description "):]
-                            elif optionType == "name":
-                                self.name = line[len("OPTION name "):]
-                        elif eventType == "MEASUREMENT":
-                            valueType = tmp[1]
-                            key = tmp[2]
-                            value = tmp[3]
-                            if valueType == "B":
-                                assert value == "True" or value == "False"
-                                value = True if value == "True" else False
-                            elif valueType == "F":
-                                value = float(value)
-                            else:
-                                logger.error("Line %d: Unknown valueType: %s" % (i, valueType))
-                                assert False
-                            self.updateValue(key, value)
-                        elif eventType == "COMMAND":
-                            pass
-                        elif eventType == "WAIT":
-                            pass
-                        elif eventType == "C102":
-                            pass
-                        else:
-                            logger.error("Line %d: Unknown eventType: %s" % (i, eventType))
-                            assert False
-                i += 1
+        self.loadEvents(iterScenarioEvents(filename))
+
+    def loadScenario(self, scenario):
+        """
+        Load values from a parsed scenario file.
+        :param scenario: ParsedScenario (see parseScenarioFile)
+        """
+        if scenario.description is not None:
+            self.description = scenario.description
+        if scenario.name is not None:
+            self.name = scenario.name
+        for key, value in scenario.measurements:
+            self.updateValue(key, value)
+
+    def loadEvents(self, events):
+        """
+        Load values from scenario events (options and measurements, all other events are ignored).
+        :param events: Iterable of ScenarioEvent records
+        """
+        for event in events:
+            if event.eventType == "MEASUREMENT":
+                self.updateValue(event.key, event.value)
+            elif event.eventType == "OPTION":
+                if event.key == "description":
+                    self.description = event.value
+                elif event.key == "name":
+                    self.name = event.value
+
+
+class ParsedScenario():
+    def __init__(self, filename, name=None, description=None, measurements=None):
+        """
+        Initialize the in-memory form of a scenario file.
+        :param filename: Filepath of scenario file
+        :param name: Name option of scenario file (None if not set)
+        :param description: Description option of scenario file (None if not set)
+        :param measurements: List of (key, value) tuples in order of the file
+        """
+        self.filename = filename
+        self.name = name
+        self.description = description
+        self.measurements = measurements if measurements is not None else []
+
+
+def parseScenarioFile(filename):
+    """
+    Parse a scenario file once into its in-memory form (options and converted measurements).
+    :param filename: Absolute or relative filepath of scenario file (text or compiled format)
+    :return: ParsedScenario object
+    """
+    scenario = ParsedScenario(filename)
+    for event in iterScenarioEvents(filename):
+        if event.eventType == "MEASUREMENT":
+            scenario.measurements.append((event.key, event.value))
+        elif event.eventType == "OPTION":
+            if event.key == "description":
+                scenario.description = event.value
+            elif event.key == "name":
+                scenario.name = event.value
+    return scenario
+
+
+class OverlayValueStore(ValueStore):
+    def __init__(self, baseStore, name=None):
+        """
+        Initialize an overlay on top of another ValueStore.
+        :param baseStore: ValueStore (or overlay) that provides all unchanged values
+        :param name: Name of overlay (name of base ValueStore if not given)
+        """
+        ValueStore.__init__(self, name if name else baseStore.name, baseStore.description)
+        self.baseStore = baseStore
+        self.version = baseStore.version
+
+    def hasValue(self, name):
+        """
+        Check whether reference is known to the overlay or its base ValueStore.
+        :param name: Reference key
+        :return: True if value is stored for reference key
+        """
+        return self.store.has_key(name) or self.baseStore.hasValue(name)
+
+    def _retrieveEntry(self, name):
+        """
+        Return the stored entry of a value (changed entry if available, base entry otherwise).
+        :param name: Reference key (must be stored)
+        :return: Tuple (value, timestamp, valid)
+        """
+        entry = self.store.get(name)
+        if entry is not None:
+            return entry
+        return self.baseStore._retrieveEntry(name)
+
+    def _retrieveHistory(self, name):
+        """
+        Return the history entries of a value (base history followed by overlay history).
+        :param name: Reference key
+        :return: List of (value, timestamp, valid) tuples
+        """
+        entries = self.history.get(name)
+        if entries:
+            return self.baseStore._retrieveHistory(name) + entries
+        return self.baseStore._retrieveHistory(name)
+
+    def retrieveVersion(self, name):
+        """
+        Return the version of a value (version of base ValueStore if unchanged in the overlay).
+        :param name: Reference key
+        :return: Version number (0 if value was never stored)
+        """
+        if self.tagVersions.has_key(name):
+            return self.tagVersions[name]
+        return self.baseStore.retrieveVersion(name)
+
+    def getEntries(self):
+        """
+        Return the entries of all values (base entries replaced by changed entries).
+        :return: Dictionary reference key -> (value, timestamp, valid) tuple
+        """
+        entries = dict(self.baseStore.getEntries())
+        entries.update(self.store)
+        return entries
+
+    def getModifiedKeys(self):
+        """
+        Return the keys of all values that were changed in the overlay.
+        :return: Set of reference keys
+        """
+        return set(self.store.keys())
+
+    def getCopy(self, newName=None):
+        """
+        Generate an independent ValueStore containing the values of the overlay and its base.
+        :param newName: Name of new ValueStore
+        :return: New ValueStore object
+        """
+        copied = self.baseStore.getCopy(newName if newName else self.name)
+        for name, entry in self.store.iteritems():
+            copied.store[name] = entry
+        for name, entries in self.history.iteritems():
+            copied.history[name].extend(entries)
+        return copied
+
+    def __getstate__(self):
+        """
+        Forbid pickling of overlays (only the changed values would be saved), save an independent copy instead (see getCopy).
+        :raise TypeError: always
+        """
+        raise TypeError("OverlayValueStore %s can not be pickled, use getCopy()." % self.name)
 
 
 def saveValuesToFile(valueStoreObject, autosave=False):
     """
     Save the ValueStore to a file.
-    :param valueStoreObject: ValueStore that should be saved
+    :param valueStoreObject: ValueStore that should be saved (overlays are saved as independent copy)
     :param autosave: True if this is an autosave
     """
+    if isinstance(valueStoreObject, OverlayValueStore):
+        valueStoreObject = valueStoreObject.getCopy()
     if not os.path.exists(DUMP_PATH):
         os.makedirs(DUMP_PATH)
     if autosave:
@@ -0,0 +1,240 @@
+#!/usr/bin/python
+# -*- coding: utf-8 -*-
+'''
+
+Bytes-native encoder of IEC-104 APDUs (APCI + ASDU) without hex strings.
+Frames are packed directly into a preallocated bytearray with precompiled structs per type ID
+(one pack call per single-object frame), multi-object ASDUs are supported with and without SQ bit.
+The encoded bytes are identical to the hex-based encoding of the APDUType* classes.
+'''
+import datetime
+import struct
+
+APDU_START_BYTE = 0x68
+APDU_MAX_LENGTH = 255
+DEFAULT_CAUSE_OF_TRANSMISSION = 0x31
+DEFAULT_ORIGINATOR_ADDRESS = 0
+VSQ_SEQUENCE = 0x80
+NORMALIZED_SCALE = 32768
+
+# type ID -> (struct format of value or None, quality descriptor, CP56Time2a time tag)
+TYPE_ELEMENTS = {1: ("B", False, False),
+                 3: ("B", False, False),
+                 9: ("h", True, False),
+                 13: ("f", True, False),
+                 21: ("h", False, False),
+                 30: ("B", False, True),
+                 31: ("B", False, True),
+                 34: ("h", True, True),
+                 36: ("f", True, True),
+                 45: ("B", False, False),
+                 46: ("B", False, False),
+                 48: ("h", True, False),
+                 50: ("f", True, False),
+                 58: ("B", False, True),
+                 59: ("B", False, True),
+                 61: ("h", True, True),
+                 63: ("f", True, True),
+                 102: (None, False, False)}
+
+# start byte, APDU length, send sequence number, receive sequence number, type ID, VSQ, cause of transmission, originator address, common address
+APDU_HEADER_FORMAT = "<BBHHBBBBH"
+# information object address (low 16 bit, high 8 bit)
+IOA_FORMAT = "HB"
+CP56TIME2A_FORMAT = "HBBBBB"
+APDU_HEADER = struct.Struct(APDU_HEADER_FORMAT)
+IOA = struct.Struct("<" + IOA_FORMAT)
+
+
+def getElementFormat(typeId):
+    """
+    Return the struct format of an information element (value, quality descriptor, time tag) of a type ID.
+    :param typeId: Type ID (key of TYPE_ELEMENTS)
+    :return: Format without byte order character
+    """
+    valueFormat, qds, timetag = TYPE_ELEMENTS[typeId]
+    return (valueFormat or "") + ("B" if qds else "") + (CP56TIME2A_FORMAT if timetag else "")
+
+
+# type ID -> precompiled structs
+SINGLE_OBJECT_APDUS = dict([(t, struct.Struct(APDU_HEADER_FORMAT + IOA_FORMAT + getElementFormat(t))) for t in TYPE_ELEMENTS])
+INFORMATION_OBJECTS = dict([(t, struct.Struct("<" + IOA_FORMAT + getElementFormat(t))) for t in TYPE_ELEMENTS])
+INFORMATION_ELEMENTS = dict([(t, struct.Struct("<" + getElementFormat(t))) for t in TYPE_ELEMENTS])
+
+
+def datetimeToCp56time2a(dateTime):
+    """
+    Convert a datetime to the fields of a CP56Time2a time tag (same encoding as TrafficUtilities.datetime_to_cp56time2a).
+    :param dateTime: datetime object
+    :return: Tuple (milliseconds, minutes, hours, day, month, year)
+    """
+    return (dateTime.microsecond // 1000 + dateTime.second * 1000, dateTime.minute & 0b111111, dateTime.hour & 0b11111,
+            dateTime.day & 0b11111, dateTime.month & 0b1111, (dateTime.year - 2000) & 0b1111111)
+
+
+def convertElementValue(typeId, value):
+    """
+    Convert a value to the packed representation of a type ID.
+    :param typeId: Type ID (key of TYPE_ELEMENTS)
+    :param value: bool, int (double point) or float
+    :return: Value to pack
+    """
+    valueFormat = TYPE_ELEMENTS[typeId][0]
+    if valueFormat == "h":
+        return int(value * NORMALIZED_SCALE)
+    elif valueFormat == "B":
+        return int(value)
+    return value
+
+
+class APDUEncoder():
+    def __init__(self, commonAddress, causeOfTransmission=DEFAULT_CAUSE_OF_TRANSMISSION, originatorAddress=DEFAULT_ORIGINATOR_ADDRESS):
+        """
+        Initialize an encoder with a preallocated frame buffer.
+        :param commonAddress: Common address of ASDU (RTU number)
+        :param causeOfTransmission: Cause of transmission
+        :param originatorAddress: Originator address
+        """
+        self.commonAddress = commonAddress
+        self.causeOfTransmission = causeOfTransmission
+        self.originatorAddress = originatorAddress
+        self.buffer = bytearray(APDU_MAX_LENGTH)
+        self.view = memoryview(self.buffer)
+        self.lastDateTime = None
+        self.lastTimeTag = None
+
+    def getTimeTag(self, dateTime):
+        """
+        Return the CP56Time2a fields of a datetime (cached for consecutive frames with the same time).
+        :param dateTime: datetime object
+        :return: Tuple of time tag fields
+        """
+        if dateTime != self.lastDateTime:
+            self.lastDateTime = dateTime
+            self.lastTimeTag = datetimeToCp56time2a(dateTime)
+        return self.lastTimeTag
+
+    def getElement(self, typeId, value, dateTime):
+        """
+        Return the fields of an information element.
+        :param typeId: Type ID
+        :param value: Value (ignored for types without value)
+        :param dateTime: datetime of time tag (ignored for types without time tag)
+        :return: Tuple of fields
+        """
+        valueFormat, qds, timetag = TYPE_ELEMENTS[typeId]
+        element = (convertElementValue(typeId, value),) if valueFormat else ()
+        if qds:
+            element += (0,)
+        if timetag:
+            element += self.getTimeTag(dateTime)
+        return element
+
+    def encodeInto(self, buffer, offset, typeId, infoObjectAddresses, values, dateTime=None, sequence=False, tx=3, rx=1):
+        """
+        Encode an APDU into a buffer.
+        :param buffer: Writable buffer (bytearray or memoryview)
+        :param offset: Offset of APDU in buffer
+        :param typeId: Type ID (key of TYPE_ELEMENTS)
+        :param infoObjectAddresses: Information object address or list of addresses (only the first is used if sequence)
+        :param values: Value or list of values (one per information object)
+        :param dateTime: datetime of time tags (required for types with time tag)
+        :param sequence: Encode as sequence of information elements (SQ=1) with consecutive addresses
+        :param tx: Send sequence number
+        :param rx: Receive sequence number
+        :return: Length of APDU in bytes
+        """
+        if not isinstance(infoObjectAddresses, (list, tuple)):
+            infoObjectAddresses = [infoObjectAddresses]
+            values = [values]
+        count = len(values) if sequence else len(infoObjectAddresses)
+        if count == 1 and not sequence:
+            apdu = SINGLE_OBJECT_APDUS[typeId]
+            ioa = infoObjectAddresses[0]
+            apdu.pack_into(buffer, offset, APDU_START_BYTE, apdu.size - 2, tx * 2, rx * 2, typeId, 1, self.causeOfTransmission,
+                           self.originatorAddress, self.commonAddress, ioa & 0xFFFF, ioa >> 16 & 0xFF,
+                           *self.getElement(typeId, values[0], dateTime))
+            return apdu.size
+        if sequence:
+            element = INFORMATION_ELEMENTS[typeId]
+            length = APDU_HEADER.size + IOA.size + count * element.size
+        else:
+            element = INFORMATION_OBJECTS[typeId]
+            length = APDU_HEADER.size + count * element.size
+        assert count < VSQ_SEQUENCE and length <= APDU_MAX_LENGTH
+        APDU_HEADER.pack_into(buffer, offset, APDU_START_BYTE, length - 2, tx * 2, rx * 2, typeId, (VSQ_SEQUENCE if sequence else 0) | count,
+                              self.causeOfTransmission, self.originatorAddress, self.commonAddress)
+        position = offset + APDU_HEADER.size
+        if sequence:
+            IOA.pack_into(buffer, position, infoObjectAddresses[0] & 0xFFFF, infoObjectAddresses[0] >> 16 & 0xFF)
+            position += IOA.size
+            for value in values:
+                element.pack_into(buffer, position, *self.getElement(typeId, value, dateTime))
+                position += element.size
+        else:
+            for ioa, value in zip(infoObjectAddresses, values):
+                element.pack_into(buffer, position, ioa & 0xFFFF, ioa >> 16 & 0xFF, *self.getElement(typeId, value, dateTime))
+                position += element.size
+        return length
+
+    def encodeFrames(self, buffer, offset, typeId, infoObjectAddresses, values, dateTime=None, tx=3, rx=1):
+        """
+        Encode one single-object APDU per value into a buffer (time tag, struct and header fields are resolved once per batch).
+        :param buffer: Writable buffer (bytearray or memoryview)
+        :param offset: Offset of first APDU in buffer
+        :param typeId: Type ID (key of TYPE_ELEMENTS)
+        :param infoObjectAddresses: List of information object addresses (one per APDU)
+        :param values: List of values (one per APDU)
+        :param dateTime: datetime of time tags (same time tag for all APDUs)
+        :param tx: Send sequence number
+        :param rx: Receive sequence number
+        :return: Offset after the last APDU
+        """
+        apdu = SINGLE_OBJECT_APDUS[typeId]
+        packInto = apdu.pack_into
+        size = apdu.size
+        valueFormat, qds, timetag = TYPE_ELEMENTS[typeId]
+        header = (APDU_START_BYTE, size - 2, tx * 2, rx * 2, typeId, 1, self.causeOfTransmission, self.originatorAddress, self.commonAddress)
+        suffix = ((0,) if qds else ()) + (self.getTimeTag(dateTime) if timetag else ())
+        if valueFormat == "h":
+            values = [int(v * NORMALIZED_SCALE) for v in values]
+        elif valueFormat == "B":
+            values = [int(v) for v in values]
+        if valueFormat:
+            for ioa, value in zip(infoObjectAddresses, values):
+                packInto(buffer, offset, *(header + (ioa & 0xFFFF, ioa >> 16 & 0xFF, value) + suffix))
+                offset += size
+        else:
+            for ioa in infoObjectAddresses:
+                packInto(buffer, offset, *(header + (ioa & 0xFFFF, ioa >> 16 & 0xFF) + suffix))
+                offset += size
+        return offset
+
+    def encode(self, typeId, infoObjectAddresses, values, dateTime=None, sequence=False, tx=3, rx=1):
+        """
+        Encode an APDU into the frame buffer of the encoder (overwritten by the next call).
+        :param typeId: Type ID (key of TYPE_ELEMENTS)
+        :param infoObjectAddresses: Information object address or list of addresses
+        :param values: Value or list of values
+        :param dateTime: datetime of time tags
+        :param sequence: Encode as sequence of information elements (SQ=1)
+        :param tx: Send sequence number
+        :param rx: Receive sequence number
+        :return: memoryview of the APDU bytes (no copy)
+        """
+        return self.view[:self.encodeInto(self.buffer, 0, typeId, infoObjectAddresses, values, dateTime, sequence, tx, rx)]
+
+
+def encodeAPDU(typeId, commonAddress, infoObjectAddress, value=None, dateTime=datetime.datetime(2000, 01, 01, 0, 0, 0)):
+    """
+    Encode a single-object APDU as bytes.
+    :param typeId: Type ID (key of TYPE_ELEMENTS)
+    :param commonAddress: Common address of ASDU
+    :param infoObjectAddress: Information object address
+    :param value: Value (None for types without value)
+    :param dateTime: datetime of time tag
+    :return: APDU (bytes)
+    """
+    buffer = bytearray(SINGLE_OBJECT_APDUS[typeId].size)
+    APDUEncoder(commonAddress).encodeInto(buffer, 0, typeId, infoObjectAddress, value, dateTime)
+    return bytes(buffer)
@@ -7,6 +7,7 @@ import binascii
 import datetime
 import struct
 
+from APDUEncoder import encodeAPDU
 from TrafficUtilities import datetime_to_cp56time2a, structToHex
 
 
@@ -52,7 +53,7 @@ class AbstractAPDU(object):
         return tmp
 
     def toBytes(self):
-        return self.toHex().decode('hex')
+        return encodeAPDU(self.type, self.ca, self.ioa, getattr(self, "value", None), self.dateTime)
 
     def toHexSinglePointValue(self, qds, timetag):
         # Create ASDU
@@ -18,13 +18,15 @@ from APDUType36 import APDUType36
 from APDUType58 import APDUType58
 from APDUType61 import APDUType61
 from APDUType63 import APDUType63
-from GeneratePhysicalTagMap import getTagDict
+from RTUConfiguration import loadRTUConfiguration
+from ScenarioFiles import iterScenarioEvents
 from StateManagerUtilities import isZero
 from TrafficConstants import SERVER_HOST, SERVER_PORT
 
 RTU_NUMBER = 1001
 SCENARIO_PATH = "../state-manager/Scenarios/"
 RTU_CONFIGURATION_FILE = "../policy-generator/rtu-configs/%s%s_RTU_Configuration.csv"
+SEND_INTERVAL = 0.03
 
 
 def connectToServer():
@@ -39,8 +41,19 @@ def normalizeValue(value, lowerBound, upperBound):
     return v
 
 
-def sendValue(sock, rtuTags, eventType, k, v):
+def createAPDU(rtuTags, eventType, k, v, dateTime=None):
+    """
+    Create the APDU of a scenario event.
+    :param rtuTags: Tag dictionary of the RTU configuration
+    :param eventType: "MEASUREMENT", "COMMAND" or "C102"
+    :param k: Tag name
+    :param v: Value (bool or float)
+    :param dateTime: Time tag of APDU (now if not given)
+    :return: APDU object
+    """
     apdu = None
+    if dateTime is None:
+        dateTime = datetime.datetime.now()
     try:
         if eventType == "C102":
             apdu = APDUType102(RTU_NUMBER, rtuTags[k].addresses[1])
@@ -49,23 +62,23 @@ def sendValue(sock, rtuTags, eventType, k, v):
                 if not isZero(rtuTags[k].lowerBound) and not isZero(rtuTags[k].lowerBound):
                     v = normalizeValue(v, rtuTags[k].lowerBound, rtuTags[k].upperBound)
                     if eventType == "COMMAND":
-                        apdu = APDUType61(RTU_NUMBER, rtuTags[k].addresses[2], v, datetime.datetime.now())
+                        apdu = APDUType61(RTU_NUMBER, rtuTags[k].addresses[2], v, dateTime)
                     elif eventType == "MEASUREMENT":
-                        apdu = APDUType34(RTU_NUMBER, rtuTags[k].addresses[1], v, datetime.datetime.now())
+                        apdu = APDUType34(RTU_NUMBER, rtuTags[k].addresses[1], v, dateTime)
                     else:
                         assert False
                 else:
                     if eventType == "COMMAND":
-                        apdu = APDUType63(RTU_NUMBER, rtuTags[k].addresses[2], v, datetime.datetime.now())
+                        apdu = APDUType63(RTU_NUMBER, rtuTags[k].addresses[2], v, dateTime)
                     elif eventType == "MEASUREMENT":
-                        apdu = APDUType36(RTU_NUMBER, rtuTags[k].addresses[1], v, datetime.datetime.now())
+                        apdu = APDUType36(RTU_NUMBER, rtuTags[k].addresses[1], v, dateTime)
                     else:
                         assert False
             elif type(v) == bool:
                 if eventType == "COMMAND":
-                    apdu = APDUType58(RTU_NUMBER, rtuTags[k].addresses[2], v, datetime.datetime.now())
+                    apdu = APDUType58(RTU_NUMBER, rtuTags[k].addresses[2], v, dateTime)
                 elif eventType == "MEASUREMENT":
-                    apdu = APDUType30(RTU_NUMBER, rtuTags[k].addresses[1], v, datetime.datetime.now())
+                    apdu = APDUType30(RTU_NUMBER, rtuTags[k].addresses[1], v, dateTime)
                 else:
                     assert False
             else:
@@ -74,77 +87,63 @@ def sendValue(sock, rtuTags, eventType, k, v):
     except Exception, e:
         print "Exception while creating APDUs: %s" % e.message
         assert False
-
-    if apdu:
-        print "Sending '%s'" % binascii.hexlify(apdu.toBytes())
-        sock.sendall(apdu.toBytes())
-        time.sleep(0.03)
-    else:
+    if not apdu:
         print "APDU empty?"
         assert False
+    return apdu
 
 
-def processScenarioFile(sock, scenarioFilename, caseName, normalized):
+def sendValue(sock, rtuTags, eventType, k, v):
+    apdu = createAPDU(rtuTags, eventType, k, v)
+    print "Sending '%s'" % binascii.hexlify(apdu.toBytes())
+    sock.sendall(apdu.toBytes())
+    time.sleep(SEND_INTERVAL)
+
+
+def loadRtuTags(caseName, normalized):
     """
-    Generate traffic from a scenario file.
-    :param sock: Open network socket
-    :param scenarioFilename: Absolute or relative filepath of scenario file
+    Load the tag dictionary of the RTU configuration of a case (cached, must not be modified).
     :param caseName: Name of case
     :param normalized: True if normalization of values desired
+    :return: Tag dictionary
     """
-    rtuTags = None
     try:
         if normalized:
             rtuConfigFile = RTU_CONFIGURATION_FILE % (caseName, "_Normalized")
         else:
             rtuConfigFile = RTU_CONFIGURATION_FILE % (caseName, "")
-        rtuTags = getTagDict(rtuConfigFile)
+        return loadRTUConfiguration(rtuConfigFile).tagsByName
     except Exception, e:
         print "RTU configuration could not be loaded. %s" % e
         assert False
+
+
+def processScenarioFile(sock, scenarioFilename, caseName, normalized):
+    """
+    Generate traffic from a scenario file.
+    :param sock: Open network socket
+    :param scenarioFilename: Absolute or relative filepath of scenario file (text or compiled format)
+    :param caseName: Name of case
+    :param normalized: True if normalization of values desired
+    """
+    rtuTags = loadRtuTags(caseName, normalized)
     if rtuTags:
-        with open(scenarioFilename, "r") as f:
-            i = 1
-            for line in f:
-                line = line.strip()
-                if line:
-                    if not line.startswith("#"):
-                        tmp = line.split(" ")
-                        eventType = tmp[0]
-                        if eventType == "OPTION":
-                            optionType = tmp[1]
-                            if optionType == "description":
-                                pass
-                            elif optionType == "name":
-                                pass
-                        elif eventType == "MEASUREMENT" or eventType == "COMMAND":
-                            valueType = tmp[1]
-                            key = tmp[2]
-                            value = tmp[3]
-                            if valueType == "B":
-                                assert value == "True" or value == "False"
-                                value = True if value == "True" else False
-                            elif valueType == "F":
-                                value = float(value)
-                            else:
-                                print "Line %d: Unknown valueType: %s" % (i, valueType)
-                                assert False
-
-                            sendValue(sock, rtuTags, eventType, key, value)
-                            # send key,value measurement here
-                        elif eventType == "WAIT":
-                            duration = float(tmp[1])
-                            time.sleep(duration)
-                        elif eventType == "C102":
-                            key = tmp[1]
-                            sendValue(sock, rtuTags, eventType, key, 0.0)
-                        else:
-                            print "Line %d: Unknown eventType: %s" % (i, eventType)
-                            assert False
-                i += 1
+        for event in iterScenarioEvents(scenarioFilename):
+            if event.eventType == "MEASUREMENT" or event.eventType == "COMMAND":
+                sendValue(sock, rtuTags, event.eventType, event.key, event.value)
+            elif event.eventType == "WAIT":
+                time.sleep(event.value)
+            elif event.eventType == "C102":
+                sendValue(sock, rtuTags, event.eventType, event.key, 0.0)
 
 
-def generateScenarioTraffic(sock, caseName, caseNumber, normalized):
+def getScenarioFilenames(caseName, caseNumber):
+    """
+    Return the scenario files of a scenario (base case first).
+    :param caseName: Name of case
+    :param caseNumber: Scenario number of case
+    :return: List of filepaths
+    """
     scenarioFiles = []
     basicCaseFilename = "%s_%s.state" % (caseName, "BasicCase")
     scenarioFilename = "%s_%s.state" % (caseName, "Scenario%d" % caseNumber)
@@ -157,9 +156,12 @@ def generateScenarioTraffic(sock, caseName, caseNumber, normalized):
                 scenarioFiles.append(filename)
     assert basicCaseFound
     assert scenarioFilename in scenarioFiles
+    return ["%s%s" % (SCENARIO_PATH, basicCaseFilename), "%s%s" % (SCENARIO_PATH, scenarioFilename)]
+
 
-    processScenarioFile(sock, "%s%s" % (SCENARIO_PATH, basicCaseFilename), caseName, normalized)
-    processScenarioFile(sock, "%s%s" % (SCENARIO_PATH, scenarioFilename), caseName, normalized)
+def generateScenarioTraffic(sock, caseName, caseNumber, normalized):
+    for scenarioFilename in getScenarioFilenames(caseName, caseNumber):
+        processScenarioFile(sock, scenarioFilename, caseName, normalized)
 
 
 def sendData(sock, caseName, caseNumber, normalized):
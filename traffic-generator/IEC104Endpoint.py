@@ -0,0 +1,360 @@
+#!/usr/bin/python
+# -*- coding: utf-8 -*-
+'''
+
+Multi-connection IEC-104 endpoint (server and client) based on asyncore.
+Every session frames the received bytes into APDUs by the APCI length byte, answers U-frames (STARTDT, STOPDT, TESTFR),
+acknowledges received I-frames with S-frames (after w I-frames or t2 seconds) and keeps the k window of sent I-frames.
+The output buffer of a session is bounded: I-frames stay pending above its high-water mark, and a session whose peer does not read
+its S- and U-frames any more is closed.
+Statistics are printed periodically instead of every frame (frames are only printed in verbose mode).
+'''
+import asyncore
+import binascii
+import socket
+import struct
+import time
+
+from TrafficConstants import SERVER_HOST, SERVER_PORT
+
+IEC104_K = 12
+IEC104_W = 8
+IEC104_T2 = 10.0
+IEC104_SEQUENCE_MODULO = 32768
+IEC104_START_BYTE = 0x68
+STARTDT_ACT = 0x07
+STARTDT_CON = 0x0B
+STOPDT_ACT = 0x13
+STOPDT_CON = 0x23
+TESTFR_ACT = 0x43
+TESTFR_CON = 0x83
+U_FRAME_CONFIRMATIONS = {STARTDT_ACT: STARTDT_CON, STOPDT_ACT: STOPDT_CON, TESTFR_ACT: TESTFR_CON}
+ENDPOINT_BACKLOG = 128
+ENDPOINT_RECEIVE_SIZE = 65536
+ENDPOINT_LOOP_TIMEOUT = 0.1
+ENDPOINT_STATISTICS_INTERVAL = 5.0
+ENDPOINT_MAX_OUTPUT_BUFFER = 1 << 20
+ENDPOINT_MAX_PENDING_IFRAMES = 65536
+
+CONTROL_FIELDS = struct.Struct("<HH")
+
+
+def createUFrame(function):
+    """
+    Create a U-frame.
+    :param function: Function bits of first control octet (e.g. STARTDT_ACT)
+    :return: APDU (bytes)
+    """
+    return struct.pack("<BBBBBB", IEC104_START_BYTE, 4, function, 0, 0, 0)
+
+
+def createSFrame(receiveSequenceNumber):
+    """
+    Create an S-frame.
+    :param receiveSequenceNumber: Receive sequence number N(R)
+    :return: APDU (bytes)
+    """
+    return struct.pack("<BBBBH", IEC104_START_BYTE, 4, 0x01, 0, receiveSequenceNumber << 1)
+
+
+class EndpointStatistics():
+    def __init__(self):
+        """Initialize the counters of an endpoint."""
+        self.startTime = time.time()
+        self.sessions = 0
+        self.activeSessions = 0
+        self.iFrames = 0
+        self.sFrames = 0
+        self.uFrames = 0
+        self.sentIFrames = 0
+        self.sentSFrames = 0
+        self.acknowledgedIFrames = 0
+        self.receivedBytes = 0
+        self.sequenceErrors = 0
+        self.framingErrors = 0
+        self.overflows = 0
+
+    def printStatistics(self):
+        """Print the counters and the rate of received I-frames."""
+        elapsed = max(time.time() - self.startTime, 1e-9)
+        print "Sessions: %d (%d active), received I/S/U-frames: %d/%d/%d (%d I-frames/s, %d bytes), sent I/S-frames: %d/%d " \
+              "(%d I-frames acknowledged), sequence errors: %d, framing errors: %d, overflows: %d" % (
+                  self.sessions, self.activeSessions, self.iFrames, self.sFrames, self.uFrames, self.iFrames / elapsed, self.receivedBytes,
+                  self.sentIFrames, self.sentSFrames, self.acknowledgedIFrames, self.sequenceErrors, self.framingErrors, self.overflows)
+
+
+class IEC104Session(asyncore.dispatcher):
+    def __init__(self, sock=None, socketMap=None, statistics=None, verbose=False, onAPDU=None):
+        """
+        Initialize an IEC-104 session.
+        :param sock: Connected socket (None for clients that connect later)
+        :param socketMap: asyncore socket map of the endpoint
+        :param statistics: EndpointStatistics object of the endpoint
+        :param verbose: Print every received frame
+        :param onAPDU: Function called with (session, APDU bytes) for every received I-frame
+        """
+        asyncore.dispatcher.__init__(self, sock, socketMap)
+        self.statistics = statistics if statistics else EndpointStatistics()
+        self.verbose = verbose
+        self.onAPDU = onAPDU
+        self.inBuffer = bytearray()
+        self.outBuffer = bytearray()
+        self.pendingIFrames = []
+        self.sendSequenceNumber = 0
+        self.receiveSequenceNumber = 0
+        self.unacknowledgedSent = 0
+        self.unacknowledgedReceived = 0
+        self.lastReceivedTime = time.time()
+        self.started = False
+        self.active = True
+        self.statistics.sessions += 1
+        self.statistics.activeSessions += 1
+
+    def handle_read(self):
+        """Receive data and process all complete APDUs."""
+        data = self.recv(ENDPOINT_RECEIVE_SIZE)
+        if not data:
+            return
+        self.statistics.receivedBytes += len(data)
+        self.inBuffer.extend(data)
+        position = 0
+        length = len(self.inBuffer)
+        while length - position >= 2:
+            if self.inBuffer[position] != IEC104_START_BYTE:
+                # Resynchronize at the next start byte
+                self.statistics.framingErrors += 1
+                nextStart = self.inBuffer.find(chr(IEC104_START_BYTE), position + 1)
+                position = nextStart if nextStart >= 0 else length
+                continue
+            end = position + self.inBuffer[position + 1] + 2
+            if end > length:
+                break
+            self.processFrame(bytes(self.inBuffer[position:end]))
+            position = end
+        del self.inBuffer[:position]
+
+    def processFrame(self, frame):
+        """
+        Process a received APDU.
+        :param frame: APDU (bytes)
+        """
+        self.lastReceivedTime = time.time()
+        if self.verbose:
+            print "Recieved: '%s'" % binascii.hexlify(frame)
+        if len(frame) < 6:
+            self.statistics.framingErrors += 1
+            return
+        control = ord(frame[2])
+        if control & 0x01 == 0:
+            self.statistics.iFrames += 1
+            sendSequenceNumber, receiveSequenceNumber = CONTROL_FIELDS.unpack_from(frame, 2)
+            if sendSequenceNumber >> 1 != self.receiveSequenceNumber:
+                self.statistics.sequenceErrors += 1
+            self.receiveSequenceNumber = ((sendSequenceNumber >> 1) + 1) % IEC104_SEQUENCE_MODULO
+            self.acknowledgeSent(receiveSequenceNumber >> 1)
+            self.unacknowledgedReceived += 1
+            if self.unacknowledgedReceived >= IEC104_W:
+                self.sendSFrame()
+            if self.onAPDU:
+                self.onAPDU(self, frame)
+        elif control & 0x03 == 0x01:
+            self.statistics.sFrames += 1
+            self.acknowledgeSent(CONTROL_FIELDS.unpack_from(frame, 2)[1] >> 1)
+        else:
+            self.statistics.uFrames += 1
+            if control in U_FRAME_CONFIRMATIONS:
+                self.queueFrame(createUFrame(U_FRAME_CONFIRMATIONS[control]))
+                if control == STARTDT_ACT:
+                    self.started = True
+                elif control == STOPDT_ACT:
+                    self.started = False
+            elif control == STARTDT_CON:
+                self.started = True
+                self.flushPending()
+
+    def acknowledgeSent(self, receiveSequenceNumber):
+        """
+        Process an acknowledgement of sent I-frames and send pending I-frames within the k window.
+        :param receiveSequenceNumber: N(R) of the peer (next expected send sequence number)
+        """
+        unacknowledged = (self.sendSequenceNumber - receiveSequenceNumber) % IEC104_SEQUENCE_MODULO
+        if unacknowledged <= self.unacknowledgedSent:
+            self.statistics.acknowledgedIFrames += self.unacknowledgedSent - unacknowledged
+            self.unacknowledgedSent = unacknowledged
+        else:
+            # N(R) outside of the window of sent I-frames
+            self.statistics.sequenceErrors += 1
+        self.flushPending()
+
+    def queueFrame(self, frame):
+        """
+        Queue an S- or U-frame, the session is closed if the peer does not read (output buffer above ENDPOINT_MAX_OUTPUT_BUFFER).
+        :param frame: APDU (bytes)
+        """
+        if not self.active:
+            return
+        if len(self.outBuffer) >= ENDPOINT_MAX_OUTPUT_BUFFER:
+            self.statistics.overflows += 1
+            self.handle_close()
+            return
+        self.outBuffer.extend(frame)
+
+    def sendSFrame(self):
+        """Acknowledge all received I-frames."""
+        self.queueFrame(createSFrame(self.receiveSequenceNumber))
+        self.unacknowledgedReceived = 0
+        self.statistics.sentSFrames += 1
+
+    def sendAPDU(self, apdu):
+        """
+        Send an I-frame (queued while the k window is full or data transfer is not started), the sequence numbers are set by the session.
+        :param apdu: I-frame APDU (bytes)
+        :return: True if queued, False if ENDPOINT_MAX_PENDING_IFRAMES I-frames are pending already
+        """
+        if len(self.pendingIFrames) >= ENDPOINT_MAX_PENDING_IFRAMES:
+            self.statistics.overflows += 1
+            return False
+        self.pendingIFrames.append(apdu)
+        self.flushPending()
+        return True
+
+    def flushPending(self):
+        """Move pending I-frames to the output buffer as long as the k window and the output buffer allow."""
+        sent = 0
+        while sent < len(self.pendingIFrames) and self.started and self.unacknowledgedSent < IEC104_K and \
+                len(self.outBuffer) < ENDPOINT_MAX_OUTPUT_BUFFER:
+            frame = bytearray(self.pendingIFrames[sent])
+            CONTROL_FIELDS.pack_into(frame, 2, self.sendSequenceNumber << 1, self.receiveSequenceNumber << 1)
+            self.outBuffer.extend(frame)
+            self.sendSequenceNumber = (self.sendSequenceNumber + 1) % IEC104_SEQUENCE_MODULO
+            self.unacknowledgedSent += 1
+            # The I-frame acknowledges all received I-frames
+            self.unacknowledgedReceived = 0
+            self.statistics.sentIFrames += 1
+            sent += 1
+        if sent:
+            del self.pendingIFrames[:sent]
+
+    def checkTimers(self, now):
+        """
+        Acknowledge received I-frames after t2 seconds without acknowledgement.
+        :param now: Current time
+        """
+        if self.unacknowledgedReceived and now - self.lastReceivedTime >= IEC104_T2:
+            self.sendSFrame()
+
+    def hasPending(self):
+        """
+        Check whether I-frames wait for sending or acknowledgement.
+        :return: True if pending or unacknowledged I-frames exist
+        """
+        return bool(self.pendingIFrames or self.outBuffer or self.unacknowledgedSent)
+
+    def writable(self):
+        return bool(self.outBuffer) or not self.connected
+
+    def handle_write(self):
+        sent = self.send(self.outBuffer)
+        del self.outBuffer[:sent]
+        if self.pendingIFrames:
+            self.flushPending()
+
+    def handle_close(self):
+        if self.active:
+            self.active = False
+            self.statistics.activeSessions -= 1
+        self.close()
+
+
+class IEC104Client(IEC104Session):
+    def __init__(self, host=SERVER_HOST, port=SERVER_PORT, socketMap=None, statistics=None, verbose=False, onAPDU=None):
+        """
+        Connect to an IEC-104 endpoint and start the data transfer (STARTDT).
+        :param host: Host of endpoint
+        :param port: Port of endpoint
+        :param socketMap: asyncore socket map (own map if not given)
+        :param statistics: EndpointStatistics object
+        :param verbose: Print every received frame
+        :param onAPDU: Function called with (session, APDU bytes) for every received I-frame
+        """
+        self.socketMap = socketMap if socketMap is not None else dict()
+        IEC104Session.__init__(self, None, self.socketMap, statistics, verbose, onAPDU)
+        self.create_socket(socket.AF_INET, socket.SOCK_STREAM)
+        self.connect((host, port))
+        self.outBuffer.extend(createUFrame(STARTDT_ACT))
+
+    def handle_connect(self):
+        pass
+
+    def runUntilSent(self, timeout=None):
+        """
+        Run the socket map until all I-frames are sent and acknowledged.
+        :param timeout: Maximum time in seconds (no limit if not given)
+        :return: True if all I-frames were acknowledged
+        """
+        startTime = time.time()
+        while self.hasPending() and self.socketMap:
+            if timeout is not None and time.time() - startTime > timeout:
+                return False
+            asyncore.loop(timeout=ENDPOINT_LOOP_TIMEOUT, count=1, map=self.socketMap)
+        return not self.hasPending()
+
+
+class IEC104Server(asyncore.dispatcher):
+    def __init__(self, host=SERVER_HOST, port=SERVER_PORT, verbose=False, printStatistics=True, onAPDU=None):
+        """
+        Listen for IEC-104 sessions.
+        :param host: Host to bind
+        :param port: Port to bind (0 for any free port)
+        :param verbose: Print every received frame
+        :param printStatistics: Print statistics every ENDPOINT_STATISTICS_INTERVAL seconds
+        :param onAPDU: Function called with (session, APDU bytes) for every received I-frame
+        """
+        self.socketMap = dict()
+        asyncore.dispatcher.__init__(self, map=self.socketMap)
+        self.statistics = EndpointStatistics()
+        self.verbose = verbose
+        self.printStatistics = printStatistics
+        self.onAPDU = onAPDU
+        self.sessions = []
+        self.create_socket(socket.AF_INET, socket.SOCK_STREAM)
+        self.set_reuse_addr()
+        self.bind((host, port))
+        self.listen(ENDPOINT_BACKLOG)
+        self.address = self.socket.getsockname()
+
+    def handle_accept(self):
+        connection = self.accept()
+        if connection:
+            self.sessions.append(IEC104Session(connection[0], self.socketMap, self.statistics, self.verbose, self.onAPDU))
+
+    def serveForever(self, duration=None, runOnlyOnce=False):
+        """
+        Serve sessions until SIGINT / CTRL + C.
+        :param duration: Stop after duration in seconds (no limit if not given)
+        :param runOnlyOnce: Stop after the first session is closed
+        """
+        startTime = time.time()
+        statisticsTime = startTime
+        try:
+            while True:
+                asyncore.loop(timeout=ENDPOINT_LOOP_TIMEOUT, count=1, map=self.socketMap)
+                now = time.time()
+                for session in self.sessions:
+                    session.checkTimers(now)
+                self.sessions = [s for s in self.sessions if s.connected]
+                if self.printStatistics and now - statisticsTime >= ENDPOINT_STATISTICS_INTERVAL:
+                    self.statistics.printStatistics()
+                    statisticsTime = now
+                if duration is not None and now - startTime >= duration:
+                    break
+                if runOnlyOnce and self.statistics.sessions and not self.statistics.activeSessions:
+                    break
+        except KeyboardInterrupt:
+            pass
+        if self.printStatistics:
+            self.statistics.printStatistics()
+
+    def closeAll(self):
+        """Close all sessions and the listening socket."""
+        asyncore.close_all(map=self.socketMap)
@@ -0,0 +1,341 @@
+#!/usr/bin/python
+# -*- coding: utf-8 -*-
+'''
+
+This load generator emits IEC-104 traffic at a target APDU rate to find the throughput ceiling of Bro and the state manager.
+All measured tags of an RTU configuration are reported in sweeps (one APDU per tag). The values start at the base case of the scenario case
+and follow a random walk of a global load factor (currents), voltage factor (voltages) and both (powers),
+so Kirchhoff's laws, power balance and transformer ratios of the base case stay consistent. Occasionally a set point command is added.
+The traffic is sent live over several IEC-104 sessions (IEC104Client, with STARTDT, sequence numbers and the k window) and processes
+with absolute pacing, or written as pcapng with virtual timestamps. The live rate is the rate of I-frames acknowledged by the endpoint.
+Usage: python LoadGeneration.py <case name> <APDUs per second> <duration in seconds> [connections] [processes] [pcapng file]
+'''
+import asyncore
+import datetime
+import os
+import random
+import sys
+import time
+from multiprocessing import Pool
+
+from APDUEncoder import APDUEncoder, SINGLE_OBJECT_APDUS
+from GenerateScenarioTrafficExtended import loadRtuTags, SCENARIO_PATH
+from IEC104Endpoint import IEC104Client, EndpointStatistics, IEC104_W
+from PcapngWriter import PcapngWriter, TcpSession
+from ScenarioFiles import iterScenarioEvents
+from StateManagerUtilities import isZero
+from TrafficConstants import SERVER_HOST, SERVER_PORT
+
+LOAD_BATCH_DURATION = 0.01
+LOAD_REPORT_INTERVAL = 1.0
+LOAD_FACTOR_INTERVAL = (0.5, 1.0)
+LOAD_FACTOR_STEP = 0.01
+VOLTAGE_FACTOR_INTERVAL = (0.97, 1.0)
+VOLTAGE_FACTOR_STEP = 0.001
+COMMAND_PROBABILITY = 0.01
+# description of tag -> exponents of (load factor, voltage factor)
+SCALED_DESCRIPTIONS = {"Measured Current": (1, 0),
+                       "Measured Voltage": (0, 1),
+                       "Generated Power": (1, 1),
+                       "Consumed Power": (1, 1)}
+COMMAND_DESCRIPTIONS = ["Set Point Current", "Set Point Voltage"]
+LOAD_CLIENT_ADDRESS = "127.0.0.1"
+LOAD_CLIENT_PORT = 40000
+LOAD_MAX_SEGMENT_SIZE = 1460
+LOAD_MAX_PENDING_APDUS = 4096
+LOAD_DRAIN_TIMEOUT = 10.0
+
+
+def reflectRandomWalk(randomGenerator, value, step, interval):
+    """
+    Advance a random walk that is reflected at the bounds of an interval.
+    :param randomGenerator: random.Random object
+    :param value: Current value
+    :param step: Standard deviation of a step
+    :param interval: (lower bound, upper bound) tuple
+    :return: New value
+    """
+    lowerBound, upperBound = interval
+    value += randomGenerator.gauss(0.0, step)
+    if value < lowerBound:
+        value = 2 * lowerBound - value
+    if value > upperBound:
+        value = 2 * upperBound - value
+    return min(max(value, lowerBound), upperBound)
+
+
+class LoadGenerator():
+    def __init__(self, caseName, normalized=True, seed=None):
+        """
+        Initialize the values of all tags of a case from its base case.
+        :param caseName: Scenario case (RTU configuration and base case)
+        :param normalized: normalized (True) or float (False) values
+        :param seed: Seed of the random walk
+        """
+        self.random = random.Random(seed)
+        self.loadFactor = LOAD_FACTOR_INTERVAL[1]
+        self.voltageFactor = VOLTAGE_FACTOR_INTERVAL[1]
+        self.sweepCount = 0
+        self.segments = dict()
+        self.commands = []
+        self.encoders = dict()
+        rtuTags = loadRtuTags(caseName, normalized)
+        baseValues = dict()
+        for event in iterScenarioEvents("%s%s_BasicCase.state" % (SCENARIO_PATH, caseName)):
+            if event.eventType == "MEASUREMENT":
+                baseValues[event.key] = event.value
+        for tagName, value in sorted(baseValues.iteritems()):
+            tag = rtuTags[tagName]
+            commonAddress = int(tag.rtuNumber)
+            if commonAddress not in self.encoders:
+                self.encoders[commonAddress] = APDUEncoder(commonAddress)
+            if type(value) == bool:
+                self.addTag(commonAddress, 30, tag.addresses[1], float(value), (0, 0), None)
+            else:
+                scaling = SCALED_DESCRIPTIONS.get(tag.description, (0, 0))
+                bounds = (tag.lowerBound, tag.upperBound) if not isZero(tag.lowerBound) else None
+                self.addTag(commonAddress, 34 if bounds else 36, tag.addresses[1], value, scaling, bounds)
+                if tag.description in COMMAND_DESCRIPTIONS:
+                    self.commands.append((commonAddress, 61 if bounds else 63, tag.addresses[2], self.getCoefficients(value, bounds)))
+        self.tagCount = sum([len(ioas) for ioas, slopes, offsets in self.segments.values()])
+
+    def getCoefficients(self, value, bounds):
+        """
+        Return the coefficients of the transmitted value of a tag (transmitted value = slope * scale + offset).
+        :param value: Base case value
+        :param bounds: (lower bound, upper bound) of normalization interval or None if not normalized
+        :return: (slope, offset) tuple
+        """
+        if bounds is None:
+            return value, 0.0
+        lowerBound, upperBound = bounds
+        return value * 2.0 / (upperBound - lowerBound), -2.0 * lowerBound / (upperBound - lowerBound) - 1.0
+
+    def addTag(self, commonAddress, typeId, infoObjectAddress, value, scaling, bounds):
+        """
+        Add a measured tag to the segment of its common address, type ID and scaling.
+        :param commonAddress: Common address of RTU
+        :param typeId: Type ID of measurement APDU
+        :param infoObjectAddress: Information object address of measurement
+        :param value: Base case value
+        :param scaling: Exponents of (load factor, voltage factor)
+        :param bounds: (lower bound, upper bound) of normalization interval or None if not normalized
+        """
+        ioas, slopes, offsets = self.segments.setdefault((commonAddress, typeId, scaling), ([], [], []))
+        slope, offset = self.getCoefficients(value, bounds)
+        ioas.append(infoObjectAddress)
+        slopes.append(slope)
+        offsets.append(offset)
+
+    def step(self):
+        """Advance the random walk of the load and voltage factor."""
+        self.loadFactor = reflectRandomWalk(self.random, self.loadFactor, LOAD_FACTOR_STEP, LOAD_FACTOR_INTERVAL)
+        self.voltageFactor = reflectRandomWalk(self.random, self.voltageFactor, VOLTAGE_FACTOR_STEP, VOLTAGE_FACTOR_INTERVAL)
+
+    def encodeSweep(self, buffer, offset, dateTime):
+        """
+        Advance the random walk and encode one APDU per tag (and occasionally a set point command) into a buffer.
+        :param buffer: Writable buffer (at least getMaxSweepLength bytes after offset)
+        :param offset: Offset of first APDU
+        :param dateTime: datetime of time tags
+        :return: (offset after last APDU, number of APDUs) tuple
+        """
+        self.step()
+        self.sweepCount += 1
+        count = self.tagCount
+        for (commonAddress, typeId, (loadExponent, voltageExponent)), (ioas, slopes, offsets) in self.segments.iteritems():
+            scale = self.loadFactor ** loadExponent * self.voltageFactor ** voltageExponent
+            if typeId == 30:
+                values = [s > 0.5 for s in slopes]
+            else:
+                values = [s * scale + o for s, o in zip(slopes, offsets)]
+            offset = self.encoders[commonAddress].encodeFrames(buffer, offset, typeId, ioas, values, dateTime)
+        if self.commands and self.random.random() < COMMAND_PROBABILITY:
+            commonAddress, typeId, ioa, (slope, constant) = self.random.choice(self.commands)
+            offset += self.encoders[commonAddress].encodeInto(buffer, offset, typeId, ioa, slope + constant, dateTime)
+            count += 1
+        return offset, count
+
+    def getMaxSweepLength(self):
+        """
+        Return the maximum length of an encoded sweep in bytes.
+        :return: Length in bytes
+        """
+        return (self.tagCount + 1) * max([s.size for s in SINGLE_OBJECT_APDUS.values()])
+
+
+def splitSegments(data, maxSegmentSize=LOAD_MAX_SEGMENT_SIZE):
+    """
+    Split encoded APDUs into TCP payloads at APDU boundaries.
+    :param data: Encoded APDUs (bytes)
+    :param maxSegmentSize: Maximum payload size
+    :return: List of payloads
+    """
+    segments = []
+    start = 0
+    position = 0
+    while position < len(data):
+        apduLength = ord(data[position + 1]) + 2
+        if position + apduLength - start > maxSegmentSize:
+            segments.append(data[start:position])
+            start = position
+        position += apduLength
+    if start < len(data):
+        segments.append(data[start:])
+    return segments
+
+
+def splitAPDUs(buffer, length):
+    """
+    Split encoded APDUs at the APCI length bytes.
+    :param buffer: Buffer with encoded APDUs
+    :param length: Length of encoded APDUs in buffer
+    :return: List of APDUs (bytes)
+    """
+    apdus = []
+    position = 0
+    while position < length:
+        end = position + buffer[position + 1] + 2
+        apdus.append(bytes(buffer[position:end]))
+        position = end
+    return apdus
+
+
+def runLive(task):
+    """
+    Send load traffic over IEC-104 sessions with absolute pacing (one process).
+    Sweeps are only queued while a session has less than LOAD_MAX_PENDING_APDUS pending I-frames, otherwise the lag grows.
+    :param task: (case name, normalized, APDUs per second, duration, connections, host, port, seed) tuple
+    :return: Dictionary with statistics (apdus, sent, acknowledged, sequenceErrors, elapsed, maxLag)
+    """
+    caseName, normalized, rate, duration, connections, host, port, seed = task
+    generator = LoadGenerator(caseName, normalized, seed)
+    socketMap = dict()
+    statistics = EndpointStatistics()
+    sessions = [IEC104Client(host, port, socketMap, statistics) for i in range(connections)]
+    buffer = bytearray(generator.getMaxSweepLength())
+    apdus = 0
+    maxLag = 0.0
+    startTime = time.time()
+    reportTime = startTime
+    reportAcknowledged = 0
+    try:
+        while True:
+            now = time.time()
+            if now - startTime >= duration:
+                break
+            if now - reportTime >= LOAD_REPORT_INTERVAL:
+                print "[%d] %d APDUs/s acknowledged (target %d), lag %.3fs" % (os.getpid(), (statistics.acknowledgedIFrames - reportAcknowledged) /
+                                                                               (now - reportTime), rate, max(0.0, now - startTime - apdus / float(rate)))
+                reportTime = now
+                reportAcknowledged = statistics.acknowledgedIFrames
+            # APDUs of the next sweep are due at their scheduled time (start time + number of APDUs / rate)
+            scheduledTime = startTime + apdus / float(rate)
+            session = sessions[generator.sweepCount % connections]
+            if scheduledTime > now:
+                asyncore.loop(timeout=min(scheduledTime - now, LOAD_BATCH_DURATION), count=1, map=socketMap)
+                continue
+            if len(session.pendingIFrames) >= LOAD_MAX_PENDING_APDUS or not session.connected:
+                asyncore.loop(timeout=LOAD_BATCH_DURATION, count=1, map=socketMap)
+                continue
+            maxLag = max(maxLag, now - scheduledTime)
+            length, count = generator.encodeSweep(buffer, 0, datetime.datetime.fromtimestamp(now))
+            for apdu in splitAPDUs(buffer, length):
+                session.sendAPDU(apdu)
+            apdus += count
+            asyncore.loop(timeout=0.0, count=1, map=socketMap)
+        # Wait for the acknowledgements of the sent I-frames (less than w I-frames are only acknowledged after t2 of the endpoint)
+        drainTime = time.time()
+        while time.time() - drainTime < LOAD_DRAIN_TIMEOUT and [s for s in sessions if s.connected and (s.pendingIFrames or s.outBuffer or
+                                                                                                     s.unacknowledgedSent >= IEC104_W)]:
+            asyncore.loop(timeout=LOAD_BATCH_DURATION, count=1, map=socketMap)
+    finally:
+        asyncore.close_all(map=socketMap)
+    return {"apdus": apdus, "sent": statistics.sentIFrames, "acknowledged": statistics.acknowledgedIFrames,
+            "sequenceErrors": statistics.sequenceErrors, "elapsed": time.time() - startTime, "maxLag": maxLag}
+
+
+def runLoad(caseName, rate, duration, connections=1, processes=1, normalized=True, host=SERVER_HOST, port=SERVER_PORT):
+    """
+    Send load traffic live, the rate and connections are divided among worker processes.
+    :param caseName: Scenario case
+    :param rate: Target rate in APDUs per second
+    :param duration: Duration in seconds
+    :param connections: Number of TCP connections (at least one per process)
+    :param processes: Number of worker processes
+    :param normalized: normalized (True) or float (False) values
+    :param host: Host of IEC-104 endpoint
+    :param port: Port of IEC-104 endpoint
+    :return: Dictionary with statistics (apdus, sent, acknowledged, sequenceErrors, elapsed, rate, maxLag)
+    """
+    processes = min(processes, connections)
+    tasks = [(caseName, normalized, rate / float(processes), duration, len(range(i, connections, processes)), host, port, i) for i in range(processes)]
+    if processes == 1:
+        results = [runLive(tasks[0])]
+    else:
+        pool = Pool(processes)
+        try:
+            results = pool.map(runLive, tasks)
+        finally:
+            pool.close()
+            pool.join()
+    statistics = dict([(key, sum([r[key] for r in results])) for key in ["apdus", "sent", "acknowledged", "sequenceErrors"]])
+    statistics["elapsed"] = max([r["elapsed"] for r in results])
+    statistics["maxLag"] = max([r["maxLag"] for r in results])
+    statistics["rate"] = statistics["acknowledged"] / statistics["elapsed"]
+    print "Generated %d APDUs, sent %d, acknowledged %d in %.2fs: %d APDUs/s (target %d), max lag %.3fs, sequence errors %d" % (
+        statistics["apdus"], statistics["sent"], statistics["acknowledged"], statistics["elapsed"], statistics["rate"], rate, statistics["maxLag"],
+        statistics["sequenceErrors"])
+    return statistics
+
+
+def writeLoadCapture(filename, caseName, rate, duration, connections=1, normalized=True, startTime=None):
+    """
+    Write load traffic as pcapng with virtual timestamps (APDU k is sent at start time + k / rate).
+    :param filename: Path to capture
+    :param caseName: Scenario case
+    :param rate: Rate in APDUs per second
+    :param duration: Duration in seconds
+    :param connections: Number of TCP connections
+    :param normalized: normalized (True) or float (False) values
+    :param startTime: Virtual time of first packet (seconds since epoch, now if not given)
+    :return: Dictionary with statistics (apdus, bytes, packets)
+    """
+    startTime = startTime if startTime is not None else time.time()
+    generator = LoadGenerator(caseName, normalized, seed=0)
+    buffer = bytearray(generator.getMaxSweepLength())
+    writer = PcapngWriter(filename)
+    apdus = 0
+    sentBytes = 0
+    try:
+        sessions = [TcpSession(writer, (LOAD_CLIENT_ADDRESS, LOAD_CLIENT_PORT + i), (LOAD_CLIENT_ADDRESS, SERVER_PORT)) for i in range(connections)]
+        for session in sessions:
+            session.open(startTime)
+        virtualTime = startTime
+        while apdus < rate * duration:
+            virtualTime = startTime + apdus / float(rate)
+            length, count = generator.encodeSweep(buffer, 0, datetime.datetime.fromtimestamp(virtualTime))
+            session = sessions[generator.sweepCount % connections]
+            for payload in splitSegments(bytes(buffer[:length])):
+                session.send(virtualTime, payload)
+            apdus += count
+            sentBytes += length
+        for session in sessions:
+            session.close(virtualTime)
+    finally:
+        writer.close()
+    return {"apdus": apdus, "bytes": sentBytes, "packets": writer.packetCount}
+
+
+if __name__ == '__main__':
+    if len(sys.argv) < 4:
+        print __doc__
+        sys.exit(1)
+    arguments = sys.argv[1:]
+    connectionCount = int(arguments[3]) if len(arguments) > 3 else 1
+    if len(arguments) > 5:
+        start = time.time()
+        result = writeLoadCapture(arguments[5], arguments[0], int(arguments[1]), float(arguments[2]), connectionCount)
+        print "Wrote %d APDUs in %d packets to %s in %.2fs" % (result["apdus"], result["packets"], arguments[5], time.time() - start)
+    else:
+        runLoad(arguments[0], int(arguments[1]), float(arguments[2]), connectionCount, int(arguments[4]) if len(arguments) > 4 else 1)
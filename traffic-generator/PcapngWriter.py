@@ -0,0 +1,183 @@
+#!/usr/bin/python
+# -*- coding: utf-8 -*-
+'''
+
+Writer of pcapng capture files with synthetic Ethernet/IPv4/TCP framing.
+A TcpSession emulates the packets of a TCP connection (handshake, data segments with acknowledgements, teardown)
+with correct sequence numbers and checksums, so captures can be created without a network interface, tcpdump or root privileges.
+'''
+import socket
+import struct
+
+PCAPNG_SECTION_HEADER_BLOCK = 0x0A0D0D0A
+PCAPNG_INTERFACE_DESCRIPTION_BLOCK = 0x00000001
+PCAPNG_ENHANCED_PACKET_BLOCK = 0x00000006
+PCAPNG_BYTE_ORDER_MAGIC = 0x1A2B3C4D
+PCAPNG_VERSION = (1, 0)
+PCAPNG_LINKTYPE_ETHERNET = 1
+PCAPNG_SNAPLEN = 262144
+ETHERTYPE_IPV4 = 0x0800
+ETHERNET_ADDRESS = "\x00" * 6
+IP_PROTOCOL_TCP = 6
+IP_TTL = 64
+IP_DONT_FRAGMENT = 0x4000
+TCP_WINDOW = 43690
+TCP_FIN = 0x01
+TCP_SYN = 0x02
+TCP_PSH = 0x08
+TCP_ACK = 0x10
+
+ETHERNET_HEADER = struct.Struct("!6s6sH")
+IPV4_HEADER = struct.Struct("!BBHHHBBH4s4s")
+TCP_HEADER = struct.Struct("!HHIIBBHHH")
+TCP_PSEUDO_HEADER = struct.Struct("!4s4sBBH")
+
+
+def internetChecksum(data):
+    """
+    Calculate the internet checksum (RFC 1071) of IPv4 and TCP headers.
+    :param data: Bytes (string)
+    :return: Checksum
+    """
+    if len(data) % 2:
+        data += "\x00"
+    total = sum(struct.unpack("!%dH" % (len(data) / 2), data))
+    while total >> 16:
+        total = (total & 0xFFFF) + (total >> 16)
+    return ~total & 0xFFFF
+
+
+def createTcpFrame(source, destination, sequenceNumber, acknowledgementNumber, flags, payload="", ipIdentification=0):
+    """
+    Create an Ethernet frame with an IPv4/TCP packet (loopback addresses, no TCP options).
+    :param source: (IPv4 address, port) tuple of sender
+    :param destination: (IPv4 address, port) tuple of receiver
+    :param sequenceNumber: TCP sequence number
+    :param acknowledgementNumber: TCP acknowledgement number
+    :param flags: TCP flags (e.g. TCP_PSH | TCP_ACK)
+    :param payload: TCP payload (bytes)
+    :param ipIdentification: IPv4 identification
+    :return: Frame (bytes)
+    """
+    sourceAddress = socket.inet_aton(source[0])
+    destinationAddress = socket.inet_aton(destination[0])
+    tcpLength = TCP_HEADER.size + len(payload)
+    tcpHeader = TCP_HEADER.pack(source[1], destination[1], sequenceNumber, acknowledgementNumber, (TCP_HEADER.size / 4) << 4, flags,
+                                TCP_WINDOW, 0, 0)
+    pseudoHeader = TCP_PSEUDO_HEADER.pack(sourceAddress, destinationAddress, 0, IP_PROTOCOL_TCP, tcpLength)
+    tcpChecksum = internetChecksum(pseudoHeader + tcpHeader + payload)
+    tcpHeader = tcpHeader[:16] + struct.pack("!H", tcpChecksum) + tcpHeader[18:]
+    ipHeader = IPV4_HEADER.pack(0x45, 0, IPV4_HEADER.size + tcpLength, ipIdentification & 0xFFFF, IP_DONT_FRAGMENT, IP_TTL, IP_PROTOCOL_TCP,
+                                0, sourceAddress, destinationAddress)
+    ipHeader = ipHeader[:10] + struct.pack("!H", internetChecksum(ipHeader)) + ipHeader[12:]
+    return ETHERNET_HEADER.pack(ETHERNET_ADDRESS, ETHERNET_ADDRESS, ETHERTYPE_IPV4) + ipHeader + tcpHeader + payload
+
+
+class PcapngWriter():
+    def __init__(self, filename):
+        """
+        Create a pcapng file with a section header and one Ethernet interface (microsecond timestamps).
+        :param filename: Path to capture file
+        """
+        self.filename = filename
+        self.packetCount = 0
+        self.file = open(filename, "wb")
+        majorVersion, minorVersion = PCAPNG_VERSION
+        # section length -1: not specified
+        self.writeBlock(PCAPNG_SECTION_HEADER_BLOCK, struct.pack("<IHHq", PCAPNG_BYTE_ORDER_MAGIC, majorVersion, minorVersion, -1))
+        self.writeBlock(PCAPNG_INTERFACE_DESCRIPTION_BLOCK, struct.pack("<HHI", PCAPNG_LINKTYPE_ETHERNET, 0, PCAPNG_SNAPLEN))
+
+    def writeBlock(self, blockType, body):
+        """
+        Write a pcapng block (body is padded to 32 bit).
+        :param blockType: Block type
+        :param body: Block body (bytes)
+        """
+        body += "\x00" * (-len(body) % 4)
+        blockLength = len(body) + 12
+        self.file.write(struct.pack("<II", blockType, blockLength) + body + struct.pack("<I", blockLength))
+
+    def writePacket(self, timestamp, frame):
+        """
+        Write a frame as enhanced packet block.
+        :param timestamp: Capture time (seconds since epoch)
+        :param frame: Ethernet frame (bytes)
+        """
+        microseconds = int(round(timestamp * 1000000))
+        self.writeBlock(PCAPNG_ENHANCED_PACKET_BLOCK, struct.pack("<IIIII", 0, microseconds >> 32, microseconds & 0xFFFFFFFF, len(frame), len(frame)) + frame)
+        self.packetCount += 1
+
+    def close(self):
+        """Close the capture file."""
+        self.file.close()
+
+
+class TcpSession():
+    def __init__(self, writer, client, server, clientSequenceNumber=1000, serverSequenceNumber=5000):
+        """
+        Initialize an emulated TCP connection whose packets are written to a capture.
+        :param writer: PcapngWriter object
+        :param client: (IPv4 address, port) tuple of client
+        :param server: (IPv4 address, port) tuple of server
+        :param clientSequenceNumber: Initial sequence number of client
+        :param serverSequenceNumber: Initial sequence number of server
+        """
+        self.writer = writer
+        self.client = client
+        self.server = server
+        self.clientSequenceNumber = clientSequenceNumber
+        self.serverSequenceNumber = serverSequenceNumber
+        self.clientIpIdentification = clientSequenceNumber & 0xFFFF
+        self.serverIpIdentification = serverSequenceNumber & 0xFFFF
+
+    def writeClientPacket(self, timestamp, flags, payload=""):
+        """
+        Write a packet of the client and advance its sequence number.
+        :param timestamp: Capture time (seconds since epoch)
+        :param flags: TCP flags
+        :param payload: TCP payload (bytes)
+        """
+        self.writer.writePacket(timestamp, createTcpFrame(self.client, self.server, self.clientSequenceNumber,
+                                                          self.serverSequenceNumber if flags & TCP_ACK else 0, flags, payload,
+                                                          self.clientIpIdentification))
+        self.clientSequenceNumber = (self.clientSequenceNumber + len(payload) + (1 if flags & (TCP_SYN | TCP_FIN) else 0)) & 0xFFFFFFFF
+        self.clientIpIdentification += 1
+
+    def writeServerPacket(self, timestamp, flags, payload=""):
+        """
+        Write a packet of the server and advance its sequence number.
+        :param timestamp: Capture time (seconds since epoch)
+        :param flags: TCP flags
+        :param payload: TCP payload (bytes)
+        """
+        self.writer.writePacket(timestamp, createTcpFrame(self.server, self.client, self.serverSequenceNumber, self.clientSequenceNumber,
+                                                          flags, payload, self.serverIpIdentification))
+        self.serverSequenceNumber = (self.serverSequenceNumber + len(payload) + (1 if flags & (TCP_SYN | TCP_FIN) else 0)) & 0xFFFFFFFF
+        self.serverIpIdentification += 1
+
+    def open(self, timestamp):
+        """
+        Write the three-way handshake.
+        :param timestamp: Capture time (seconds since epoch)
+        """
+        self.writeClientPacket(timestamp, TCP_SYN)
+        self.writeServerPacket(timestamp, TCP_SYN | TCP_ACK)
+        self.writeClientPacket(timestamp, TCP_ACK)
+
+    def send(self, timestamp, payload):
+        """
+        Write a data segment of the client and the acknowledgement of the server.
+        :param timestamp: Capture time (seconds since epoch)
+        :param payload: TCP payload (bytes)
+        """
+        self.writeClientPacket(timestamp, TCP_PSH | TCP_ACK, payload)
+        self.writeServerPacket(timestamp, TCP_ACK)
+
+    def close(self, timestamp):
+        """
+        Write the connection teardown (initiated by the client).
+        :param timestamp: Capture time (seconds since epoch)
+        """
+        self.writeClientPacket(timestamp, TCP_FIN | TCP_ACK)
+        self.writeServerPacket(timestamp, TCP_FIN | TCP_ACK)
+        self.writeClientPacket(timestamp, TCP_ACK)
@@ -0,0 +1,154 @@
+#!/usr/bin/python
+# -*- coding: utf-8 -*-
+'''
+
+This traffic generator writes pcapng traffic dumps of scenarios directly (no server, no tcpdump, no root privileges).
+The APDUs of the scenario events are framed into an emulated TCP connection (see PcapngWriter.py).
+Packets get virtual timestamps: SEND_INTERVAL seconds between APDUs and the duration of every WAIT event,
+so the captures have the same timing as captures of the live traffic generation but are created within milliseconds.
+Batch mode writes the captures of all scenario cases in parallel worker processes together with a manifest (JSON)
+of the generated files and their SHA-256 checksums.
+'''
+import datetime
+import hashlib
+import json
+import os
+import sys
+import time
+from multiprocessing import Pool, cpu_count
+
+from GenerateScenarioTrafficExtended import createAPDU, getScenarioFilenames, loadRtuTags, SEND_INTERVAL
+from PcapngWriter import PcapngWriter, TcpSession
+from ScenarioFiles import iterScenarioEvents
+from TrafficConstants import SERVER_PORT
+
+SYNTHETIC_TRAFFIC_PATH = "/tmp/traffic/"
+SYNTHETIC_START_TIME = time.mktime(datetime.datetime(2018, 3, 2, 9, 40, 44).timetuple())
+SYNTHETIC_CLIENT = ("127.0.0.1", 35808)
+SYNTHETIC_SERVER = ("127.0.0.1", SERVER_PORT)
+SYNTHETIC_CASES = [("Masterthesis_GlobalKnowledge", range(1, 9 + 1)),
+                   ("Alpha_GlobalKnowledge", range(1, 8 + 1)),
+                   ("Alpha_LocalKnowledge", range(1, 3 + 1))]
+SYNTHETIC_WORKERS = cpu_count()
+MANIFEST_FILENAME = "manifest.json"
+CHECKSUM_BLOCK_SIZE = 1 << 20
+
+
+def getCaptureFilename(caseName, caseNumber, normalized, path=SYNTHETIC_TRAFFIC_PATH):
+    """
+    Return the filename of the capture of a scenario (same names as AutomaticTrafficGeneration.py).
+    :param caseName: Scenario case
+    :param caseNumber: Scenario number of case
+    :param normalized: normalized (True) or float (False) values
+    :param path: Directory of captures
+    :return: Path to capture
+    """
+    if normalized:
+        return os.path.join(path, "%s_Normalized_Scenario%d.pcapng" % (caseName, caseNumber))
+    return os.path.join(path, "%s_Scenario%d.pcapng" % (caseName, caseNumber))
+
+
+def synthesizeCapture(caseName, caseNumber, normalized, path=SYNTHETIC_TRAFFIC_PATH, startTime=SYNTHETIC_START_TIME):
+    """
+    Write the capture of a scenario (base case and scenario file in one TCP connection).
+    :param caseName: Scenario case
+    :param caseNumber: Scenario number of case
+    :param normalized: normalized (True) or float (False) values
+    :param path: Directory of captures
+    :param startTime: Virtual time of first packet (seconds since epoch)
+    :return: Path to capture
+    """
+    rtuTags = loadRtuTags(caseName, normalized)
+    filename = getCaptureFilename(caseName, caseNumber, normalized, path)
+    writer = PcapngWriter(filename)
+    try:
+        session = TcpSession(writer, SYNTHETIC_CLIENT, SYNTHETIC_SERVER)
+        virtualTime = startTime
+        session.open(virtualTime)
+        for scenarioFilename in getScenarioFilenames(caseName, caseNumber):
+            for event in iterScenarioEvents(scenarioFilename):
+                if event.eventType == "MEASUREMENT" or event.eventType == "COMMAND" or event.eventType == "C102":
+                    apdu = createAPDU(rtuTags, event.eventType, event.key, event.value if event.eventType != "C102" else 0.0,
+                                      datetime.datetime.fromtimestamp(virtualTime))
+                    session.send(virtualTime, apdu.toBytes())
+                    virtualTime += SEND_INTERVAL
+                elif event.eventType == "WAIT":
+                    virtualTime += event.value
+        session.close(virtualTime)
+    finally:
+        writer.close()
+    return filename
+
+
+def getFileChecksum(filename):
+    """
+    Calculate the SHA-256 checksum of a file.
+    :param filename: Path to file
+    :return: Checksum (hex string)
+    """
+    checksum = hashlib.sha256()
+    with open(filename, "rb") as f:
+        block = f.read(CHECKSUM_BLOCK_SIZE)
+        while block:
+            checksum.update(block)
+            block = f.read(CHECKSUM_BLOCK_SIZE)
+    return checksum.hexdigest()
+
+
+def synthesizeTask(task):
+    """
+    Write the capture of a scenario in a worker process.
+    :param task: (case name, scenario number, normalized, directory of captures) tuple
+    :return: Manifest entry of the capture (dictionary)
+    """
+    caseName, caseNumber, normalized, path = task
+    filename = synthesizeCapture(caseName, caseNumber, normalized, path)
+    print "Finished with Case %s Scenario %d" % (caseName, caseNumber)
+    return {"file": os.path.basename(filename), "case": caseName, "scenario": caseNumber, "normalized": normalized,
+            "size": os.path.getsize(filename), "sha256": getFileChecksum(filename)}
+
+
+def writeManifest(entries, path=SYNTHETIC_TRAFFIC_PATH):
+    """
+    Write the manifest of generated captures (sorted by filename).
+    :param entries: List of manifest entries (see synthesizeTask)
+    :param path: Directory of captures
+    :return: Path to manifest
+    """
+    filename = os.path.join(path, MANIFEST_FILENAME)
+    with open(filename, "w") as f:
+        json.dump(sorted(entries, key=lambda e: e["file"]), f, indent=2, sort_keys=True)
+        f.write("\n")
+    return filename
+
+
+def synthesizeCaptures(cases=SYNTHETIC_CASES, path=SYNTHETIC_TRAFFIC_PATH, workers=SYNTHETIC_WORKERS):
+    """
+    Write the captures of several scenario cases (normalized and float values) in parallel and the manifest.
+    :param cases: List of (case name, list of scenario numbers) tuples
+    :param path: Directory of captures
+    :param workers: Number of worker processes (1: no worker processes)
+    :return: List of paths to captures
+    """
+    if not os.path.exists(path):
+        os.makedirs(path)
+    tasks = [(caseName, caseNumber, normalized, path) for normalized in [True, False] for caseName, caseNumbers in cases for caseNumber in caseNumbers]
+    if workers == 1:
+        entries = map(synthesizeTask, tasks)
+    else:
+        pool = Pool(min(workers, len(tasks)))
+        try:
+            entries = pool.map(synthesizeTask, tasks)
+        finally:
+            pool.close()
+            pool.join()
+    writeManifest(entries, path)
+    return [os.path.join(path, entry["file"]) for entry in entries]
+
+
+if __name__ == '__main__':
+    start = time.time()
+    workers = int(sys.argv[1]) if len(sys.argv) > 1 else SYNTHETIC_WORKERS
+    path = sys.argv[2] if len(sys.argv) > 2 else SYNTHETIC_TRAFFIC_PATH
+    filenames = synthesizeCaptures(path=path, workers=workers)
+    print "Generated %d captures in %.2fs" % (len(filenames), time.time() - start)